@@ -1,12 +1,16 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from database import SessionLocal
+from database import SessionLocal, get_async_db
 from models import User
+from profiling import phase
 from schemas import UserCreate, UserLogin
 
 # Secret key for JWT
@@ -14,6 +18,9 @@ SECRET_KEY = "your_secret_key_here"  # Ensure this is the same across your backe
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Comma-separated usernames allowed to use admin/analyst endpoints
+ADMIN_USERNAMES = {u.strip() for u in os.getenv("ADMIN_USERNAMES", "").split(",") if u.strip()}
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 router = APIRouter()
 
@@ -29,11 +36,13 @@ def get_db():
 
 def hash_password(password: str) -> str:
     """Hash the password before storing it."""
-    return pwd_context.hash(password)
+    with phase("auth"):
+        return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against the stored hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    with phase("auth"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Generate a JWT access token."""
@@ -60,30 +69,40 @@ def verify_access_token(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
 
 # 🟢 NEW FUNCTION: Get the current authenticated user
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     """Retrieve the authenticated user from the JWT token."""
-    token_data = verify_access_token(token)
-    username: str = token_data.get("sub")
+    with phase("auth"):
+        token_data = verify_access_token(token)
+        username: str = token_data.get("sub")
 
-    if not username:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication token")
+        if not username:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication token")
 
-    user = db.query(User).filter(User.username == username).first()
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalars().first()
 
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
     return user
 
+def require_admin(user: User = Depends(get_current_user)):
+    """Allow only users listed in ADMIN_USERNAMES."""
+    if user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return user
+
 # 🟢 SIGNUP ROUTE
 @router.post("/signup")
-def signup(user: UserCreate, db: Session = Depends(get_db)):
+async def signup(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Registers a new user."""
-    existing_user = db.query(User).filter((User.username == user.username) | (User.email == user.email)).first()
+    result = await db.execute(select(User).where((User.username == user.username) | (User.email == user.email)))
+    existing_user = result.scalars().first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Username or Email already taken")
 
-    hashed_password = hash_password(user.password)
+    # bcrypt is CPU-bound, keep it off the event loop
+    hashed_password = await run_in_threadpool(hash_password, user.password)
 
     new_user = User(
         fullname=user.fullname,
@@ -93,17 +112,17 @@ def signup(user: UserCreate, db: Session = Depends(get_db)):
     )
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
 
     return {"message": "User created successfully"}
 
 # 🔵 LOGIN ROUTE
 @router.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
+async def login(user: UserLogin, db: AsyncSession = Depends(get_async_db)):
     """Authenticates user and returns JWT token."""
-    existing_user = db.query(User).filter(User.username == user.username).first()
-    if not existing_user or not verify_password(user.password, existing_user.password):
+    result = await db.execute(select(User).where(User.username == user.username))
+    existing_user = result.scalars().first()
+    if not existing_user or not await run_in_threadpool(verify_password, user.password, existing_user.password):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
     # Generate JWT token
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from models import User
-from auth import hash_password, verify_password, create_access_token, verify_access_token
+from auth import hash_password, verify_password, create_access_token, verify_access_token, require_admin
+from bulk_signup import bulk_create_users, BULK_FORMATS
+from sharding import claim_emails, release_emails
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -22,40 +27,48 @@ class LoginRequest(BaseModel):
     password: str
 
 @router.post("/signup")
-def signup(user_data: SignupRequest, db: Session = Depends(get_db)):
+async def signup(user_data: SignupRequest, db: AsyncSession = Depends(get_async_db)):
     """Registers a new user."""
     # Check if user already exists
-    existing_user = db.query(User).filter(User.username == user_data.username).first()
+    result = await db.execute(select(User).where(User.username == user_data.username))
+    existing_user = result.scalars().first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already taken")
 
-    # Check if email is already in use
-    existing_email = db.query(User).filter(User.email == user_data.email).first()
-    if existing_email:
+    # Claim the email (case-insensitively) in the primary's index first: users.email is only unique per shard
+    claim = [(user_data.email, user_data.username)]
+    if user_data.email.lower() not in await run_in_threadpool(claim_emails, claim):
         raise HTTPException(status_code=400, detail="Email already in use")
 
-    # Hash the password
-    hashed_password = hash_password(user_data.password)
+    try:
+        # Hash the password (bcrypt is CPU-bound, keep it off the event loop)
+        hashed_password = await run_in_threadpool(hash_password, user_data.password)
 
-    # Create new user
-    new_user = User(
-        fullname=user_data.fullname,
-        username=user_data.username,
-        email=user_data.email,
-        password=hashed_password
-    )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+        # Create new user
+        new_user = User(
+            fullname=user_data.fullname,
+            username=user_data.username,
+            email=user_data.email,
+            password=hashed_password
+        )
+        db.add(new_user)
+        await db.commit()
+    except IntegrityError:
+        await run_in_threadpool(release_emails, claim)
+        raise HTTPException(status_code=400, detail="Username already taken")  # A concurrent signup got there first
+    except BaseException:
+        await run_in_threadpool(release_emails, claim)
+        raise
 
     return {"message": "User registered successfully"}
 
 @router.post("/login")
-def login(credentials: LoginRequest, db: Session = Depends(get_db)):
+async def login(credentials: LoginRequest, db: AsyncSession = Depends(get_async_db)):
     """Authenticates user and returns JWT token."""
-    user = db.query(User).filter(User.username == credentials.username).first()
+    result = await db.execute(select(User).where(User.username == credentials.username))
+    user = result.scalars().first()
     
-    if not user or not verify_password(credentials.password, user.password):
+    if not user or not await run_in_threadpool(verify_password, credentials.password, user.password):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
     # Generate JWT token
@@ -72,7 +85,7 @@ def login(credentials: LoginRequest, db: Session = Depends(get_db)):
     }
 
 @router.get("/verify-token")
-def verify_token(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def verify_token(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     """Validates the provided JWT token."""
     try:
         payload = verify_access_token(token)
@@ -81,7 +94,8 @@ def verify_token(token: str = Depends(oauth2_scheme), db: Session = Depends(get_
 
         # Optional: Check if user still exists
         username = payload.get("sub")
-        user = db.query(User).filter(User.username == username).first()
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalars().first()
         if not user:
             raise HTTPException(status_code=401, detail="User no longer exists")
 
@@ -89,3 +103,17 @@ def verify_token(token: str = Depends(oauth2_scheme), db: Session = Depends(get_
 
     except Exception as e:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+@router.post("/bulk_signup")
+async def bulk_signup(request: Request, format: str = "csv", admin: User = Depends(require_admin)):
+    """
+    Creates accounts from a CSV or NDJSON request body (fullname, username, email, password).
+    Valid rows are created; the response lists every rejected row and why.
+    """
+    if format not in BULK_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format, use one of: {', '.join(BULK_FORMATS)}")
+    data = await request.body()
+    try:
+        return await run_in_threadpool(bulk_create_users, data, format)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,187 @@
+"""
+Micro-benchmarks for the functions on every request path, with regression gates.
+
+Each benchmark times one call with timeit (best of REPEATS runs, so machine
+noise inflates results less) and measures the peak memory traced by
+tracemalloc over ALLOC_CALLS calls. Fixtures are synthetic: FIXTURE_USERS users whose gap_analysis
+documents carry HISTORY_LENGTH answered questions and full mastery maps.
+
+    python benchmarks.py                      # run and print
+    python benchmarks.py --save               # run and store as the baseline
+    python benchmarks.py --check              # run and fail (exit 1) on regressions
+    python benchmarks.py --check --only elo   # just the benchmarks whose name contains "elo"
+
+Baselines are machine-specific: save one on the machine that runs --check.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+from types import SimpleNamespace
+
+from auth import create_access_token, verify_access_token
+from final_result import generate_career_prompt
+from gap_test import TOPICS, DIFFICULTY_RATINGS, elo_update, pick_question_for_rating
+from nontech_test import analyze_personality
+from technical_test import count_lines_of_code
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks_baseline.json")
+TIME_THRESHOLD = 0.25  # Allowed slowdown over baseline (25%)
+ALLOC_THRESHOLD = 0.10  # Allowed growth in bytes allocated per call (10%)
+REPEATS = 5
+ALLOC_CALLS = 200  # Calls per tracemalloc measurement
+RECHECKS = 2  # Re-measurements of a suspected regression before it's reported (filters out noisy runs)
+
+FIXTURE_USERS = 10_000
+HISTORY_LENGTH = 2_000
+QUESTION_BANK = 20_000
+
+# ----------------------- Fixtures -----------------------
+
+def make_gap_analysis(rng):
+    concepts = [f"{topic} concept {i}" for topic in TOPICS for i in range(5)]
+    return {
+        "topic_ratings": {topic: rng.randint(500, 1600) for topic in TOPICS},
+        "average_elo": rng.randint(500, 1600),
+        "prev_topics": [rng.choice(TOPICS) for _ in range(10)],
+        "answered_questions": rng.sample(range(QUESTION_BANK), HISTORY_LENGTH),
+        "concept_mastery": {c: {"attempts": rng.randint(1, 20), "correct": rng.randint(0, 10)} for c in concepts},
+    }
+
+
+def build_fixtures(seed=1):
+    rng = random.Random(seed)
+    # Distinct documents for a sample of users; the rest reuse them (their size, not their content, matters)
+    documents = [make_gap_analysis(rng) for _ in range(100)]
+    users = [documents[i % len(documents)] for i in range(FIXTURE_USERS)]
+    bank = [
+        SimpleNamespace(id=i, difficulty=rng.choice(list(DIFFICULTY_RATINGS)).capitalize(), topic=rng.choice(TOPICS))
+        for i in range(QUESTION_BANK)
+    ]
+    topic_questions = [q for q in bank if q.topic == TOPICS[0]]
+    code = "\n".join(
+        ("    " * (i % 4)) + f"value_{i} = compute(value_{i - 1}) + {i}" if i % 5 else "" for i in range(400)
+    )
+    responses = {q: rng.randint(1, 7) for q in range(1, 21)}
+    token = create_access_token({"sub": "bench_user"})
+    return SimpleNamespace(users=users, rng=rng, topic_questions=topic_questions, code=code,
+                           responses=responses, token=token, blob=json.dumps(users[0]))
+
+# ----------------------- Benchmarks -----------------------
+
+def benchmarks(fx):
+    """name -> zero-argument callable doing one representative call."""
+    ratings = [u["average_elo"] for u in fx.users]
+    counter = iter(range(10 ** 12))
+
+    def elo():
+        i = next(counter) % FIXTURE_USERS
+        return elo_update(ratings[i], 1200, i % 2 == 0)
+
+    def selection():
+        return pick_question_for_rating(fx.topic_questions, ratings[next(counter) % FIXTURE_USERS])
+
+    def answered_lookup():
+        # next_gap_question turns the history into a set on every call
+        return set(fx.users[next(counter) % FIXTURE_USERS]["answered_questions"])
+
+    return {
+        "elo_update": elo,
+        "pick_question_for_rating": selection,
+        "answered_history_set": answered_lookup,
+        "analyze_personality": lambda: analyze_personality(fx.responses),
+        "count_lines_of_code": lambda: count_lines_of_code(fx.code),
+        "generate_career_prompt": lambda: generate_career_prompt(1150, "INTJ", "adept"),
+        "jwt_encode": lambda: create_access_token({"sub": "bench_user"}),
+        "jwt_decode": lambda: verify_access_token(fx.token),
+        "gap_analysis_dumps": lambda: json.dumps(fx.users[next(counter) % FIXTURE_USERS]),
+        "gap_analysis_loads": lambda: json.loads(fx.blob),
+    }
+
+
+def measure(fn):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=REPEATS, number=number)) / number
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for _ in range(ALLOC_CALLS):
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ns_per_call": round(best * 1e9, 1), "peak_bytes": max(0, peak - before)}
+
+
+def compare(results, baseline, time_threshold, alloc_threshold):
+    """Regressions as (name, what, baseline value, new value)."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["ns_per_call"] > base["ns_per_call"] * (1 + time_threshold):
+            regressions.append((name, "ns_per_call", base["ns_per_call"], result["ns_per_call"]))
+        # Small absolute changes in allocation are noise (interned objects, free lists)
+        if result["peak_bytes"] > base["peak_bytes"] * (1 + alloc_threshold) + 1024:
+            regressions.append((name, "peak_bytes", base["peak_bytes"], result["peak_bytes"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hot-path micro-benchmarks.")
+    parser.add_argument("--save", action="store_true", help="store results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 if anything regressed against the baseline")
+    parser.add_argument("--only", help="run only benchmarks whose name contains this")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--time-threshold", type=float, default=TIME_THRESHOLD)
+    parser.add_argument("--alloc-threshold", type=float, default=ALLOC_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    fixtures = build_fixtures()
+    results = {}
+    for name, fn in benchmarks(fixtures).items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(fn)
+        print(f"{name:28} {results[name]['ns_per_call']:>14,.1f} ns/call {results[name]['peak_bytes']:>12,} B peak")
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --save first")
+            return 1
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        suites = benchmarks(fixtures)
+        regressions = compare(results, baseline, args.time_threshold, args.alloc_threshold)
+        for _ in range(RECHECKS):
+            if not regressions:
+                break
+            for name in {r[0] for r in regressions}:
+                again = measure(suites[name])
+                results[name] = {key: min(results[name][key], again[key]) for key in again}
+            regressions = compare(results, baseline, args.time_threshold, args.alloc_threshold)
+        for name, what, before, after in regressions:
+            print(f"REGRESSION {name}: {what} {before:,} -> {after:,}")
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Bulk account creation from CSV or NDJSON (fullname, username, email, password per row).
+
+Rows are validated up front. Duplicates within the file and against existing
+users are found with set-based IN queries, one per BULK_LOOKUP_CHUNK rows.
+Passwords are bcrypt-hashed in parallel across a process pool, and users are
+inserted BULK_INSERT_BATCH at a time, one transaction each, on their own
+shard (existing usernames and emails are looked up on every shard). Each
+batch first claims its emails in the primary's user_emails index, so a
+signup that lands between the lookup and the insert can't leave two users
+with one email. Every rejected row comes back with its row number and
+reason; valid rows are created regardless.
+
+    python bulk_signup.py students.csv
+    python bulk_signup.py students.ndjson --format ndjson
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from auth import hash_password
+from database import shard_engines
+from models import User
+from sharding import claim_emails, create_email_index, release_emails, shard_for
+
+BULK_FORMATS = ("csv", "ndjson")
+REQUIRED_FIELDS = ("fullname", "username", "email", "password")
+BULK_LOOKUP_CHUNK = 400  # Usernames + emails per IN query, under SQLite's bound-parameter limit
+BULK_INSERT_BATCH = 1000
+BULK_MAX_ROWS = 50000
+HASH_WORKERS = int(os.getenv("BULK_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Forking the API (threads, an event loop, open SQLite handles) isn't safe; workers start from a clean process
+HASH_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+
+def parse_rows(data: bytes, fmt: str):
+    """(row number, dict) pairs; the CSV header is row 1, so data starts at row 2."""
+    text = data.decode("utf-8-sig")
+    if fmt == "csv":
+        return [(number, row) for number, row in enumerate(csv.DictReader(io.StringIO(text)), start=2)]
+    rows = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            rows.append((number, json.loads(line)))
+        except json.JSONDecodeError as e:
+            rows.append((number, {"_error": f"Invalid JSON: {e.msg}"}))
+    return rows
+
+
+def validate_rows(rows):
+    """Split rows into candidates and errors (missing fields, duplicates within the file)."""
+    candidates, errors = [], []
+    seen_usernames, seen_emails = set(), set()
+    for number, row in rows:
+        if not isinstance(row, dict) or "_error" in row:
+            errors.append({"row": number, "error": row.get("_error", "Not an object") if isinstance(row, dict) else "Not an object"})
+            continue
+        values = {field: str(row.get(field) or "").strip() for field in REQUIRED_FIELDS}
+        values["password"] = str(row.get("password") or "")  # Passwords aren't trimmed
+        missing = [field for field in REQUIRED_FIELDS if not values[field]]
+        if missing:
+            errors.append({"row": number, "username": values["username"], "error": f"Missing {', '.join(missing)}"})
+        elif "@" not in values["email"]:
+            errors.append({"row": number, "username": values["username"], "error": "Invalid email"})
+        elif values["username"] in seen_usernames:
+            errors.append({"row": number, "username": values["username"], "error": "Duplicate username in file"})
+        elif values["email"].lower() in seen_emails:
+            errors.append({"row": number, "username": values["username"], "error": "Duplicate email in file"})
+        else:
+            seen_usernames.add(values["username"])
+            seen_emails.add(values["email"].lower())
+            candidates.append((number, values))
+    return candidates, errors
+
+
+def find_existing(conn, candidates):
+    """Usernames and emails (lower-cased) already taken, via chunked set-based lookups."""
+    taken_usernames, taken_emails = set(), set()
+    for start in range(0, len(candidates), BULK_LOOKUP_CHUNK // 2):
+        chunk = [values for _, values in candidates[start:start + BULK_LOOKUP_CHUNK // 2]]
+        result = conn.execute(
+            select(User.username, User.email).where(or_(
+                User.username.in_([v["username"] for v in chunk]),
+                func.lower(User.email).in_([v["email"].lower() for v in chunk]),
+            ))
+        )
+        for username, email in result:
+            taken_usernames.add(username)
+            taken_emails.add(email.lower())
+    return taken_usernames, taken_emails
+
+
+def hash_pool():
+    """One process pool for every upload, started on first use."""
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS,
+                                             mp_context=multiprocessing.get_context(HASH_START_METHOD))
+        return _hash_pool
+
+
+def hash_passwords(passwords):
+    """bcrypt in parallel across processes (it's CPU-bound and holds the GIL)."""
+    if len(passwords) < 2 or HASH_WORKERS < 2:
+        return [hash_password(p) for p in passwords]
+    return list(hash_pool().map(hash_password, passwords, chunksize=max(1, len(passwords) // (HASH_WORKERS * 4))))
+
+
+def insert_batch(conn, batch, errors):
+    """
+    Claim the batch's emails, then insert the rows that got theirs in one transaction; on a
+    conflict (a concurrent signup), retry row by row. Rows that aren't created give their claim back.
+    """
+    claimed = claim_emails([(values["email"], values["username"]) for _, values in batch])
+    ready = []
+    for number, values in batch:
+        if values["email"].lower() in claimed:
+            ready.append((number, values))
+        else:
+            errors.append({"row": number, "username": values["username"], "error": "Email already in use"})
+    if not ready:
+        return 0
+
+    try:
+        with conn.begin():
+            conn.execute(insert(User), [values for _, values in ready])
+        return len(ready)
+    except IntegrityError:
+        pass
+    except BaseException:
+        release_emails([(values["email"], values["username"]) for _, values in ready])
+        raise
+    created = 0
+    for number, values in ready:
+        try:
+            with conn.begin():
+                conn.execute(insert(User), [values])
+            created += 1
+        except IntegrityError:
+            release_emails([(values["email"], values["username"])])
+            errors.append({"row": number, "username": values["username"], "error": "Username already taken"})
+    return created
+
+
+def bulk_create_users(data: bytes, fmt: str):
+    """Create every valid account in `data`; returns counts and a per-row error report."""
+    rows = parse_rows(data, fmt)
+    if len(rows) > BULK_MAX_ROWS:
+        raise ValueError(f"At most {BULK_MAX_ROWS} rows per upload")
+    candidates, errors = validate_rows(rows)
+
+    taken_usernames, taken_emails = set(), set()
+    for shard_engine in shard_engines.values():
+        with shard_engine.connect() as conn:
+            usernames, emails = find_existing(conn, candidates)
+            taken_usernames |= usernames
+            taken_emails |= emails
+    accepted = []
+    for number, values in candidates:
+        if values["username"] in taken_usernames:
+            errors.append({"row": number, "username": values["username"], "error": "Username already taken"})
+        elif values["email"].lower() in taken_emails:
+            errors.append({"row": number, "username": values["username"], "error": "Email already in use"})
+        else:
+            accepted.append((number, values))
+
+    hashes = hash_passwords([values["password"] for _, values in accepted])
+    by_shard = {}
+    for (number, values), hashed in zip(accepted, hashes):
+        values["password"] = hashed
+        by_shard.setdefault(str(shard_for(values["username"])), []).append((number, values))
+
+    created = 0
+    for shard_id, rows_for_shard in by_shard.items():
+        with shard_engines[shard_id].connect() as conn:
+            for start in range(0, len(rows_for_shard), BULK_INSERT_BATCH):
+                created += insert_batch(conn, rows_for_shard[start:start + BULK_INSERT_BATCH], errors)
+
+    errors.sort(key=lambda e: e["row"])
+    return {"rows": len(rows), "created": created, "failed": len(errors), "errors": errors}
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="Create user accounts in bulk.")
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=BULK_FORMATS, help="default: from the file extension")
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.file.endswith((".ndjson", ".jsonl")) else "csv")
+    create_email_index()  # The API does this at startup; this may run before it ever has
+    with open(args.file, "rb") as file:
+        started = time.perf_counter()
+        report = bulk_create_users(file.read(), fmt)
+    print(f"Created {report['created']} of {report['rows']} users in {time.perf_counter() - started:.1f}s")
+    for error in report["errors"]:
+        print(f"  row {error['row']}: {error.get('username', '')} {error['error']}")
@@ -0,0 +1,389 @@
+"""
+Cache shared by the routers: namespaced keys, TTLs, versioned invalidation and single-flight loads.
+
+Backends (CACHE_BACKEND):
+  - "local" (default): an in-process LRU. Each worker has its own copy, and
+    invalidations from other processes (scripts, other workers) never reach
+    it, so only the TTL bounds staleness there.
+  - "redis": any server speaking the Redis protocol at CACHE_URL. That can be
+    Redis itself or the stand-in in cache_server.py. Every worker shares one
+    copy, so adding workers adds hits instead of duplicating misses.
+
+Keys are "<namespace>:v<version>:<key>". Invalidating a namespace bumps its
+version, which orphans every old key; they age out through their TTL. On
+the shared backend the bump is an INCR plus a PUBLISH on the invalidation
+channel. Every worker listens on that channel and refreshes its copy of the
+version straight away. Versions are also re-read at least every
+VERSION_TTL_SECONDS, in case a message is missed.
+
+Single-flight: concurrent misses on one key within a worker wait for a
+single loader. On the shared backend a short SET NX lock does the same
+across workers. If the cache server is unreachable, reads count as misses
+and values load from the source.
+
+    ns = cache.namespace("tech_question", ttl=3600)
+    question = ns.get_or_load(question_id, lambda: load_from_db(question_id))
+    ns.invalidate()
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")  # "local" or "redis"
+CACHE_URL = os.getenv("CACHE_URL", "redis://127.0.0.1:6379/0")
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "nextstep")
+LOCAL_MAX_ENTRIES = int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", "10000"))
+DEFAULT_TTL_SECONDS = 300
+VERSION_TTL_SECONDS = 5
+LOCK_TTL_SECONDS = 5  # Longest a shared single-flight lock is held
+LOCK_POLL_SECONDS = 0.02
+SOCKET_TIMEOUT_SECONDS = 1.0
+INVALIDATION_CHANNEL = f"{CACHE_PREFIX}:invalidate"
+
+_MISSING = object()
+
+
+class CacheUnavailable(Exception):
+    """The shared cache server couldn't be reached or answered with an error."""
+
+# ----------------------- Backends -----------------------
+
+class LocalBackend:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at or None, value)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None, only_if_missing=False):
+        with self.lock:
+            if only_if_missing:
+                entry = self.entries.get(key)
+                if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                    return False
+            self.entries[key] = (time.monotonic() + ttl if ttl else None, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            value = int(self.entries.get(key, (None, b"0"))[1]) + 1
+            self.entries[key] = (None, str(value).encode())
+            return value
+
+    def publish(self, channel, message):
+        pass  # One process: nobody else to tell
+
+    def subscribe(self, channel, callback):
+        pass
+
+
+class RespConnection:
+    """One socket speaking RESP2 (the Redis wire protocol)."""
+
+    def __init__(self, host, port, db=0, timeout=SOCKET_TIMEOUT_SECONDS):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile("rb")
+        if db:
+            self.command("SELECT", db)
+
+    def send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.sock.sendall(b"".join(parts))
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Cache server closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise CacheUnavailable(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            return None if count < 0 else [self.read_reply() for _ in range(count)]
+        raise CacheUnavailable(f"Unexpected reply: {line!r}")
+
+    def command(self, *args):
+        self.send(*args)
+        return self.read_reply()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisBackend:
+    """Shared cache over RESP; one connection per thread."""
+
+    def __init__(self, url=CACHE_URL):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.strip("/") or 0)
+        self.local = threading.local()
+
+    def _command(self, *args):
+        connection = getattr(self.local, "connection", None)
+        try:
+            if connection is None:
+                connection = self.local.connection = RespConnection(self.host, self.port, self.db)
+            return connection.command(*args)
+        except (OSError, ConnectionError) as e:
+            if connection is not None:
+                connection.close()
+            self.local.connection = None
+            raise CacheUnavailable(str(e))
+
+    def get(self, key):
+        return self._command("GET", key)
+
+    def set(self, key, value, ttl=None, only_if_missing=False):
+        args = ["SET", key, value]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        if only_if_missing:
+            args.append("NX")
+        return self._command(*args) == "OK"
+
+    def delete(self, key):
+        self._command("DEL", key)
+
+    def incr(self, key):
+        return self._command("INCR", key)
+
+    def publish(self, channel, message):
+        self._command("PUBLISH", channel, message)
+
+    def subscribe(self, channel, callback):
+        """Call callback(message bytes) for every message on channel, from a daemon thread that reconnects."""
+
+        def listen():
+            while True:
+                try:
+                    connection = RespConnection(self.host, self.port, timeout=None)
+                    connection.command("SUBSCRIBE", channel)
+                    while True:
+                        reply = connection.read_reply()
+                        if isinstance(reply, list) and reply and reply[0] == b"message":
+                            callback(reply[2])
+                except Exception as e:
+                    logger.warning(f"cache invalidation listener disconnected ({e}); reconnecting")
+                    time.sleep(1)
+
+        threading.Thread(target=listen, name="cache-invalidation", daemon=True).start()
+
+# ----------------------- Cache -----------------------
+
+class Namespace:
+    def __init__(self, cache, name, ttl):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "waits": 0, "errors": 0}
+
+    def _key(self, key):
+        return f"{CACHE_PREFIX}:{self.name}:v{self.cache.version(self.name)}:{key}"
+
+    def get(self, key, default=None):
+        try:
+            data = self.cache.backend.get(self._key(key))
+        except CacheUnavailable:
+            self.stats["errors"] += 1
+            return default
+        if data is None:
+            return default
+        return json.loads(data)
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.cache.backend.set(self._key(key), json.dumps(value).encode(), ttl or self.ttl)
+        except CacheUnavailable:
+            self.stats["errors"] += 1
+
+    def delete(self, key):
+        try:
+            self.cache.backend.delete(self._key(key))
+        except CacheUnavailable:
+            self.stats["errors"] += 1
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Cached value, or loader()'s result stored for next time. One loader runs per key at a time."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.stats["hits"] += 1
+            return value
+        self.stats["misses"] += 1
+
+        full_key = self._key(key)
+        leader, flight = self.cache.join_flight(full_key)
+        if not leader:
+            self.stats["waits"] += 1
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = self._load_shared(key, full_key, loader, ttl)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self.cache.land_flight(full_key, flight)
+
+    def _load_shared(self, key, full_key, loader, ttl):
+        """Across workers: whoever takes the lock loads; the others wait for its result."""
+        lock_key = f"{full_key}:lock"
+        token = uuid.uuid4().hex.encode()
+        try:
+            locked = self.cache.backend.set(lock_key, token, LOCK_TTL_SECONDS, only_if_missing=True)
+        except CacheUnavailable:
+            self.stats["errors"] += 1
+            locked = True  # No shared cache: just load
+        if not locked:
+            deadline = time.monotonic() + LOCK_TTL_SECONDS
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_SECONDS)
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    self.stats["waits"] += 1
+                    return value
+            # The other loader died or is very slow: load anyway
+
+        self.stats["loads"] += 1
+        value = loader()
+        if value is not None:
+            self.set(key, value, ttl)
+        if locked:
+            try:
+                # Only our own lock: if loading outlasted LOCK_TTL_SECONDS, another worker may hold it by now
+                if self.cache.backend.get(lock_key) == token:
+                    self.cache.backend.delete(lock_key)
+            except CacheUnavailable:
+                pass
+        return value
+
+    def invalidate(self):
+        """Drop every key in the namespace, in every worker."""
+        try:
+            self.cache.bump_version(self.name)
+        except CacheUnavailable as e:
+            logger.warning(f"cache namespace {self.name} not invalidated ({e}); entries expire within {self.ttl}s")
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Cache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.namespaces = {}
+        self.versions = {}  # namespace -> (version, read at)
+        self.flights = {}
+        self.lock = threading.Lock()
+        backend.subscribe(INVALIDATION_CHANNEL, self._on_invalidation)
+
+    def namespace(self, name, ttl=DEFAULT_TTL_SECONDS):
+        with self.lock:
+            if name not in self.namespaces:
+                self.namespaces[name] = Namespace(self, name, ttl)
+            return self.namespaces[name]
+
+    def version(self, name):
+        cached = self.versions.get(name)
+        if cached is not None and time.monotonic() - cached[1] < VERSION_TTL_SECONDS:
+            return cached[0]
+        try:
+            version = int(self.backend.get(f"{CACHE_PREFIX}:{name}:version") or 0)
+        except CacheUnavailable:
+            return cached[0] if cached else 0
+        self.versions[name] = (version, time.monotonic())
+        return version
+
+    def bump_version(self, name):
+        version = self.backend.incr(f"{CACHE_PREFIX}:{name}:version")
+        self.versions[name] = (version, time.monotonic())
+        self.backend.publish(INVALIDATION_CHANNEL, json.dumps({"namespace": name, "version": version}))
+        return version
+
+    def _on_invalidation(self, message):
+        data = json.loads(message)
+        current = self.versions.get(data["namespace"])
+        if current is None or current[0] < data["version"]:
+            self.versions[data["namespace"]] = (data["version"], time.monotonic())
+
+    def join_flight(self, key):
+        """(True, flight) for the first caller of a key; (False, flight) for the ones that should wait."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return False, flight
+            flight = self.flights[key] = _Flight()
+            return True, flight
+
+    def land_flight(self, key, flight):
+        with self.lock:
+            self.flights.pop(key, None)
+        flight.done.set()
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "namespaces": {name: {**ns.stats, "version": self.versions.get(name, (0,))[0]}
+                           for name, ns in self.namespaces.items()},
+        }
+
+
+def build_cache():
+    if CACHE_BACKEND == "redis":
+        return Cache(RedisBackend(CACHE_URL))
+    return Cache(LocalBackend())
+
+
+cache = build_cache()
@@ -0,0 +1,135 @@
+"""
+Stand-in for Redis, speaking enough of RESP2 for cache.py.
+
+Commands: PING, SELECT, GET, SET (EX/PX/NX), DEL, INCR, EXPIRE, FLUSHALL,
+PUBLISH, SUBSCRIBE. Data lives in memory in one process and every
+connection shares it. That is enough to run several uvicorn workers against
+CACHE_BACKEND=redis locally or in CI without installing Redis. Production
+should use a real Redis.
+
+    python cache_server.py --port 6379
+"""
+import argparse
+import asyncio
+import time
+
+
+class CacheServer:
+    def __init__(self):
+        self.data = {}  # key -> (expires_at or None, bytes)
+        self.subscribers = {}  # channel -> set of writers
+
+    def _get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry[1]
+
+    def execute(self, args, writer):
+        name = args[0].upper().decode()
+        if name == "PING":
+            return "+PONG"
+        if name == "SELECT":
+            return "+OK"  # One keyspace
+        if name == "GET":
+            return self._get(args[1])
+        if name == "SET":
+            key, value, options = args[1], args[2], [a.upper() for a in args[3:]]
+            expires_at = None
+            if b"PX" in options:
+                expires_at = time.monotonic() + int(args[3 + options.index(b"PX") + 1]) / 1000
+            elif b"EX" in options:
+                expires_at = time.monotonic() + int(args[3 + options.index(b"EX") + 1])
+            if b"NX" in options and self._get(key) is not None:
+                return None
+            self.data[key] = (expires_at, value)
+            return "+OK"
+        if name == "DEL":
+            return sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+        if name == "INCR":
+            current = self._get(args[1])
+            value = int(current or 0) + 1
+            expires_at = self.data[args[1]][0] if current is not None else None
+            self.data[args[1]] = (expires_at, str(value).encode())
+            return value
+        if name == "EXPIRE":
+            current = self._get(args[1])
+            if current is None:
+                return 0
+            self.data[args[1]] = (time.monotonic() + int(args[2]), current)
+            return 1
+        if name == "FLUSHALL":
+            self.data.clear()
+            return "+OK"
+        if name == "PUBLISH":
+            listeners = self.subscribers.get(args[1], set())
+            for listener in list(listeners):
+                listener.write(encode([b"message", args[1], args[2]]))
+            return len(listeners)
+        if name == "SUBSCRIBE":
+            for count, channel in enumerate(args[1:], start=1):
+                self.subscribers.setdefault(channel, set()).add(writer)
+                writer.write(encode([b"subscribe", channel, count]))
+            return ...  # Replies already written
+        return f"-ERR unknown command '{name}'"
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                args = await read_command(reader)
+                if args is None:
+                    break
+                reply = self.execute(args, writer) if args else "-ERR empty command"
+                if reply is not ...:
+                    writer.write(encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for listeners in self.subscribers.values():
+                listeners.discard(writer)
+            writer.close()
+
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.split()  # Inline command (e.g. typed into telnet)
+    args = []
+    for _ in range(int(line[1:])):
+        length = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+def encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, str):  # Pre-formatted status or error line
+        return value.encode() + b"\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+
+
+async def serve(host, port):
+    server = CacheServer()
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"Cache server listening on {host}:{port}")
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Minimal Redis-protocol cache server for local runs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
@@ -0,0 +1,256 @@
+"""
+Negotiated response compression and pre-compressed static serving of the React build.
+
+CompressionMiddleware compresses compressible responses of at least
+COMPRESS_MIN_BYTES with brotli (if the brotli package is installed and the
+client accepts it) or gzip. Streamed responses such as the exports are
+compressed chunk by chunk and flushed after each chunk, so they keep
+streaming. Responses that already carry a Content-Encoding pass through.
+
+FrontendFiles serves a `npm run build` output directory (FRONTEND_BUILD_DIR
+in main.py):
+  - A .br or .gz file prepared next to an asset is sent in its place when
+    the client accepts that encoding, so nothing is compressed per request.
+  - Content-hashed filenames (CRA's main.1a2b3c4d.js) are cached for a year
+    as immutable. Everything else (index.html, manifest) is revalidated on
+    every load, so a deploy shows up immediately.
+  - Unknown paths that ask for HTML get index.html, for client-side routes.
+
+    python compression.py precompress ../frontend/build
+"""
+import argparse
+import mimetypes
+import os
+import re
+import zlib
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6  # Per-response: speed matters more than the last few percent
+BROTLI_QUALITY = 5
+PRECOMPRESS_GZIP_LEVEL = 9  # Build time: spend the CPU once
+PRECOMPRESS_BROTLI_QUALITY = 11
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/x-ndjson",
+                      "application/xml", "application/manifest+json", "image/svg+xml")
+PRECOMPRESS_EXTENSIONS = (".html", ".js", ".css", ".json", ".map", ".svg", ".txt", ".xml", ".ico")
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.")  # main.1a2b3c4d.js, 453.9f8e7d6c.chunk.js
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+
+def accepted_encodings(header: str):
+    """Encodings an Accept-Encoding header allows (q > 0)."""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            accepted.add(name.strip().lower())
+    if "*" in accepted:
+        accepted |= {"br", "gzip"}
+    return accepted
+
+
+def choose_encoding(header: str):
+    accepted = accepted_encodings(header)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def is_compressible(content_type: str):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+# ----------------------- Dynamic responses -----------------------
+
+class _Compressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self.engine = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.engine = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+
+    def chunk(self, data):
+        """Compress and flush, so the client can decode everything sent so far."""
+        if self.encoding == "br":
+            return self.engine.process(data) + self.engine.flush()
+        return self.engine.compress(data) + self.engine.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b""):
+        if self.encoding == "br":
+            return self.engine.process(data) + self.engine.finish()
+        return self.engine.compress(data) + self.engine.flush()
+
+
+class CompressionMiddleware:
+    """ASGI middleware: brotli/gzip for compressible responses of at least `minimum_size` bytes."""
+
+    def __init__(self, app, minimum_size=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+        pending, pending_size = [], 0  # Body held until it's clear whether it reaches minimum_size
+
+        async def compressing_send(message):
+            nonlocal start, compressor, passthrough, pending_size
+            if message["type"] == "http.response.start":
+                start = message
+                headers = MutableHeaders(raw=start["headers"])
+                if not is_compressible(headers.get("content-type", "")) or "content-encoding" in headers \
+                        or start["status"] in (204, 304):
+                    passthrough = True
+                    await send(start)
+                else:
+                    headers.add_vary_header("Accept-Encoding")
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if compressor is None:
+                # Middleware like BaseHTTPMiddleware re-sends every response in chunks, so buffer up to the threshold
+                pending.append(body)
+                pending_size += len(body)
+                if more_body and pending_size < self.minimum_size:
+                    return
+                body = b"".join(pending)
+                pending.clear()
+                if not more_body and pending_size < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+                compressor = _Compressor(encoding)
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = encoding
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag  # Same content, different bytes
+                if not more_body:
+                    body = compressor.finish(body)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                await send(start)
+
+            data = compressor.chunk(body) if more_body else compressor.finish(body)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, compressing_send)
+
+# ----------------------- Static frontend -----------------------
+
+class FrontendFiles(StaticFiles):
+    """StaticFiles for a built SPA: pre-compressed variants, immutable hashed assets, index.html fallback."""
+
+    def __init__(self, directory):
+        super().__init__(directory=directory, html=True)
+
+    async def get_response(self, path, scope):
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as exc:
+            if exc.status_code != 404 or "text/html" not in Headers(scope=scope).get("accept", ""):
+                raise
+        # A client-side route (e.g. /dashboard): the app's router takes it from index.html
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, "index.html")
+        if stat_result is None:
+            raise HTTPException(status_code=404)
+        return self.file_response(full_path, stat_result, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        served_path, served_stat, encoding = full_path, stat_result, None
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for candidate in ("br", "gzip"):
+            if candidate in accepted:
+                try:
+                    variant_stat = os.stat(str(full_path) + ENCODING_SUFFIXES[candidate])
+                except OSError:
+                    continue
+                served_path, served_stat, encoding = str(full_path) + ENCODING_SUFFIXES[candidate], variant_stat, candidate
+                break
+
+        name = os.path.basename(full_path)
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE if HASHED_NAME.search(name) else "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        response = FileResponse(served_path, status_code=status_code, stat_result=served_stat, headers=headers,
+                                media_type=mimetypes.guess_type(name)[0])
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def precompress(directory, minimum_size=COMPRESS_MIN_BYTES):
+    """Write .gz (and .br, with brotli installed) next to every compressible build file; returns (files, bytes saved)."""
+    files, saved = 0, 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if not name.endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as file:
+                data = file.read()
+            if len(data) < minimum_size:
+                continue
+            variants = {".gz": lambda d: zlib.compress(d, PRECOMPRESS_GZIP_LEVEL, wbits=31)}
+            if brotli is not None:
+                variants[".br"] = lambda d: brotli.compress(d, quality=PRECOMPRESS_BROTLI_QUALITY)
+            for suffix, compress in variants.items():
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + suffix, "wb") as file:
+                    file.write(compressed)
+                saved += len(data) - len(compressed)
+            files += 1
+    return files, saved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-compress a frontend build for FrontendFiles.")
+    parser.add_argument("command", choices=("precompress",))
+    parser.add_argument("directory")
+    args = parser.parse_args()
+
+    count, saved = precompress(args.directory)
+    encodings = "gzip + brotli" if brotli is not None else "gzip (install brotli for .br files)"
+    print(f"Pre-compressed {count} files with {encodings}, {saved / 1024:.0f} KiB smaller in total")
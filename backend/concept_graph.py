@@ -0,0 +1,147 @@
+"""
+Prerequisite graph over the gap-test concepts.
+
+Every gap question is tagged with its concept (the `prerequisite` /
+`prerequisites` field of gap_questions/*.json). Within a topic, concepts are
+listed in teaching order: each block of questions builds on the concepts
+before it. The graph therefore links each concept to the concept before it in
+its topic. A file can also declare extra edges as a top-level
+"concept_prerequisites": {concept: [prerequisite, ...]} mapping.
+
+The graph is built once per process from the question table (init_db.py
+builds it at load time to validate it) and cached.
+"""
+import json
+import os
+from collections import deque
+
+from sqlalchemy import select
+
+from models import GapTestQuestion
+
+GAP_QUESTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gap_questions")
+MASTERED_THRESHOLD = 0.75  # Estimated mastery above which a prerequisite isn't worth probing
+
+
+def question_concepts(prerequisites):
+    """Concept tags of a question as stored in GapTestQuestion.prerequisites."""
+    if prerequisites is None:
+        return []
+    if isinstance(prerequisites, str):
+        try:
+            decoded = json.loads(prerequisites)
+        except json.JSONDecodeError:
+            decoded = prerequisites
+        prerequisites = decoded
+    if isinstance(prerequisites, list):
+        return [str(p) for p in prerequisites if p]
+    return [prerequisites] if prerequisites else []
+
+
+def concept_mastery(stats):
+    """Smoothed share of correct answers: 0.5 for an untested concept."""
+    if not stats:
+        return 0.5
+    return (stats.get("correct", 0) + 1) / (stats.get("attempts", 0) + 2)
+
+
+class ConceptGraph:
+    def __init__(self):
+        self.parents = {}  # concept -> [prerequisite concepts]
+        self.topic = {}  # concept -> topic
+        self.questions = {}  # concept -> [question ids]
+
+    @classmethod
+    def from_questions(cls, rows, extra_edges=None):
+        """rows: (id, topic, prerequisites) in load order."""
+        graph = cls()
+        last_in_topic = {}
+        for question_id, topic, prerequisites in rows:
+            for concept in question_concepts(prerequisites):
+                if concept not in graph.topic:
+                    graph.topic[concept] = topic
+                    previous = last_in_topic.get(topic)
+                    graph.parents[concept] = [previous] if previous else []
+                    last_in_topic[topic] = concept
+                graph.questions.setdefault(concept, []).append(question_id)
+        for concept, prerequisites in (extra_edges or {}).items():
+            if concept in graph.parents:
+                graph.parents[concept].extend(p for p in prerequisites if p in graph.topic and p not in graph.parents[concept])
+        graph.check_acyclic()
+        return graph
+
+    def check_acyclic(self):
+        state = {}
+
+        def visit(concept, path):
+            if state.get(concept) == "done":
+                return
+            if state.get(concept) == "visiting":
+                raise ValueError(f"Prerequisite cycle: {' -> '.join(path + [concept])}")
+            state[concept] = "visiting"
+            for parent in self.parents.get(concept, []):
+                visit(parent, path + [concept])
+            state[concept] = "done"
+
+        for concept in self.parents:
+            visit(concept, [])
+
+    def ancestors(self, concept):
+        """Prerequisites of a concept, nearest first."""
+        seen, order = {concept}, []
+        queue = deque(self.parents.get(concept, []))
+        while queue:
+            parent = queue.popleft()
+            if parent in seen:
+                continue
+            seen.add(parent)
+            order.append(parent)
+            queue.extend(self.parents.get(parent, []))
+        return order
+
+    def weakest_prerequisite(self, concept, mastery_stats, answered):
+        """
+        The prerequisite to probe after a miss on `concept`: lowest estimated mastery
+        (nearest on ties), skipping concepts already mastered or with no questions left.
+        """
+        best, best_score = None, None
+        for candidate in self.ancestors(concept):
+            score = concept_mastery(mastery_stats.get(candidate))
+            if score >= MASTERED_THRESHOLD:
+                continue
+            if not any(q not in answered for q in self.questions.get(candidate, [])):
+                continue
+            if best_score is None or score < best_score:
+                best, best_score = candidate, score
+        return best
+
+
+def load_extra_edges(directory=GAP_QUESTIONS_DIR):
+    edges = {}
+    if not os.path.isdir(directory):
+        return edges
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as file:
+                edges.update(json.load(file).get("concept_prerequisites", {}))
+    return edges
+
+
+_QUESTION_ROWS = select(GapTestQuestion.id, GapTestQuestion.topic, GapTestQuestion.prerequisites).order_by(GapTestQuestion.id)
+_graph = None
+
+
+def build_concept_graph(session):
+    """Build (and cache) the graph with a sync session; used by init_db.py at load time."""
+    global _graph
+    _graph = ConceptGraph.from_questions(session.execute(_QUESTION_ROWS).all(), load_extra_edges())
+    return _graph
+
+
+async def get_concept_graph(db):
+    """The cached graph, built from the question table on first use."""
+    global _graph
+    if _graph is None:
+        result = await db.execute(_QUESTION_ROWS)
+        _graph = ConceptGraph.from_questions(result.all(), load_extra_edges())
+    return _graph
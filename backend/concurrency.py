@@ -0,0 +1,78 @@
+import asyncio
+import random
+import logging
+import threading
+import time
+
+from fastapi import HTTPException
+from sqlalchemy.orm.exc import StaleDataError
+
+logger = logging.getLogger(__name__)
+
+# Compare-and-swap retry settings
+MAX_RETRIES = 5
+BASE_BACKOFF_SECONDS = 0.01  # Doubled on each retry, with full jitter
+
+# Per-operation counters: {operation: {"attempts": n, "conflicts": n, "exhausted": n}}
+_stats = {}
+_stats_lock = threading.Lock()
+
+def record(operation: str, field: str):
+    """Increment a conflict-tracking counter for an operation."""
+    with _stats_lock:
+        counters = _stats.setdefault(operation, {"attempts": 0, "conflicts": 0, "exhausted": 0})
+        counters[field] += 1
+
+def get_conflict_stats():
+    """Return a snapshot of attempt/conflict counts and conflict rates per operation."""
+    with _stats_lock:
+        return {
+            operation: {
+                **counters,
+                "conflict_rate": round(counters["conflicts"] / counters["attempts"], 4) if counters["attempts"] else 0.0,
+            }
+            for operation, counters in _stats.items()
+        }
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, BASE_BACKOFF_SECONDS * (2 ** attempt))
+
+def retry_sync(operation: str, attempt_fn, max_retries: int = MAX_RETRIES):
+    """
+    Run attempt_fn() until it reports success, for hand-written CAS updates.
+    attempt_fn returns (applied, result); applied=False means the version check lost the race.
+    """
+    for attempt in range(max_retries):
+        record(operation, "attempts")
+        applied, result = attempt_fn()
+        if applied:
+            return result
+        record(operation, "conflicts")
+        time.sleep(backoff_delay(attempt))
+
+    record(operation, "exhausted")
+    logger.warning(f"{operation}: gave up after {max_retries} conflicting attempts")
+    raise HTTPException(status_code=409, detail="Concurrent update detected, please retry")
+
+async def run_with_retry(db, operation: str, attempt_fn, max_retries: int = MAX_RETRIES):
+    """
+    Run `await attempt_fn()` followed by a commit, retrying on version conflicts.
+
+    attempt_fn must re-read whatever rows it modifies on every call; after a rollback
+    the session's objects are expired, so a fresh SELECT picks up the winning writer's state.
+    """
+    for attempt in range(max_retries):
+        record(operation, "attempts")
+        try:
+            result = await attempt_fn()
+            await db.commit()
+            return result
+        except StaleDataError:
+            record(operation, "conflicts")
+            await db.rollback()
+            await asyncio.sleep(backoff_delay(attempt))
+
+    record(operation, "exhausted")
+    logger.warning(f"{operation}: gave up after {max_retries} conflicting attempts")
+    raise HTTPException(status_code=409, detail="Concurrent update detected, please retry")
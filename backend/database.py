@@ -1,13 +1,39 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.horizontal_shard import ShardedSession
 from sqlalchemy.orm import sessionmaker
 
+from sharding import SHARD_COUNT, SHARD_IDS, shard_path, sharded_session_options
+
 DATABASE_URL = "sqlite:///./nextstep.db"  # ✅ Make sure this is correct
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./nextstep.db"  # Same file, driven by aiosqlite
 
+# Sync engine: still used by scripts such as init_db.py
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Async engine: used by the API routers so requests don't hold a threadpool thread while waiting on I/O
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+
+# One engine pair per user shard (see sharding.py); shard "0" is the primary above
+shard_engines = {"0": engine}
+async_shard_engines = {"0": async_engine}
+for shard_id in SHARD_IDS[1:]:
+    shard_engines[shard_id] = create_engine(f"sqlite:///./{shard_path(int(shard_id))}", connect_args={"check_same_thread": False})
+    async_shard_engines[shard_id] = create_async_engine(f"sqlite+aiosqlite:///./{shard_path(int(shard_id))}")
+
+if SHARD_COUNT == 1:
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+else:
+    # Sessions route each statement to the shards it concerns
+    SessionLocal = sessionmaker(class_=ShardedSession, autoflush=False, **sharded_session_options(shard_engines))
+    AsyncSessionLocal = async_sessionmaker(
+        class_=AsyncSession, sync_session_class=ShardedSession, autoflush=False, expire_on_commit=False,
+        **sharded_session_options({k: e.sync_engine for k, e in async_shard_engines.items()}),
+    )
+
 # ✅ This function should be in database.py
 def get_db():
     db = SessionLocal()
@@ -15,3 +41,18 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    """Yield an AsyncSession for use in async endpoints."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def ensure_column(table: str, column: str, ddl: str):
+    """Add a column to an existing table if it's missing (create_all won't alter existing tables), on every shard."""
+    for shard_engine in shard_engines.values():
+        inspector = inspect(shard_engine)
+        if table not in inspector.get_table_names():
+            continue
+        if column not in [c["name"] for c in inspector.get_columns(table)]:
+            with shard_engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
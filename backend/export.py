@@ -0,0 +1,235 @@
+"""
+Bulk export of every candidate's results as CSV, NDJSON or Parquet.
+
+Rows are read through a streaming cursor in batches of EXPORT_BATCH_SIZE and
+encoded one batch at a time, so memory stays flat regardless of the number
+of users. With several user shards, the shards are streamed side by side and
+merged by username. Available over HTTP (admin only) and as a CLI:
+
+    python export.py --format csv --output results.csv
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth import require_admin
+from database import get_async_db, SessionLocal
+from gap_test import TOPICS
+from models import User, CareerGuidance
+from guidance_store import decompress_guidance
+from results import decode_gap_analysis, decode_technical_test, decode_final_result
+from sharding import SHARD_COUNT, scatter_stream, merged_rows
+
+router = APIRouter(prefix="/export", tags=["Export"])
+
+EXPORT_BATCH_SIZE = 500
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+CSV_COLUMNS = (
+    ["username", "fullname", "email", "average_elo"]
+    + [f"rating: {topic}" for topic in TOPICS]
+    + ["solved", "milestone", "personality_type", "career_guidance"]
+)
+
+# Only the columns the export needs; password hashes never leave the database
+EXPORT_QUERY = select(
+    User.username, User.fullname, User.email, User.gap_analysis,
+    User.technical_test, User.non_technical_test, User.final_result,
+    CareerGuidance.codec.label("guidance_codec"), CareerGuidance.body.label("guidance_body"),
+).outerjoin(CareerGuidance, CareerGuidance.hash == User.career_guidance_hash) \
+    .order_by(User.username).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def user_record(row):
+    """Decode one user row's JSON result columns into a flat-ish export record."""
+    gap = decode_gap_analysis(row.gap_analysis) or {}
+    tech = decode_technical_test(row.technical_test) or {}
+    final = decode_final_result(row.final_result) or {}
+    guidance = final.get("career_guidance")
+    if guidance is None and row.guidance_body is not None:
+        guidance = decompress_guidance(row.guidance_codec, row.guidance_body)
+    return {
+        "username": row.username,
+        "fullname": row.fullname,
+        "email": row.email,
+        "average_elo": gap.get("average_elo"),
+        "topic_ratings": gap.get("topic_ratings", {}),
+        "solved": tech.get("solved"),
+        "milestone": tech.get("milestone"),
+        "personality_type": row.non_technical_test,
+        "career_guidance": guidance,
+    }
+
+
+class CsvEncoder:
+    def header(self):
+        return self._rows([CSV_COLUMNS])
+
+    def encode(self, records):
+        return self._rows([
+            [r["username"], r["fullname"], r["email"], r["average_elo"]]
+            + [r["topic_ratings"].get(topic) for topic in TOPICS]
+            + [r["solved"], r["milestone"], r["personality_type"], r["career_guidance"]]
+            for r in records
+        ])
+
+    def footer(self):
+        return b""
+
+    @staticmethod
+    def _rows(rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+
+class NdjsonEncoder:
+    def header(self):
+        return b""
+
+    def encode(self, records):
+        return "".join(json.dumps(r) + "\n" for r in records).encode()
+
+    def footer(self):
+        return b""
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file object whose buffered bytes are taken out after each batch."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class ParquetEncoder:
+    """One Parquet row group per batch (needs the optional pyarrow package)."""
+
+    def __init__(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema(
+            [("username", pa.string()), ("fullname", pa.string()), ("email", pa.string()), ("average_elo", pa.int64())]
+            + [(f"rating: {topic}", pa.int64()) for topic in TOPICS]
+            + [("solved", pa.int64()), ("milestone", pa.string()), ("personality_type", pa.string()),
+               ("career_guidance", pa.string())]
+        )
+        self.sink = _DrainableSink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression="zstd")
+
+    def header(self):
+        return self.sink.drain()
+
+    def encode(self, records):
+        columns = {name: [] for name in self.schema.names}
+        for r in records:
+            for key in ("username", "fullname", "email", "average_elo", "solved", "milestone",
+                        "personality_type", "career_guidance"):
+                columns[key].append(r[key])
+            for topic in TOPICS:
+                columns[f"rating: {topic}"].append(r["topic_ratings"].get(topic))
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+        return self.sink.drain()
+
+    def footer(self):
+        self.writer.close()
+        return self.sink.drain()
+
+
+def make_encoder(fmt):
+    if fmt == "csv":
+        return CsvEncoder()
+    if fmt == "ndjson":
+        return NdjsonEncoder()
+    try:
+        return ParquetEncoder()
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export requires the pyarrow package")
+
+
+@router.get("/results")
+async def export_results(format: str = "csv", db: AsyncSession = Depends(get_async_db), admin: User = Depends(require_admin)):
+    """Stream every user's gap ratings, technical progress, personality type and final guidance."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format, use one of: {', '.join(EXPORT_FORMATS)}")
+    encoder = make_encoder(format)
+
+    async def generate():
+        yield encoder.header()
+        if SHARD_COUNT == 1:
+            result = await db.stream(EXPORT_QUERY)
+            async for partition in result.partitions():
+                yield encoder.encode([user_record(row) for row in partition])
+        else:
+            batch = []
+            async for row in scatter_stream(EXPORT_QUERY, key=lambda row: row.username):
+                batch.append(user_record(row))
+                if len(batch) == EXPORT_BATCH_SIZE:
+                    yield encoder.encode(batch)
+                    batch = []
+            if batch:
+                yield encoder.encode(batch)
+        yield encoder.footer()
+
+    return StreamingResponse(
+        generate(),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="nextstep_results.{format}"'},
+    )
+
+
+def export_to_file(fmt, out):
+    """CLI path: same encoding, driven by the sync engine."""
+    encoder = make_encoder(fmt)
+    out.write(encoder.header())
+    with SessionLocal() as db:
+        batch = []
+        for row in merged_rows(db, EXPORT_QUERY, key=lambda row: row.username):
+            batch.append(user_record(row))
+            if len(batch) == EXPORT_BATCH_SIZE:
+                out.write(encoder.encode(batch))
+                batch = []
+        if batch:
+            out.write(encoder.encode(batch))
+    out.write(encoder.footer())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export all candidate results.")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, "wb") as out:
+            export_to_file(args.format, out)
+    else:
+        export_to_file(args.format, sys.stdout.buffer)
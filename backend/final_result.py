@@ -1,10 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.attributes import flag_modified
 import json
-import requests
-from database import get_db
+from database import get_async_db
+from llm_provider import build_llm, ProviderError, CircuitOpenError
+from guidance_store import store_guidance, load_guidance
+from concurrency import run_with_retry
+from gap_sessions import gap_sessions
 from models import User
+from profiling import phase
 
 router = APIRouter()
 
@@ -12,10 +18,13 @@ router = APIRouter()
 API_KEY = "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"
 API_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+llm = build_llm(API_URL, API_KEY)
+
 # ----------------------- Helper Functions -----------------------
 
-def get_user_data(username: str, db: Session):
-    user = db.query(User).filter(User.username == username).first()
+async def get_user_data(username: str, db: AsyncSession):
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -160,32 +169,29 @@ def generate_career_prompt(average_elo, non_technical_test, skill_level):
     )
 
 def call_ai_api(prompt):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {API_KEY}"
-    }
-    payload = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.7
-    }
-    response = requests.post(API_URL, headers=headers, json=payload)
-    
-    if response.status_code == 200:
-        return response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
-    else:
-        raise HTTPException(status_code=500, detail=f"Error from AI API: {response.text}")
+    """Ask the LLM for career guidance (deadline, retries, hedging and circuit breaking live in llm_provider)."""
+    try:
+        with phase("llm"):
+            return llm.complete(prompt)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail="AI service temporarily unavailable",
+                            headers={"Retry-After": str(e.retry_after)})
+    except ProviderError as e:
+        raise HTTPException(status_code=500, detail=f"Error from AI API: {e}")
 
 # ----------------------- Main Endpoints -----------------------
 
 @router.post("/generate_final_result/{username}")
-def generate_final_result(username: str, db: Session = Depends(get_db)):
-    user = get_user_data(username, db)
+async def generate_final_result(username: str, db: AsyncSession = Depends(get_async_db)):
+    # A gap test still in the session store must be written back before its rating is used
+    await gap_sessions.flush([username])
+    user = await get_user_data(username, db)
     average_elo, technical_test_combined, non_technical_test, solved, milestone_number = extract_test_results(user)
     
     skill_level = determine_skill_level(solved, milestone_number)
     prompt = generate_career_prompt(average_elo, non_technical_test, skill_level)
-    career_guidance = call_ai_api(prompt)
+    # The AI call is a blocking HTTP request, run it in the threadpool
+    career_guidance = await run_in_threadpool(call_ai_api, prompt)
     
     final_result_data = {
         "average_elo": average_elo,
@@ -196,21 +202,36 @@ def generate_final_result(username: str, db: Session = Depends(get_db)):
 
     print("Final result before saving:", final_result_data)  # Debugging
 
-    # Convert JSON to string explicitly before saving
-    user.final_result = json.dumps(final_result_data)
+    # The guidance text is stored once, compressed, by hash; the user row only keeps the reference
+    stored_result = {key: value for key, value in final_result_data.items() if key != "career_guidance"}
+
+    async def attempt():
+        user = await get_user_data(username, db)
+        user.career_guidance_hash = await store_guidance(db, career_guidance, username)
+        # Convert JSON to string explicitly before saving
+        user.final_result = json.dumps(stored_result)
+        # Mark as modified for SQLAlchemy
+        flag_modified(user, "final_result")
+        return user.final_result
 
-    # Mark as modified for SQLAlchemy
-    flag_modified(user, "final_result")
-    db.commit()
-    db.refresh(user)
+    saved = await run_with_retry(db, "generate_final_result", attempt)
 
-    print("Final result saved in database:", user.final_result)  # Debugging
+    print("Final result saved in database:", saved)  # Debugging
 
     return {"message": "Final result generated successfully", "final_result": final_result_data}
 
 @router.get("/get_final_result/{username}")
-def get_final_result(username: str, db: Session = Depends(get_db)):
-    user = get_user_data(username, db)
+async def get_final_result(username: str, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_data(username, db)
     if not user.final_result:
         raise HTTPException(status_code=404, detail="Final result not found")
-    return json.loads(user.final_result)
+    final_result_data = json.loads(user.final_result)
+    # Rows written before guidance moved to its own table still carry the text inline
+    if "career_guidance" not in final_result_data and user.career_guidance_hash:
+        final_result_data["career_guidance"] = await load_guidance(db, user.career_guidance_hash, username)
+    return final_result_data
+
+@router.get("/final_result/llm_status")
+def get_llm_status():
+    """Circuit breaker state per LLM provider."""
+    return llm.status()
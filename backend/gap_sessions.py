@@ -0,0 +1,227 @@
+"""
+Write-behind store for live gap tests.
+
+While a test is running, its gap_analysis document (topic ratings, rotation
+history, answered question IDs) lives here instead of being written to
+users.gap_analysis on every next/evaluate request. Dirty sessions are written
+back in one transaction per flush:
+
+  - every FLUSH_INTERVAL_SECONDS by the background flusher,
+  - immediately when the test ends (POST /gap_test/end_gap_test),
+  - for every session at graceful shutdown.
+
+Sessions idle for SESSION_IDLE_SECONDS are flushed and dropped.
+
+Crash safety:
+  - Each flush writes a whole document, so the database never holds a rating
+    without its matching answered IDs (or the reverse).
+  - A hard crash (SIGKILL, OOM kill, power loss) loses at most the last
+    FLUSH_INTERVAL_SECONDS of answers of each live test. The candidate
+    resumes from the last flushed document.
+  - A finished test is durable as soon as end_gap_test returns.
+  - The store is per process, and several workers may each hold a session
+    for the same user. A flush is a compare-and-swap on the gap_analysis
+    value this process last read or wrote. If another worker changed it in
+    between, this process's changes since then are merged onto the stored
+    document (rating deltas, new answers and concept attempts; see
+    gap_test.merge_gap_analysis) and the swap is retried. Conflicts are
+    counted under "gap_session_flush" in /metrics/concurrency.
+  - Sessions with nothing unflushed re-read the stored document on every
+    request, so a user moving between workers continues from the latest state.
+"""
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import bindparam, select, update
+
+from concurrency import record
+from database import AsyncSessionLocal
+from models import User
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("GAP_FLUSH_INTERVAL_SECONDS", "5"))
+SESSION_IDLE_SECONDS = float(os.getenv("GAP_SESSION_IDLE_SECONDS", "1800"))
+FLUSH_OPERATION = "gap_session_flush"
+MERGE_RETRIES = 3
+
+
+def _parse(raw):
+    try:
+        return json.loads(raw) if raw else {}
+    except json.JSONDecodeError:
+        return {}
+
+
+class GapSession:
+    def __init__(self, username, raw):
+        self.username = username
+        self.data = _parse(raw)
+        self.persisted = raw  # Column value as last read from / written to the database
+        self.base = copy.deepcopy(self.data)  # self.data as of `persisted`: what merges diff against
+        self.dirty = False
+        self.touched = time.monotonic()
+        self.lock = asyncio.Lock()  # Serializes one user's concurrent requests
+
+    def mark_dirty(self):
+        self.dirty = True
+        self.touched = time.monotonic()
+
+
+class GapSessionStore:
+    def __init__(self):
+        self.sessions = {}
+        self.flush_lock = asyncio.Lock()
+        self.task = None
+        # merge(base, ours, theirs) -> document; set by gap_test, which owns the document's format
+        self.merge = None
+        self.counters = {"updates": 0, "flushes": 0, "rows_written": 0, "conflicts_merged": 0, "conflicts_dropped": 0}
+
+    async def get(self, db, username):
+        """The user's live session: loaded on first use, refreshed from the database while it has nothing unflushed."""
+        session = self.sessions.get(username)
+        if session is None:
+            result = await db.execute(select(User.gap_analysis).where(User.username == username))
+            raw = result.scalar()
+            # Another request may have loaded it while we awaited
+            session = self.sessions.setdefault(username, GapSession(username, raw))
+        elif not session.dirty and not self.flush_lock.locked():
+            # Another worker may have moved the test on since we last saw it
+            async with session.lock:
+                result = await db.execute(select(User.gap_analysis).where(User.username == username))
+                raw = result.scalar()
+                if not session.dirty and raw != session.persisted:
+                    session.data, session.persisted, session.base = _parse(raw), raw, _parse(raw)
+        session.touched = time.monotonic()
+        return session
+
+    def updated(self, session):
+        """Record a change to session.data; it reaches the database on the next flush."""
+        session.mark_dirty()
+        self.counters["updates"] += 1
+
+    def peek(self, username):
+        """In-memory gap_analysis for a live test (newer than the database), or None."""
+        session = self.sessions.get(username)
+        return session.data if session else None
+
+    async def flush(self, usernames=None, evict=False):
+        """Write dirty sessions back in one transaction; optionally drop them from memory."""
+        async with self.flush_lock:
+            targets = [self.sessions[u] for u in (usernames if usernames is not None else list(self.sessions))
+                       if u in self.sessions]
+            # Snapshot synchronously: requests can't interleave between the dumps
+            pending = [(s, json.dumps(s.data)) for s in targets if s.dirty]
+            for session, _ in pending:
+                session.dirty = False
+
+            written, dropped = [], []
+            if pending:
+                try:
+                    async with AsyncSessionLocal() as db:
+                        for session, raw in pending:
+                            stored = await self._write(db, session, raw)
+                            if stored is None:
+                                dropped.append(session)
+                            else:
+                                written.append((session, raw, stored))
+                        await db.commit()
+                except BaseException:
+                    # Nothing was committed (failure or cancellation): keep everything for the next flush
+                    for session, raw in pending:
+                        session.dirty = True
+                    raise
+                self.counters["flushes"] += 1
+                self.counters["rows_written"] += len(written)
+
+            for session, raw, stored in written:
+                stored_data = _parse(stored)
+                if stored != raw:
+                    # Merged with another worker's writes: rebase whatever changed here during the flush onto it
+                    session.data = self.merge(_parse(raw), session.data, stored_data) if session.dirty else stored_data
+                session.persisted, session.base = stored, stored_data
+            for session in dropped:
+                self.counters["conflicts_dropped"] += 1
+                logger.warning(f"gap session for {session.username}: user no longer exists; dropping cached state")
+                self.sessions.pop(session.username, None)
+            if evict:
+                for session in targets:
+                    if not session.dirty:  # Changed again mid-flush: keep it for the next round
+                        self.sessions.pop(session.username, None)
+            return len(written)
+
+    async def _write(self, db, session, raw):
+        """
+        Compare-and-swap one document. On a conflict, merge this session's changes onto the stored
+        document and retry. Returns the value written, or None if the user's row is gone.
+        """
+        ours = _parse(raw)
+        expected = session.persisted
+        for _ in range(MERGE_RETRIES + 1):
+            record(FLUSH_OPERATION, "attempts")
+            # Hand-written CAS on the column itself; version is bumped so ORM writers notice too
+            # (the bind must go through the column's JSON type to match the stored text)
+            previous = User.gap_analysis.is_(None) if expected is None else \
+                User.gap_analysis == bindparam("previous", expected, type_=User.gap_analysis.type)
+            result = await db.execute(
+                update(User)
+                .where(User.username == session.username, previous)
+                .values(gap_analysis=raw, version=User.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                return raw
+            record(FLUSH_OPERATION, "conflicts")
+            row = (await db.execute(select(User.gap_analysis).where(User.username == session.username))).first()
+            if row is None:
+                return None
+            expected = row.gap_analysis
+            raw = json.dumps(self.merge(session.base, ours, _parse(expected)))
+            self.counters["conflicts_merged"] += 1
+        record(FLUSH_OPERATION, "exhausted")
+        raise RuntimeError(f"gap session flush for {session.username} kept conflicting")
+
+    async def flush_idle(self):
+        cutoff = time.monotonic() - SESSION_IDLE_SECONDS
+        await self.flush()
+        idle = [u for u, s in self.sessions.items() if s.touched < cutoff]
+        if idle:
+            await self.flush(idle, evict=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            try:
+                await self.flush_idle()
+            except Exception:
+                logger.exception("gap session flush failed; retrying next interval")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write back everything (graceful shutdown)."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush(evict=True)
+
+    def stats(self):
+        return {
+            "live_sessions": len(self.sessions),
+            "dirty_sessions": sum(1 for s in self.sessions.values() if s.dirty),
+            "flush_interval_seconds": FLUSH_INTERVAL_SECONDS,
+            **self.counters,
+        }
+
+
+gap_sessions = GapSessionStore()
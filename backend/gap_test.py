@@ -1,13 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import copy
 import random
 import json
 import logging
 
-from database import get_db
+from database import get_async_db, AsyncSessionLocal
 from models import GapTestQuestion, User
 from schemas import QuestionResponse, GapTestResponse
-from auth import get_current_user
+from auth import get_current_user, verify_access_token
+from gap_sessions import gap_sessions
+from concept_graph import get_concept_graph, question_concepts
+from results import decode_gap_analysis
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -24,85 +30,46 @@ K_FACTOR = 64
 ROTATION_LIMIT = 3
 HISTORY_LIMIT = 10
 
-@router.post("/reset_gap_test")
-def reset_gap_test(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    """
-    Resets the user's gap test data.
-    Clears previous results, detailed topic ratings, average rating, and history.
-    """
-    try:
-        # Re-fetch the user from the database for an attached instance.
-        user = db.query(User).filter(User.username == user.username).first()
-        if not user:
-            logger.error("User not found in database.")
-            raise HTTPException(status_code=404, detail="User not found")
-
-        logger.debug(f"Before reset: {user.gap_analysis}")
-        
-        gap_data = {
-            "topic_ratings": {topic: INITIAL_TOPIC_RATING for topic in TOPICS},
-            "average_elo": INITIAL_TOPIC_RATING,
-            "prev_topics": [],
-            "answered_questions": []
-        }
-        user.gap_analysis = json.dumps(gap_data)
-        
-        db.commit()
-        db.refresh(user)
-        
-        logger.debug(f"After reset: {user.gap_analysis}")
-        return {"message": "Gap test progress has been reset.", "debug": user.gap_analysis}
-    except Exception as e:
-        logger.exception("Error resetting gap test:")
-        raise HTTPException(status_code=500, detail="Failed to reset gap test.")
+# ----------------------- Rating and selection -----------------------
 
-@router.get("/next_gap_question", response_model=QuestionResponse)
-def next_gap_question(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    """
-    Fetches the next question based on the user's performance and history.
-    Uses the detailed per-topic rating stored in gap_analysis.
-    """
-    # Re-fetch the user from the database.
-    user = db.query(User).filter(User.username == user.username).first()
-    
-    try:
-        gap_analysis = json.loads(user.gap_analysis) if user.gap_analysis else {}
-    except json.JSONDecodeError:
-        gap_analysis = {}
-    
-    # Initialize test-specific variables if not present.
-    gap_analysis.setdefault("topic_ratings", {topic: INITIAL_TOPIC_RATING for topic in TOPICS})
-    gap_analysis.setdefault("prev_topics", [])
-    gap_analysis.setdefault("answered_questions", [])
-
-    prev_topics = gap_analysis["prev_topics"]
-    answered_questions = set(gap_analysis["answered_questions"])
-
-    # Ensure rotation: do not repeat topics more than ROTATION_LIMIT times.
-    valid_topics = [t for t in TOPICS if prev_topics.count(t) < ROTATION_LIMIT]
-    if not valid_topics:
-        valid_topics = TOPICS
-        gap_analysis["prev_topics"] = []
-        prev_topics = []
-
-    selected_topic = random.choice(valid_topics)
-    current_rating = gap_analysis["topic_ratings"].get(selected_topic, INITIAL_TOPIC_RATING)
-
-    query = db.query(GapTestQuestion).filter(GapTestQuestion.topic == selected_topic)
-    if answered_questions:
-        query = query.filter(GapTestQuestion.id.notin_(answered_questions))
-    
-    topic_questions = query.all()
-    if not topic_questions:
-        return {"id": 0, "question": "No more questions available for this topic", "options": []}
+def elo_update(current_rating: int, question_difficulty: int, correct: bool) -> int:
+    """New topic rating after one answer (sharper drops than rises, clamped to 500-1600)."""
+    if correct:
+        if current_rating < 1000:
+            K = 64  # Decent rise for lower ratings
+        elif current_rating < 1400:
+            K = 48  # Moderate rise
+        else:
+            K = 32  # Slower rise at high ratings
+    else:
+        if current_rating > 1400:
+            K = 100  # Big drop for high-rated users
+        elif current_rating > 1000:
+            K = 120  # Even bigger drop for mid-rated users
+        else:
+            K = 140  # Massive drop if already struggling
+
+    expected_score = 1 / (1 + 10 ** ((question_difficulty - current_rating) / 400))
+    actual_score = 1 if correct else 0
+    new_rating = int(current_rating + K * (actual_score - expected_score))
 
+    # Make drops sharper than rises
+    if not correct:
+        new_rating = int(current_rating - (K * (1 - expected_score) * 1.2))  # 20% sharper drop
+
+    # Prevent the rating from going above 1600 or below 500
+    new_rating = max(500, min(new_rating, 1600))
+
+    return new_rating
+
+def pick_question_for_rating(topic_questions, current_rating: int):
+    """Select a question based on the current rating: easy below 1000, medium below 1400, else hard."""
     categorized_questions = {
         "easy": [q for q in topic_questions if q.difficulty.lower() == "easy"],
         "medium": [q for q in topic_questions if q.difficulty.lower() == "medium"],
         "hard": [q for q in topic_questions if q.difficulty.lower() == "hard"]
     }
 
-    # Select a question based on the current rating.
     if current_rating < 1000 and categorized_questions["easy"]:
         selected_question = random.choice(categorized_questions["easy"])
     elif current_rating < 1400 and categorized_questions["medium"]:
@@ -111,91 +78,305 @@ def next_gap_question(db: Session = Depends(get_db), user: User = Depends(get_cu
         selected_question = random.choice(categorized_questions["hard"])
     else:
         selected_question = random.choice(topic_questions)
+    return selected_question
 
-    # Update history.
-    prev_topics.append(selected_topic)
-    if len(prev_topics) > HISTORY_LIMIT:
-        prev_topics.pop(0)
-    
-    answered_questions.add(selected_question.id)
-    gap_analysis["prev_topics"] = prev_topics
-    gap_analysis["answered_questions"] = list(answered_questions)
+def merge_gap_analysis(base: dict, ours: dict, theirs: dict) -> dict:
+    """
+    Replay this worker's changes since `base` onto `theirs`, the document another worker stored meanwhile.
+    Rating changes carry over as deltas, new answered questions and concept attempts are added,
+    and a reset on this side wins.
+    """
+    base_answered = base.get("answered_questions", [])
+    ours_answered = ours.get("answered_questions", [])
+    if not set(base_answered).issubset(ours_answered):
+        return copy.deepcopy(ours)  # The test was reset here
 
-    # Commit the updated gap_analysis (no rating change here).
-    user.gap_analysis = json.dumps(gap_analysis)
-    db.commit()
+    merged = copy.deepcopy(theirs)
+    base_ratings = base.get("topic_ratings", {})
+    ratings = merged.setdefault("topic_ratings", {topic: INITIAL_TOPIC_RATING for topic in TOPICS})
+    for topic, rating in ours.get("topic_ratings", {}).items():
+        delta = rating - base_ratings.get(topic, INITIAL_TOPIC_RATING)
+        if delta:
+            # Same bounds as elo_update
+            ratings[topic] = max(500, min(ratings.get(topic, INITIAL_TOPIC_RATING) + delta, 1600))
+    merged["average_elo"] = int(sum(ratings.values()) / len(ratings))
 
-    return {
-        "id": selected_question.id,
-        "question": selected_question.question,
-        "options": selected_question.options
-    }
+    answered = merged.setdefault("answered_questions", [])
+    seen = set(answered) | set(base_answered)
+    answered.extend(q for q in ours_answered if q not in seen)
+    merged["prev_topics"] = list(ours.get("prev_topics", merged.get("prev_topics", [])))
 
-@router.post("/evaluate_gap_question")
-def evaluate_gap_question(
-    response: GapTestResponse,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
+    base_mastery = base.get("concept_mastery", {})
+    mastery = merged.setdefault("concept_mastery", {})
+    for concept, stats in ours.get("concept_mastery", {}).items():
+        before = base_mastery.get(concept, {"attempts": 0, "correct": 0})
+        target = mastery.setdefault(concept, {"attempts": 0, "correct": 0})
+        target["attempts"] += stats["attempts"] - before["attempts"]
+        target["correct"] += stats["correct"] - before["correct"]
+
+    # The probe queued (or consumed) by the most recent answer here
+    if "probe_concept" in ours:
+        merged["probe_concept"] = ours["probe_concept"]
+    elif "probe_concept" in base:
+        merged.pop("probe_concept", None)
+    return merged
+
+gap_sessions.merge = merge_gap_analysis
+
+# ----------------------- Test loop -----------------------
+# Shared by the HTTP endpoints and the WebSocket transport below.
+
+async def reset_test(db: AsyncSession, username: str) -> str:
+    """
+    Resets the user's gap test data.
+    Clears previous results, detailed topic ratings, average rating, and history.
+    """
+    session = await gap_sessions.get(db, username)
+    async with session.lock:
+        logger.debug(f"Before reset: {session.data}")
+        session.data = {
+            "topic_ratings": {topic: INITIAL_TOPIC_RATING for topic in TOPICS},
+            "average_elo": INITIAL_TOPIC_RATING,
+            "prev_topics": [],
+            "answered_questions": [],
+            "concept_mastery": {}
+        }
+        gap_sessions.updated(session)
+        gap_analysis = json.dumps(session.data)
+
+    logger.debug(f"After reset: {gap_analysis}")
+    return gap_analysis
+
+async def select_next_question(db: AsyncSession, username: str) -> dict:
+    """
+    Picks the next question based on the user's performance and history.
+    Uses the detailed per-topic rating stored in gap_analysis.
+    """
+    # State lives in the write-behind session store while the test is running
+    session = await gap_sessions.get(db, username)
+    async with session.lock:
+        gap_analysis = session.data
+
+        # Initialize test-specific variables if not present.
+        gap_analysis.setdefault("topic_ratings", {topic: INITIAL_TOPIC_RATING for topic in TOPICS})
+        gap_analysis.setdefault("prev_topics", [])
+        gap_analysis.setdefault("answered_questions", [])
+
+        prev_topics = gap_analysis["prev_topics"]
+        answered_questions = set(gap_analysis["answered_questions"])
+
+        # Ensure rotation: do not repeat topics more than ROTATION_LIMIT times.
+        valid_topics = [t for t in TOPICS if prev_topics.count(t) < ROTATION_LIMIT]
+        if not valid_topics:
+            valid_topics = TOPICS
+            gap_analysis["prev_topics"] = []
+            prev_topics = []
+
+        # After a miss, the evaluator queues the weakest prerequisite concept to probe next.
+        graph = await get_concept_graph(db)
+        probe_concept = gap_analysis.pop("probe_concept", None)
+        probe_ids = [q for q in graph.questions.get(probe_concept, []) if q not in answered_questions]
+
+        if probe_ids:
+            result = await db.execute(select(GapTestQuestion).where(GapTestQuestion.id.in_(probe_ids)))
+            # Prerequisites are probed from the easy end
+            selected_question = min(
+                result.scalars().all(),
+                key=lambda q: DIFFICULTY_RATINGS.get(q.difficulty.lower(), INITIAL_TOPIC_RATING)
+            )
+            selected_topic = selected_question.topic
+        else:
+            selected_topic = random.choice(valid_topics)
+            current_rating = gap_analysis["topic_ratings"].get(selected_topic, INITIAL_TOPIC_RATING)
+
+            query = select(GapTestQuestion).where(GapTestQuestion.topic == selected_topic)
+            if answered_questions:
+                query = query.where(GapTestQuestion.id.notin_(answered_questions))
+
+            result = await db.execute(query)
+            topic_questions = result.scalars().all()
+            if not topic_questions:
+                return {"id": 0, "question": "No more questions available for this topic", "options": []}
+
+            selected_question = pick_question_for_rating(topic_questions, current_rating)
+
+        # Update history.
+        prev_topics.append(selected_topic)
+        if len(prev_topics) > HISTORY_LIMIT:
+            prev_topics.pop(0)
+
+        answered_questions.add(selected_question.id)
+        gap_analysis["prev_topics"] = prev_topics
+        gap_analysis["answered_questions"] = list(answered_questions)
+
+        # Written back by the session store's next flush (no rating change here).
+        gap_sessions.updated(session)
+
+        return {
+            "id": selected_question.id,
+            "question": selected_question.question,
+            "options": selected_question.options
+        }
+
+async def evaluate_answer(db: AsyncSession, username: str, question_id: int, answer) -> dict:
     """
     Evaluates the user's answer and updates the topic rating using the Elo formula.
     """
-    user = db.query(User).filter(User.username == user.username).first()
-    question = db.query(GapTestQuestion).filter(GapTestQuestion.id == response.question_id).first()
+    result = await db.execute(select(GapTestQuestion).where(GapTestQuestion.id == question_id))
+    question = result.scalars().first()
 
     if not question:
         raise HTTPException(status_code=404, detail="Question not found")
 
     topic = question.topic
 
-    if response.answer is None:
+    if answer is None:
         return {"error": "No answer provided"}
 
-    correct = response.answer == question.answer
+    correct = answer == question.answer
+    question_difficulty = DIFFICULTY_RATINGS.get(question.difficulty.lower(), INITIAL_TOPIC_RATING)
+    concepts = question_concepts(question.prerequisites)
+    graph = await get_concept_graph(db)
 
-    try:
-        gap_analysis = json.loads(user.gap_analysis) if user.gap_analysis else {}
-    except json.JSONDecodeError:
-        gap_analysis = {}
+    session = await gap_sessions.get(db, username)
+    async with session.lock:
+        gap_analysis = session.data
 
-    topic_ratings = gap_analysis.get("topic_ratings", {t: INITIAL_TOPIC_RATING for t in TOPICS})
-    current_rating = topic_ratings.get(topic, INITIAL_TOPIC_RATING)
-    question_difficulty = DIFFICULTY_RATINGS.get(question.difficulty.lower(), INITIAL_TOPIC_RATING)
+        topic_ratings = gap_analysis.get("topic_ratings", {t: INITIAL_TOPIC_RATING for t in TOPICS})
+        current_rating = topic_ratings.get(topic, INITIAL_TOPIC_RATING)
 
-    # Sharper drops than rises
-    if correct:
-        if current_rating < 1000:
-            K = 64  # Decent rise for lower ratings
-        elif current_rating < 1400:
-            K = 48  # Moderate rise
-        else:
-            K = 32  # Slower rise at high ratings
-    else:
-        if current_rating > 1400:
-            K = 100  # Big drop for high-rated users
-        elif current_rating > 1000:
-            K = 120  # Even bigger drop for mid-rated users
-        else:
-            K = 140  # Massive drop if already struggling
+        new_rating = elo_update(current_rating, question_difficulty, correct)
 
-    expected_score = 1 / (1 + 10 ** ((question_difficulty - current_rating) / 400))
-    actual_score = 1 if correct else 0
-    new_rating = int(current_rating + K * (actual_score - expected_score))
+        topic_ratings[topic] = new_rating
+        average_rating = int(sum(topic_ratings.values()) / len(topic_ratings))
 
-    # Make drops sharper than rises
-    if not correct:
-        new_rating = int(current_rating - (K * (1 - expected_score) * 1.2))  # 20% sharper drop
+        gap_analysis["topic_ratings"] = topic_ratings
+        gap_analysis["average_elo"] = average_rating
 
-    # Prevent the rating from going above 1600 or below 500
-    new_rating = max(500, min(new_rating, 1600))
+        # Per-concept mastery; a miss queues the weakest prerequisite concept as the next question
+        mastery = gap_analysis.setdefault("concept_mastery", {})
+        for concept in concepts:
+            stats = mastery.setdefault(concept, {"attempts": 0, "correct": 0})
+            stats["attempts"] += 1
+            stats["correct"] += int(correct)
+        gap_analysis.pop("probe_concept", None)
+        if not correct:
+            answered = set(gap_analysis.get("answered_questions", []))
+            for concept in concepts:
+                probe_concept = graph.weakest_prerequisite(concept, mastery, answered)
+                if probe_concept:
+                    gap_analysis["probe_concept"] = probe_concept
+                    break
+        gap_sessions.updated(session)
 
-    topic_ratings[topic] = new_rating
-    average_rating = int(sum(topic_ratings.values()) / len(topic_ratings))
+    return {"correct": correct, "new_rating": new_rating}
+
+async def end_test(db: AsyncSession, username: str) -> dict:
+    """
+    Ends the user's gap test: writes the live session back to the database and releases it.
+    """
+    session = await gap_sessions.get(db, username)
+    async with session.lock:
+        gap_analysis = dict(session.data)
+    await gap_sessions.flush([username], evict=True)
+    return {
+        "message": "Gap test saved.",
+        "topic_ratings": gap_analysis.get("topic_ratings", {}),
+        "average_elo": gap_analysis.get("average_elo", INITIAL_TOPIC_RATING),
+        "concept_mastery": decode_gap_analysis(gap_analysis)["concept_mastery"],
+    }
 
-    gap_analysis["topic_ratings"] = topic_ratings
-    gap_analysis["average_elo"] = average_rating
-    user.gap_analysis = json.dumps(gap_analysis)
+# ----------------------- HTTP endpoints -----------------------
 
-    db.commit()
+@router.post("/reset_gap_test")
+async def reset_gap_test(db: AsyncSession = Depends(get_async_db), user: User = Depends(get_current_user)):
+    """Resets the user's gap test data."""
+    gap_analysis = await reset_test(db, user.username)
+    return {"message": "Gap test progress has been reset.", "debug": gap_analysis}
 
-    return {"correct": correct, "new_rating": new_rating}
+@router.get("/next_gap_question", response_model=QuestionResponse)
+async def next_gap_question(db: AsyncSession = Depends(get_async_db), user: User = Depends(get_current_user)):
+    """Fetches the next question based on the user's performance and history."""
+    return await select_next_question(db, user.username)
+
+@router.post("/evaluate_gap_question")
+async def evaluate_gap_question(
+    response: GapTestResponse,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Evaluates the user's answer and updates the topic rating."""
+    return await evaluate_answer(db, user.username, response.question_id, response.answer)
+
+@router.post("/end_gap_test")
+async def end_gap_test(db: AsyncSession = Depends(get_async_db), user: User = Depends(get_current_user)):
+    """Ends the user's gap test and saves it."""
+    return await end_test(db, user.username)
+
+@router.get("/session_stats")
+def gap_session_stats():
+    """Live gap-test sessions and write-behind flush counters."""
+    return gap_sessions.stats()
+
+# ----------------------- WebSocket transport -----------------------
+
+@router.websocket("/ws")
+async def gap_test_socket(websocket: WebSocket, token: str = ""):
+    """
+    The gap-test loop over one connection, authenticated once at connect (?token=<JWT>).
+
+    Client messages: {"type": "reset"}, {"type": "next"},
+    {"type": "answer", "question_id": n, "answer": "..."} and {"type": "end"}.
+    An answer is followed by the next question without another request.
+    """
+    try:
+        username = verify_access_token(token).get("sub")
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User.username).where(User.username == username))
+        if result.scalar() is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        await db.rollback()  # Never hold a read transaction open between messages
+
+        await websocket.accept()
+        await websocket.send_json({"type": "ready", "username": username})
+        try:
+            while True:
+                try:
+                    message = await websocket.receive_json()
+                except (ValueError, KeyError):  # Not JSON, or a binary frame
+                    message = None
+                if not isinstance(message, dict):
+                    await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                    continue
+                kind = message.get("type")
+                try:
+                    if kind == "reset":
+                        await reset_test(db, username)
+                        await websocket.send_json({"type": "reset"})
+                        await websocket.send_json({"type": "question", **await select_next_question(db, username)})
+                    elif kind == "next":
+                        await websocket.send_json({"type": "question", **await select_next_question(db, username)})
+                    elif kind == "answer":
+                        evaluation = await evaluate_answer(db, username, message.get("question_id"), message.get("answer"))
+                        await websocket.send_json({"type": "result", **evaluation})
+                        if "error" not in evaluation:
+                            await websocket.send_json({"type": "question", **await select_next_question(db, username)})
+                    elif kind == "end":
+                        await websocket.send_json({"type": "ended", **await end_test(db, username)})
+                        await websocket.close()
+                        return
+                    else:
+                        await websocket.send_json({"type": "error", "detail": f"Unknown message type: {kind}"})
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+                finally:
+                    await db.rollback()
+        except WebSocketDisconnect:
+            # Dropped mid-test: save progress now (shielded, the server may be cancelling this task);
+            # the test can continue over HTTP or a new connection
+            await asyncio.shield(gap_sessions.flush([username]))
@@ -0,0 +1,125 @@
+"""
+Content-addressed, compressed storage for career guidance text.
+
+Guidance bodies live once in the career_guidance table, keyed by the SHA-256 of
+the text and compressed with zstd (if the zstandard package is installed) or
+zlib. Users point at a body through users.career_guidance_hash. Text is
+only decompressed when a reader actually needs it.
+
+The saving is the compression. Deduplication only catches byte-identical
+text (the fake provider's canned reply, re-imported rows). The LLM samples
+at temperature 0.7, so guidance generated twice, even from the same score,
+personality type and milestone, almost never hashes the same. Sharing
+guidance between users with the same prompt inputs would mean caching the
+LLM reply by prompt, which this module doesn't do. With several user shards, a body is stored on
+the shard of each user referencing it (see sharding.py), so joins stay local.
+
+    python guidance_store.py migrate   # move inline guidance from final_result into the table
+"""
+import hashlib
+import json
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm.exc import StaleDataError
+
+from concurrency import record
+from models import CareerGuidance
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 19
+
+
+def guidance_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def compress_guidance(text: str):
+    """Returns (codec, compressed bytes)."""
+    data = text.encode()
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress_guidance(codec: str, body: bytes) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed guidance needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(body).decode()
+    return zlib.decompress(body).decode()
+
+
+def _insert_statement(text: str, owner: str):
+    digest = guidance_hash(text)
+    codec, body = compress_guidance(text)
+    # Same text, same hash: an existing row is already the right content
+    statement = insert(CareerGuidance).values(
+        hash=digest, codec=codec, body=body, size=len(text.encode())
+    ).on_conflict_do_nothing(index_elements=["hash"]).execution_options(shard_username=owner)
+    return digest, statement
+
+
+async def store_guidance(db, text: str, owner: str) -> str:
+    """Store a guidance body (once per shard) for user `owner` and return its hash. Committed with the caller's transaction."""
+    digest, statement = _insert_statement(text, owner)
+    await db.execute(statement)
+    return digest
+
+
+async def load_guidance(db, digest: str, owner: str):
+    """Decompressed guidance text for a hash referenced by user `owner`, or None if it's missing."""
+    result = await db.execute(
+        select(CareerGuidance.codec, CareerGuidance.body).where(CareerGuidance.hash == digest)
+        .execution_options(shard_username=owner)
+    )
+    row = result.first()
+    return decompress_guidance(row.codec, row.body) if row else None
+
+
+def migrate_inline_guidance(batch_size=500):
+    """Move career_guidance text stored inline in users.final_result into the guidance table."""
+    from database import SessionLocal
+    from models import User
+
+    moved = 0
+    with SessionLocal() as db:
+        while True:
+            users = db.execute(
+                select(User).where(User.final_result.like('%"career_guidance"%')).limit(batch_size)
+            ).scalars().all()
+            if not users:
+                break
+            for user in users:
+                data = json.loads(user.final_result)
+                text = data.pop("career_guidance", None)
+                if text is not None:
+                    digest, statement = _insert_statement(text, user.username)
+                    db.execute(statement)
+                    user.career_guidance_hash = digest
+                user.final_result = json.dumps(data)
+            record("migrate_inline_guidance", "attempts")
+            try:
+                db.commit()
+            except StaleDataError:
+                # A user in the batch was written meanwhile (the API is running); the batch is re-read next round
+                record("migrate_inline_guidance", "conflicts")
+                db.rollback()
+                continue
+            moved += len(users)
+    return moved
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["migrate"]:
+        print(f"Moved guidance for {migrate_inline_guidance()} users")
+    else:
+        print("usage: python guidance_store.py migrate")
@@ -3,6 +3,9 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy import inspect
 from database import engine
 from models import Base, GapTestQuestion
+from question_search import rebuild_search_index
+from concept_graph import build_concept_graph
+from sharding import SHARD_COUNT, replicate_question_tables
 
 print("Creating database tables...")
 Base.metadata.create_all(bind=engine)
@@ -71,4 +74,17 @@ for file in json_files:
     except Exception as e:
         print(f"❌ Error loading {file}: {e}")
 
+print("\n🧭 Building the prerequisite graph...")
+with sessionmaker(bind=engine)() as session:
+    graph = build_concept_graph(session)
+print(f"✅ {len(graph.parents)} concepts, {sum(len(p) for p in graph.parents.values())} prerequisite links")
+
+print("\n🔎 Indexing questions for search...")
+print("✅ Indexed:", rebuild_search_index(["gap"]))
+
+if SHARD_COUNT > 1:
+    print("\n🗂️ Copying question tables to the user shards...")
+    replicate_question_tables()
+    print(f"✅ Replicated to {SHARD_COUNT - 1} shards")
+
 print("\n✅ Database initialization complete!")
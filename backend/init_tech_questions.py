@@ -1,11 +1,15 @@
 import json
 import sqlite3
 
+from cache import cache
+from question_search import rebuild_search_index
+from sharding import replicate_question_tables
+
 DB_PATH = "nextstep.db"
 JSON_FILE = "tech_questions.json"
 
 def create_table():
-    """Creates the technical_questions table if it doesn't exist."""
+    """Creates the technical_questions, submission_stats and similarity index tables if they don't exist."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
 
@@ -18,9 +22,60 @@ def create_table():
         expected_output TEXT NOT NULL,
         constraints TEXT NOT NULL,
         min_lines INTEGER NOT NULL,
-        max_lines INTEGER NOT NULL
+        max_lines INTEGER NOT NULL,
+        compare_mode TEXT NOT NULL DEFAULT 'exact',
+        float_epsilon REAL,
+        time_limit_ms INTEGER,
+        memory_limit_mb INTEGER
+    )
+    """)
+
+    # Resource usage of every judged submission
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS submission_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        question_id INTEGER NOT NULL,
+        language TEXT NOT NULL,
+        verdict TEXT NOT NULL,
+        wall_ms REAL,
+        cpu_ms REAL,
+        peak_rss_kb INTEGER,
+        output_bytes INTEGER,
+        created_at TEXT NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_submission_stats_question ON submission_stats (question_id, verdict)")
+
+    # MinHash signatures of accepted submissions, their LSH buckets and the likely copies found (see similarity.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS submission_signatures (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        question_id INTEGER NOT NULL,
+        language TEXT NOT NULL,
+        signature BLOB NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS submission_lsh (
+        question_id INTEGER NOT NULL,
+        band INTEGER NOT NULL,
+        bucket TEXT NOT NULL,
+        signature_id INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_submission_lsh_bucket ON submission_lsh (question_id, band, bucket)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS similar_submissions (
+        question_id INTEGER NOT NULL,
+        first_id INTEGER NOT NULL,
+        second_id INTEGER NOT NULL,
+        similarity REAL NOT NULL
     )
     """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_similar_submissions_question ON similar_submissions (question_id)")
 
     conn.commit()
     conn.close()
@@ -40,13 +95,19 @@ def load_questions():
 
         if not existing:
             cursor.execute("""
-            INSERT INTO technical_questions (id, title, problem_statement, input_example, expected_output, constraints, min_lines, max_lines)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO technical_questions (id, title, problem_statement, input_example, expected_output, constraints, min_lines, max_lines,
+                                             compare_mode, float_epsilon, time_limit_ms, memory_limit_mb)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (q["id"], q["title"], q["problem_statement"], q["input_example"],
-                  q["expected_output"], q["constraints"], q["min_lines"], q["max_lines"]))
+                  q["expected_output"], q["constraints"], q["min_lines"], q["max_lines"],
+                  q.get("compare_mode", "exact"), q.get("float_epsilon"), q.get("time_limit_ms"), q.get("memory_limit_mb")))
 
     conn.commit()
     conn.close()
+    rebuild_search_index(["technical"])
+    replicate_question_tables()
+    # Reaches the API only with CACHE_BACKEND=redis; a local cache picks the change up within its TTL
+    cache.namespace("tech_question").invalidate()
     print("Technical questions loaded successfully!")
 
 if __name__ == "__main__":
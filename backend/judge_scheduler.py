@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import math
+import os
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+# Scheduler settings (override with environment variables)
+JUDGE_CONCURRENCY = int(os.getenv("JUDGE_CONCURRENCY", "4"))  # Submissions executed at once
+JUDGE_QUEUE_LIMIT = int(os.getenv("JUDGE_QUEUE_LIMIT", "200"))  # Submissions waiting, across all users
+JUDGE_USER_BURST = int(os.getenv("JUDGE_USER_BURST", "5"))  # Token bucket size per user
+JUDGE_USER_RATE = float(os.getenv("JUDGE_USER_RATE", "0.5"))  # Tokens refilled per second per user
+WAIT_SAMPLE_SIZE = 1000  # Recent queue wait times kept for stats
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("JUDGE_SHUTDOWN_GRACE", "10"))  # Running jobs get this long to finish
+
+
+class SchedulerFull(Exception):
+    """Raised when a submission is not admitted; retry_after is in whole seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Per-user rate limit: `capacity` submissions at once, refilled at `rate` per second."""
+
+    def __init__(self, capacity: int, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """Take a token. Returns 0 on success, otherwise the seconds until one is available."""
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class JudgeScheduler:
+    """
+    Admission control and fair-share dispatch in front of code execution.
+
+    Each user has their own FIFO; users are served round-robin so one user's
+    backlog can't delay everyone else. At most `concurrency` jobs run at once
+    (in the threadpool, since execution is blocking I/O).
+    """
+
+    def __init__(self, concurrency: int, queue_limit: int, burst: int, rate: float):
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.burst = burst
+        self.rate = rate
+        self._queues = collections.OrderedDict()  # username -> deque of jobs, in round-robin order
+        self._buckets = {}
+        self._depth = 0
+        self._running = 0
+        self._service_time = 1.0  # EWMA of execution time, used for Retry-After estimates
+        self._waits = collections.deque(maxlen=WAIT_SAMPLE_SIZE)
+        self._tasks = set()  # Running jobs; strong references so they aren't collected mid-run
+        self._closing = False
+        self.completed = 0
+        self.rejected = 0
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._depth / max(self.concurrency, 1) * self._service_time))
+
+    def _admit(self, username: str):
+        if self._closing:
+            self.rejected += 1
+            raise SchedulerFull("Judge is shutting down", 1)
+        # Queue space first: a submission turned away because the queue is full shouldn't spend the user's token
+        if self._depth >= self.queue_limit:
+            self.rejected += 1
+            raise SchedulerFull("Judge queue is full", self._retry_after())
+
+        bucket = self._buckets.get(username)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._prune_buckets()
+            bucket = self._buckets[username] = TokenBucket(self.burst, self.rate)
+
+        wait = bucket.take()
+        if wait:
+            self.rejected += 1
+            raise SchedulerFull("Too many submissions, slow down", max(1, math.ceil(wait)))
+
+    def _prune_buckets(self):
+        """Drop buckets that have refilled completely; they carry no state."""
+        for username in list(self._buckets):
+            bucket = self._buckets[username]
+            bucket.refill()
+            if bucket.tokens >= bucket.capacity and username not in self._queues:
+                del self._buckets[username]
+
+    async def submit(self, username: str, fn, *args):
+        """Queue fn(*args) for `username` and wait for its result. Raises SchedulerFull if not admitted."""
+        self._admit(username)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(username, collections.deque()).append((future, fn, args, time.monotonic()))
+        self._depth += 1
+        self._dispatch()
+        return await future
+
+    def _dispatch(self):
+        while self._running < self.concurrency and self._queues:
+            username, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            self._depth -= 1
+            if queue:
+                self._queues.move_to_end(username)  # Next user's turn
+            else:
+                del self._queues[username]
+
+            if job[0].done():
+                continue  # Client went away while queued
+            self._running += 1
+            task = asyncio.ensure_future(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job):
+        future, fn, args, enqueued_at = job
+        started = time.monotonic()
+        self._waits.append(started - enqueued_at)
+        try:
+            result = await run_in_threadpool(fn, *args)
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started)
+            self._running -= 1
+            self.completed += 1
+            self._dispatch()
+
+    async def shutdown(self, grace: float = SHUTDOWN_GRACE_SECONDS):
+        """Stop admitting, fail what's still queued, and give running jobs `grace` seconds before cancelling them."""
+        self._closing = True
+        for queue in self._queues.values():
+            for future, *_ in queue:
+                if not future.done():
+                    future.set_exception(SchedulerFull("Judge is shutting down", 1))
+        self._queues.clear()
+        self._depth = 0
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=grace)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self):
+        """Queue depth, running jobs and recent wait-time percentiles (seconds)."""
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else 0.0
+
+        return {
+            "queue_depth": self._depth,
+            "queue_limit": self.queue_limit,
+            "running": self._running,
+            "concurrency": self.concurrency,
+            "users_waiting": len(self._queues),
+            "wait_p50": percentile(0.50),
+            "wait_p95": percentile(0.95),
+            "wait_max": round(waits[-1], 4) if waits else 0.0,
+            "avg_service_time": round(self._service_time, 4),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+judge_scheduler = JudgeScheduler(JUDGE_CONCURRENCY, JUDGE_QUEUE_LIMIT, JUDGE_USER_BURST, JUDGE_USER_RATE)
@@ -0,0 +1,241 @@
+"""
+Resilient access to the LLM used for career guidance.
+
+ResilientLLM wraps one or two providers with:
+  - an overall deadline per call (each HTTP request gets whatever time is left),
+  - jittered retries on retryable failures (timeouts, 429, 5xx),
+  - a hedged request to the secondary model if the primary hasn't answered
+    within HEDGE_AFTER_SECONDS (first success wins),
+  - a circuit breaker per provider, so calls fail fast while an upstream is down.
+
+Set LLM_PROVIDER=fake to use FakeProvider (no network) for local runs and tests.
+"""
+import concurrent.futures
+import os
+import random
+import threading
+import time
+
+import requests
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openrouter")  # "openrouter" or "fake"
+LLM_PRIMARY_MODEL = os.getenv("LLM_PRIMARY_MODEL", "gpt-3.5-turbo")
+LLM_SECONDARY_MODEL = os.getenv("LLM_SECONDARY_MODEL", "")  # Hedge/fallback model; empty disables hedging
+CALL_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))
+HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "20"))
+MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 0.5
+BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failures before a provider's circuit opens
+BREAKER_RESET_SECONDS = 30  # How long it stays open before a trial call is let through
+
+
+class ProviderError(Exception):
+    """A provider call failed. `retryable` says whether trying again could help."""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitOpenError(ProviderError):
+    """Every provider's circuit is open; the call was not attempted."""
+
+    def __init__(self, retry_after):
+        super().__init__("LLM provider unavailable", retryable=False)
+        self.retry_after = retry_after
+
+
+class OpenRouterProvider:
+    """OpenRouter (OpenAI-compatible) chat completions."""
+
+    def __init__(self, api_url, api_key, model, temperature=0.7):
+        self.name = f"openrouter:{model}"
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.temperature = temperature
+
+    def complete(self, prompt, timeout):
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature
+        }
+        try:
+            response = requests.post(self.api_url, headers=headers, json=payload, timeout=timeout)
+        except requests.RequestException as e:
+            raise ProviderError(f"{self.name}: {e}")
+
+        if response.status_code == 200:
+            return response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
+        retryable = response.status_code == 429 or response.status_code >= 500
+        raise ProviderError(f"{self.name}: {response.text}", retryable=retryable)
+
+
+class FakeProvider:
+    """Local stand-in: returns canned text after an optional delay, optionally failing first."""
+
+    def __init__(self, name="fake", response=None, latency=0.0, failures=0):
+        self.name = name
+        self.response = response
+        self.latency = latency
+        self.failures = failures
+        self.calls = 0
+
+    def complete(self, prompt, timeout):
+        self.calls += 1
+        time.sleep(min(self.latency, timeout))
+        if self.latency > timeout:
+            raise ProviderError(f"{self.name}: timed out")
+        if self.calls <= self.failures:
+            raise ProviderError(f"{self.name}: injected failure")
+        return self.response if self.response is not None else f"[{self.name}] guidance for a prompt of {len(prompt)} characters"
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open (one trial call) after a cool-down."""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_seconds and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def retry_after(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            return max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at)) + 1)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+
+class ResilientLLM:
+    def __init__(self, primary, secondary=None, deadline=CALL_DEADLINE_SECONDS, hedge_after=HEDGE_AFTER_SECONDS,
+                 max_attempts=MAX_ATTEMPTS):
+        self.providers = [p for p in (primary, secondary) if p is not None]
+        self.breakers = {p.name: CircuitBreaker() for p in self.providers}
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts
+        # Hedged losers keep running until their own timeout, so this is sized generously
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm")
+
+    def complete(self, prompt):
+        """Return the completion for `prompt`, or raise ProviderError within the deadline."""
+        deadline = time.monotonic() + self.deadline
+        last_error = None
+        for attempt in range(self.max_attempts):
+            try:
+                return self._hedged(prompt, deadline)
+            except CircuitOpenError:
+                raise
+            except ProviderError as e:
+                last_error = e
+                if not e.retryable:
+                    raise
+            delay = random.uniform(0, RETRY_BASE_SECONDS * (2 ** attempt))
+            if time.monotonic() + delay >= deadline:
+                break
+            time.sleep(delay)
+        raise last_error or ProviderError("LLM deadline exceeded")
+
+    def _call(self, provider, prompt, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ProviderError(f"{provider.name}: deadline exceeded")
+        breaker = self.breakers[provider.name]
+        try:
+            result = provider.complete(prompt, timeout=remaining)
+        except ProviderError:
+            breaker.record_failure()
+            raise
+        except Exception as e:
+            breaker.record_failure()
+            raise ProviderError(f"{provider.name}: {e}")
+        breaker.record_success()
+        return result
+
+    def _next_allowed(self, queue):
+        """Pop providers off `queue` until one's breaker lets a call through (allow() may claim a half-open trial,
+        so it's only asked of the provider about to be called)."""
+        while queue:
+            provider = queue.pop(0)
+            if self.breakers[provider.name].allow():
+                return provider
+        return None
+
+    def _hedged(self, prompt, deadline):
+        backups = list(self.providers)
+        primary = self._next_allowed(backups)
+        if primary is None:
+            raise CircuitOpenError(min(b.retry_after() for b in self.breakers.values()))
+
+        pending = {self.executor.submit(self._call, primary, prompt, deadline)}
+        errors = []
+        wait_for = min(self.hedge_after, deadline - time.monotonic()) if backups else deadline - time.monotonic()
+
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=max(0, wait_for),
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except ProviderError as e:
+                    errors.append(e)
+
+            backup = self._next_allowed(backups) if backups and (not done or not pending) else None
+            if backup is not None:
+                # Primary is slow (hedge) or already failed (fallback): bring in the next provider
+                pending.add(self.executor.submit(self._call, backup, prompt, deadline))
+            elif not done:
+                break  # Deadline reached
+            wait_for = min(self.hedge_after, deadline - time.monotonic()) if backups else deadline - time.monotonic()
+
+        if errors:
+            raise ProviderError("; ".join(str(e) for e in errors), retryable=any(e.retryable for e in errors))
+        raise ProviderError("LLM deadline exceeded")
+
+    def status(self):
+        return {name: breaker.state() for name, breaker in self.breakers.items()}
+
+
+def build_llm(api_url, api_key):
+    """Build the process-wide LLM client from the LLM_* settings."""
+    if LLM_PROVIDER == "fake":
+        return ResilientLLM(FakeProvider())
+    primary = OpenRouterProvider(api_url, api_key, LLM_PRIMARY_MODEL)
+    secondary = OpenRouterProvider(api_url, api_key, LLM_SECONDARY_MODEL) if LLM_SECONDARY_MODEL else None
+    return ResilientLLM(primary, secondary)
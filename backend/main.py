@@ -1,33 +1,140 @@
-from fastapi import FastAPI
+import os
+
+from fastapi import FastAPI, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from database import engine, Base
+import models
+from database import engine, shard_engines, async_shard_engines, Base, ensure_column
+from sharding import create_email_index, replicate_question_tables
+from concurrency import get_conflict_stats
+from cache import cache
+from compression import CompressionMiddleware, FrontendFiles
+from worker_pool import LOCAL_RUNNER_LANGUAGES, get_pool, shutdown_pools
+from gap_sessions import gap_sessions
+from judge_scheduler import judge_scheduler
+from auth import require_admin
+from profiling import TimedJSONResponse, TimedRequests, instrument_engine, profiler, slow_requests
+from init_tech_questions import create_table as create_technical_tables
 from auth_routes import router as auth_router  # ✅ Importing authentication routes
 from nontech_test import router as non_tech_router  # ✅ Importing non-technical test routes
 from gap_test import router as gap_router
 from technical_test import router as tech_router
 from results import router as results_router
 from final_result import router as final_result_router
+from export import router as export_router
+from question_search import router as search_router, ensure_search_index
 
+# Built React app (frontend/build) to serve from this process; unset, the frontend is served separately
+FRONTEND_BUILD_DIR = os.getenv("FRONTEND_BUILD_DIR")
 
-app = FastAPI()
+app = FastAPI(default_response_class=TimedJSONResponse)
 
 # Create database tables (if not already created)
 Base.metadata.create_all(bind=engine)
 
+# Tables defined in models.py that may be newer than the database (e.g. career_guidance), on every user shard
+for shard_engine in shard_engines.values():
+    models.Base.metadata.create_all(bind=shard_engine)
+
+# Version column used for optimistic locking on users (older databases predate it)
+ensure_column("users", "version", "INTEGER NOT NULL DEFAULT 0")
+# Per-question output comparison settings for the judge
+ensure_column("technical_questions", "compare_mode", "TEXT NOT NULL DEFAULT 'exact'")
+ensure_column("technical_questions", "float_epsilon", "REAL")
+# Per-question resource limits, and the table recording each submission's usage
+ensure_column("technical_questions", "time_limit_ms", "INTEGER")
+ensure_column("technical_questions", "memory_limit_mb", "INTEGER")
+create_technical_tables()
+# Final results reference their guidance text by hash
+ensure_column("users", "career_guidance_hash", "TEXT")
+# Read-only question banks are copied from the primary to the other user shards
+replicate_question_tables()
+# Emails are unique across shards through an index on the primary, filled from existing users
+create_email_index()
+# Full-text index over the question banks (built here once if the importers haven't)
+ensure_search_index()
+
+# Per-phase request timings (auth, db, execution, llm, serialization) for the slow-request log;
+# SQLAlchemy query timing only attaches during a profiler capture unless DB_PHASE_TIMING=always
+app.add_middleware(TimedRequests)
+for shard_engine in shard_engines.values():
+    instrument_engine(shard_engine)
+for shard_engine in async_shard_engines.values():
+    instrument_engine(shard_engine.sync_engine)
+
 # Enable CORS (Adjust as needed)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all for debugging (secure it later),
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],  # Ensures OPTIONS method works for preflight
-    allow_headers=["Content-Type", "Authorization"],  # Only allow necessary headers
+    allow_headers=["Content-Type", "Authorization", "If-None-Match"],  # Only allow necessary headers
+    expose_headers=["ETag"],  # The dashboard revalidates with it
 )
 
-# Root Endpoint
-@app.get("/")
-def read_root():
-    return {"message": "Hello from FastAPI!"}
+# brotli/gzip for large JSON (final results, question banks, exports), negotiated per request
+app.add_middleware(CompressionMiddleware)
+
+# Let submissions being judged finish (or cancel them) before the worker pools go away
+@app.on_event("shutdown")
+async def drain_judge():
+    await judge_scheduler.shutdown()
+
+# Start warm code-execution workers up front so the first submissions don't pay for it
+@app.on_event("startup")
+def start_worker_pools():
+    for language in LOCAL_RUNNER_LANGUAGES:
+        get_pool(language)
+
+@app.on_event("shutdown")
+def stop_worker_pools():
+    shutdown_pools()
+
+# Write-behind flusher for live gap tests; everything still in memory is written back at shutdown
+@app.on_event("startup")
+async def start_gap_session_flusher():
+    gap_sessions.start()
+
+@app.on_event("shutdown")
+async def flush_gap_sessions():
+    await gap_sessions.stop()
 
+# Root Endpoint (the frontend's index.html takes "/" when it's served from here)
+if not FRONTEND_BUILD_DIR:
+    @app.get("/")
+    def read_root():
+        return {"message": "Hello from FastAPI!"}
+
+# Optimistic-locking conflict counters per operation
+@app.get("/metrics/concurrency")
+def concurrency_metrics():
+    return get_conflict_stats()
+
+# Hit/miss/load counts per cache namespace
+@app.get("/metrics/cache")
+def cache_metrics():
+    return cache.stats()
+
+# ----------------------- Admin profiling -----------------------
+
+@app.post("/admin/profile/start")
+def start_profile(seconds: float = 10, interval_ms: float = 5, admin=Depends(require_admin)):
+    """Start a sampling-profiler capture of every thread for `seconds`."""
+    if not profiler.start(seconds, interval_ms):
+        raise HTTPException(status_code=409, detail="A capture is already running")
+    return profiler.status()
+
+@app.get("/admin/profile")
+def get_profile(format: str = "json", admin=Depends(require_admin)):
+    """Capture status, or the folded stacks (format=folded) for flamegraph.pl / speedscope."""
+    if format == "folded":
+        return PlainTextResponse(profiler.folded())
+    return profiler.status()
+
+@app.get("/admin/slow_requests")
+def get_slow_requests(admin=Depends(require_admin)):
+    """Most recent slow requests, newest first, with per-phase timings."""
+    return list(reversed(slow_requests))
 
 
 # Include authentication routes
@@ -43,3 +150,11 @@ app.include_router(tech_router)
 app.include_router(results_router)
 
 app.include_router(final_result_router)
+
+app.include_router(export_router)
+
+app.include_router(search_router)
+
+# Must stay last: the mount catches every path no API route matched
+if FRONTEND_BUILD_DIR:
+    app.mount("/", FrontendFiles(FRONTEND_BUILD_DIR), name="frontend")
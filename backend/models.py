@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Text, Integer, String, JSON
+from sqlalchemy import Column, Text, Integer, String, JSON, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from passlib.context import CryptContext
 
@@ -16,6 +16,11 @@ class User(Base):
     technical_test = Column(Text, nullable=True)
     non_technical_test = Column(Text, nullable=True)
     final_result = Column(Text, nullable=True)
+    career_guidance_hash = Column(String, nullable=True)  # Points at CareerGuidance.hash (guidance text isn't kept inline)
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # Bumped on every update (optimistic locking)
+
+    # SQLAlchemy adds "AND version = :old" to every UPDATE and raises StaleDataError if another writer got there first
+    __mapper_args__ = {"version_id_col": version}
 
     @staticmethod
     def hash_password(password: str) -> str:
@@ -38,3 +43,12 @@ class GapTestQuestion(Base):
     answer = Column(Text, nullable=False)
     difficulty = Column(String, nullable=False)
     prerequisites = Column(JSON, nullable=True)  # Store prerequisites as JSON
+
+
+class CareerGuidance(Base):
+    __tablename__ = "career_guidance"
+
+    hash = Column(String, primary_key=True)  # SHA-256 of the uncompressed text
+    codec = Column(String, nullable=False)  # "zstd" or "zlib"
+    body = Column(LargeBinary, nullable=False)  # Compressed text
+    size = Column(Integer, nullable=False)  # Uncompressed size in bytes
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from concurrency import run_with_retry
 from models import User  # Ensure the User model is correctly imported
 from pydantic import BaseModel
 from typing import Dict
@@ -13,25 +15,30 @@ class NonTechTestRequest(BaseModel):
     responses: Dict[int, int]  # {question_id: likert_scale_value}
 
 @router.post("/submit_non_tech_test")
-def submit_non_tech_test(data: NonTechTestRequest, db: Session = Depends(get_db)):
+async def submit_non_tech_test(data: NonTechTestRequest, db: AsyncSession = Depends(get_async_db)):
     # Verify user exists
-    user = db.query(User).filter(User.username == data.username).first()
+    result = await db.execute(select(User).where(User.username == data.username))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     try:
         # Analyze personality type
         personality_type = analyze_personality(data.responses)
+    except Exception as e:
+        await db.rollback()  # Rollback if an error occurs
+        raise HTTPException(status_code=500, detail=f"Error processing test: {str(e)}")
 
-        # Store result in the database
+    async def attempt():
+        # Re-read on every attempt: a gap-session flush or technical-test update may have bumped users.version
+        result = await db.execute(select(User).where(User.username == data.username))
+        user = result.scalars().first()
         user.non_technical_test = personality_type
-        db.commit()
 
-        return {"message": "Test submitted successfully", "personality_type": personality_type}
+    # Store result in the database (only this column changes, so a lost version race just retries)
+    await run_with_retry(db, "submit_non_tech_test", attempt)
 
-    except Exception as e:
-        db.rollback()  # Rollback if an error occurs
-        raise HTTPException(status_code=500, detail=f"Error processing test: {str(e)}")
+    return {"message": "Test submitted successfully", "personality_type": personality_type}
 
 def analyze_personality(responses: Dict[int, int]) -> str:
     """Analyze MBTI-based coder personality from responses."""
@@ -64,8 +71,9 @@ def analyze_personality(responses: Dict[int, int]) -> str:
     return personality
 
 @router.get("/get_result")
-def get_result(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+async def get_result(username: str, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalars().first()
     if not user or not user.non_technical_test:
         raise HTTPException(status_code=404, detail="Result not found")
     return {"personality_type": user.non_technical_test}
\ No newline at end of file
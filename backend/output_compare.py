@@ -0,0 +1,211 @@
+"""
+Streaming comparison of a program's output against the expected output.
+
+Output is fed in chunks as it arrives from the sandbox, and only a bounded
+amount of it is ever held in memory. A comparator stops accepting chunks as
+soon as a mismatch is certain or the output passes the size cap.
+
+Modes (per question, `compare_mode` column):
+    exact       line by line; line endings, trailing spaces on a line and
+                leading/trailing blank output are ignored
+    tokens      whitespace-separated tokens must match in order
+    whitespace  all whitespace is ignored, the remaining characters must match
+    float       like tokens, but numeric tokens match within `float_epsilon`
+"""
+import math
+
+COMPARE_MODES = ("exact", "tokens", "whitespace", "float")
+DEFAULT_EPSILON = 1e-6
+OUTPUT_LIMIT_CHARS = 1024 * 1024
+PREVIEW_CHARS = 500  # How much output is kept to show back to the user
+MAX_TOKEN_CHARS = 4096  # Longer tokens can't match anything in the float mode
+
+
+class OutputComparator:
+    """Base class: tracks output size and a short preview; subclasses do the matching."""
+
+    def __init__(self, expected: str, output_limit: int = OUTPUT_LIMIT_CHARS):
+        self.expected = expected
+        self.output_limit = output_limit
+        self.output_size = 0
+        self.preview = ""
+        self.mismatch = None  # Reason string once the output can no longer match
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk of output. Returns False once the result is decided as a mismatch."""
+        if self.mismatch:
+            return False
+        self.output_size += len(chunk)
+        if len(self.preview) < PREVIEW_CHARS:
+            self.preview += chunk[:PREVIEW_CHARS - len(self.preview)]
+        if self.output_size > self.output_limit:
+            self.mismatch = "Output limit exceeded"
+            return False
+        self._consume(chunk)
+        return not self.mismatch
+
+    def finish(self):
+        """Returns (matched, reason) once the program's output has ended."""
+        if not self.mismatch:
+            self._finish()
+        return self.mismatch is None, self.mismatch
+
+    def _consume(self, chunk: str):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+
+class ExactComparator(OutputComparator):
+    def __init__(self, expected: str, **kwargs):
+        super().__init__(expected, **kwargs)
+        self.expected_lines = [line.rstrip() for line in normalize_newlines(expected.strip()).split("\n")]
+        self.line_no = 0
+        self.partial = ""
+        self.started = False  # Leading whitespace before the first real output is ignored
+        self.pending_cr = False
+
+    def _expected_line(self):
+        return self.expected_lines[self.line_no] if self.line_no < len(self.expected_lines) else ""
+
+    def _consume(self, chunk):
+        if self.pending_cr:
+            chunk = "\r" + chunk
+            self.pending_cr = False
+        if chunk.endswith("\r"):
+            # Might be the first half of a \r\n split across chunks
+            chunk, self.pending_cr = chunk[:-1], True
+        chunk = normalize_newlines(chunk)
+
+        if not self.started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return
+            self.started = True
+
+        *complete, self.partial = (self.partial + chunk).split("\n")
+        for line in complete:
+            if line.rstrip() != self._expected_line():
+                self.mismatch = f"Line {self.line_no + 1} differs"
+                return
+            self.line_no += 1
+        self._check_partial()
+
+    def _check_partial(self):
+        """Fail early on a partial line that can't match, and keep its buffered size bounded."""
+        expected = self._expected_line()
+        head, tail = self.partial[:len(expected)], self.partial[len(expected):]
+        if not expected.startswith(head) or tail.strip():
+            self.mismatch = f"Line {self.line_no + 1} differs"
+        else:
+            self.partial = head  # Only trailing whitespace beyond the expected line, which doesn't count
+
+    def _finish(self):
+        if self.partial.rstrip():
+            if self.partial.rstrip() != self._expected_line():
+                self.mismatch = f"Line {self.line_no + 1} differs"
+                return
+            self.line_no += 1
+        if not self.started and self.expected_lines != [""]:
+            self.mismatch = "No output"
+        elif self.started and self.line_no < len(self.expected_lines):
+            self.mismatch = f"Output ended early at line {self.line_no + 1}"
+
+
+class TokenComparator(OutputComparator):
+    def __init__(self, expected: str, **kwargs):
+        super().__init__(expected, **kwargs)
+        self.expected_tokens = expected.split()
+        self.index = 0
+        self.partial = ""
+
+    def _expected_token(self):
+        return self.expected_tokens[self.index] if self.index < len(self.expected_tokens) else None
+
+    def _tokens_match(self, actual, expected):
+        return actual == expected
+
+    def _partial_can_match(self, partial, expected):
+        return expected.startswith(partial)
+
+    def _consume(self, chunk):
+        text = self.partial + chunk
+        tokens = text.split()
+        # The last token may continue in the next chunk unless the chunk ended on whitespace
+        self.partial = tokens.pop() if tokens and not text[-1].isspace() else ""
+        for token in tokens:
+            expected = self._expected_token()
+            if expected is None or not self._tokens_match(token, expected):
+                self.mismatch = f"Token {self.index + 1} differs"
+                return
+            self.index += 1
+
+        if self.partial:
+            expected = self._expected_token()
+            if expected is None or not self._partial_can_match(self.partial, expected):
+                self.mismatch = f"Token {self.index + 1} differs"
+
+    def _finish(self):
+        if self.partial:
+            self._consume(" ")
+            if self.mismatch:
+                return
+        if self.index < len(self.expected_tokens):
+            self.mismatch = f"Output ended early at token {self.index + 1}"
+
+
+class FloatComparator(TokenComparator):
+    def __init__(self, expected: str, epsilon: float = DEFAULT_EPSILON, **kwargs):
+        super().__init__(expected, **kwargs)
+        self.epsilon = epsilon
+
+    def _tokens_match(self, actual, expected):
+        if actual == expected:
+            return True
+        try:
+            a, b = float(actual), float(expected)
+        except ValueError:
+            return False
+        if math.isnan(a) or math.isnan(b):
+            return False
+        return abs(a - b) <= self.epsilon * max(1.0, abs(b))
+
+    def _partial_can_match(self, partial, expected):
+        # Numbers can't be checked by prefix ("3.1" may become "3.14"), only bounded in length
+        return len(partial) <= max(MAX_TOKEN_CHARS, len(expected))
+
+
+class WhitespaceComparator(OutputComparator):
+    def __init__(self, expected: str, **kwargs):
+        super().__init__(expected, **kwargs)
+        self.expected_chars = "".join(expected.split())
+        self.position = 0
+
+    def _consume(self, chunk):
+        chars = "".join(chunk.split())
+        end = self.position + len(chars)
+        if self.expected_chars[self.position:end] != chars:
+            self.mismatch = f"Output differs at character {self.position + 1}"
+            return
+        self.position = end
+
+    def _finish(self):
+        if self.position < len(self.expected_chars):
+            self.mismatch = "Output ended early"
+
+
+def normalize_newlines(text: str) -> str:
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def make_comparator(expected: str, mode: str = "exact", epsilon: float = None, output_limit: int = OUTPUT_LIMIT_CHARS):
+    """Build the comparator for a question's compare mode."""
+    mode = (mode or "exact").lower()
+    if mode == "tokens":
+        return TokenComparator(expected, output_limit=output_limit)
+    if mode == "whitespace":
+        return WhitespaceComparator(expected, output_limit=output_limit)
+    if mode == "float":
+        return FloatComparator(expected, epsilon=epsilon if epsilon is not None else DEFAULT_EPSILON, output_limit=output_limit)
+    return ExactComparator(expected, output_limit=output_limit)
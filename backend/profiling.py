@@ -0,0 +1,241 @@
+"""
+Request phase timings, a rolling slow-request log and an on-demand sampling profiler.
+
+Every request gets a phase record through a context variable, set by the
+TimedRequests ASGI middleware. Code marks its phases with
+`with phase("auth"):`; code on raw sqlite3 connections wraps them in
+`phase("db")` itself. Phases are exclusive: time spent in a nested phase is
+not counted again in the outer one, and whatever is left is "other".
+Requests slower than SLOW_REQUEST_MS are kept in a ring buffer of
+SLOW_LOG_SIZE entries.
+
+SQLAlchemy queries are timed as "db" through engine events. Event dispatch
+costs every statement something even outside a request, so by default
+(DB_PHASE_TIMING=capture) the listeners are only attached while a profiler
+capture runs; DB_PHASE_TIMING=always keeps them on.
+
+The sampling profiler is a background thread that only exists while a
+capture is running. It reads every thread's stack via sys._current_frames()
+and aggregates folded stacks ("frame;frame;frame count"), the input format
+of flamegraph.pl and speedscope.
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_LOG_SIZE = int(os.getenv("SLOW_LOG_SIZE", "200"))
+DB_PHASE_TIMING = os.getenv("DB_PHASE_TIMING", "capture")  # "always", or "capture": only while the profiler runs
+MAX_CAPTURE_SECONDS = 120
+MIN_SAMPLE_INTERVAL_MS = 1
+
+_current = contextvars.ContextVar("request_phases", default=None)
+slow_requests = deque(maxlen=SLOW_LOG_SIZE)
+
+
+class PhaseRecord:
+    def __init__(self):
+        self.totals = {}
+        self.stack = []  # [name, started, time spent in nested phases]
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        name, started, nested = self.stack.pop()
+        elapsed = time.perf_counter() - started
+        self.totals[name] = self.totals.get(name, 0.0) + elapsed - nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+
+@contextmanager
+def phase(name):
+    """Attribute the enclosed time to a phase of the current request (no-op outside a request)."""
+    record = _current.get()
+    if record is None:
+        yield
+        return
+    record.enter(name)
+    try:
+        yield
+    finally:
+        record.exit()
+
+
+class TimedRequests:
+    """ASGI middleware: time each HTTP request's phases and log it if it was slow."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        record = PhaseRecord()
+        token = _current.set(record)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            total = time.perf_counter() - started
+            _current.reset(token)
+            if total * 1000 >= SLOW_REQUEST_MS:
+                phases = {name: round(seconds * 1000, 2) for name, seconds in record.totals.items()}
+                phases["other"] = round(max(0.0, total * 1000 - sum(phases.values())), 2)
+                slow_requests.append({
+                    "at": datetime.utcnow().isoformat(),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status_code,
+                    "total_ms": round(total * 1000, 2),
+                    "phases_ms": phases,
+                })
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse whose encoding is counted as the "serialization" phase."""
+
+    def render(self, content):
+        with phase("serialization"):
+            return super().render(content)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    record = _current.get()
+    if record is not None:
+        record.enter("db")
+        context._phase_record = record
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    record = getattr(context, "_phase_record", None)
+    if record is not None:
+        record.exit()
+        context._phase_record = None
+
+
+def _execute_error(exception_context):
+    context = exception_context.execution_context
+    record = getattr(context, "_phase_record", None) if context is not None else None
+    if record is not None:
+        record.exit()
+        context._phase_record = None
+
+
+_DB_LISTENERS = (("before_cursor_execute", _before_execute), ("after_cursor_execute", _after_execute),
+                 ("handle_error", _execute_error))
+_instrumented_engines = []
+_db_timing = DB_PHASE_TIMING == "always"
+_db_timing_lock = threading.Lock()
+
+
+def instrument_engine(engine):
+    """Count queries on a (sync) SQLAlchemy engine as "db" time, whenever SQL timing is on."""
+    with _db_timing_lock:
+        _instrumented_engines.append(engine)
+        if _db_timing:
+            for name, listener in _DB_LISTENERS:
+                event.listen(engine, name, listener)
+
+
+def set_db_timing(enabled: bool):
+    """Attach or detach the query listeners. Detached, statements don't pay for event dispatch at all."""
+    global _db_timing
+    with _db_timing_lock:
+        if enabled == _db_timing:
+            return
+        _db_timing = enabled
+        for engine in _instrumented_engines:
+            for name, listener in _DB_LISTENERS:
+                (event.listen if enabled else event.remove)(engine, name, listener)
+
+
+class SamplingProfiler:
+    """Samples all thread stacks at a fixed interval for a bounded window."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.finished_at = None
+        self.seconds = 0
+        self.interval = 0
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds, interval_ms):
+        """Begin a capture; returns False if one is already running."""
+        with self.lock:
+            if self.running():
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.seconds = min(seconds, MAX_CAPTURE_SECONDS)
+            self.interval = max(interval_ms, MIN_SAMPLE_INTERVAL_MS) / 1000
+            self.started_at = datetime.utcnow().isoformat()
+            self.finished_at = None
+            self.thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+            if DB_PHASE_TIMING == "capture":
+                set_db_timing(True)
+            self.thread.start()
+            return True
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                frames.append(f"thread {names.get(thread_id, thread_id)}")
+                self.stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        if DB_PHASE_TIMING == "capture":
+            set_db_timing(False)
+        self.finished_at = datetime.utcnow().isoformat()
+
+    def status(self):
+        return {
+            "running": self.running(),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "seconds": self.seconds,
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks),
+        }
+
+    def folded(self):
+        """Folded stacks, one "root;...;leaf count" line each."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+profiler = SamplingProfiler()
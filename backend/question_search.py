@@ -0,0 +1,177 @@
+"""
+Full-text search over the gap and technical question banks (SQLite FTS5).
+
+question_search holds one row per question: gap questions index their text,
+options and prerequisites; technical questions their title and problem
+statement. The importers (init_db.py, init_tech_questions.py) rebuild their
+part of the index after loading, and startup builds it once for databases
+that predate it. To rebuild by hand:
+
+    python question_search.py rebuild
+"""
+import json
+import re
+import sqlite3
+import time
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from auth import require_admin
+from models import User
+from profiling import phase
+
+DB_PATH = "nextstep.db"
+KINDS = ("gap", "technical")
+MAX_RESULTS = 100
+# bm25 column weights: kind, item_id, topic, difficulty (unindexed), title, body, options, prerequisites
+RANK_WEIGHTS = (0, 0, 0, 0, 4.0, 2.0, 1.0, 1.0)
+
+router = APIRouter(prefix="/search", tags=["Search"])
+
+
+def create_search_index(conn):
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS question_search USING fts5(
+        kind UNINDEXED,
+        item_id UNINDEXED,
+        topic UNINDEXED,
+        difficulty UNINDEXED,
+        title,
+        body,
+        options,
+        prerequisites,
+        tokenize = 'porter unicode61'
+    )
+    """)
+
+
+def _text(value):
+    """Gap question JSON columns (options list, prerequisite string or list) as plain text."""
+    if value is None:
+        return ""
+    try:
+        value = json.loads(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if isinstance(value, list):
+        return " | ".join(str(v) for v in value)
+    return str(value)
+
+
+def index_gap_questions(conn):
+    conn.execute("DELETE FROM question_search WHERE kind = 'gap'")
+    rows = conn.execute("SELECT id, topic, difficulty, question, options, prerequisites FROM gap_test_questions").fetchall()
+    conn.executemany(
+        "INSERT INTO question_search (kind, item_id, topic, difficulty, title, body, options, prerequisites) "
+        "VALUES ('gap', ?, ?, ?, ?, '', ?, ?)",
+        [(r[0], r[1], r[2], r[3], _text(r[4]), _text(r[5])) for r in rows]
+    )
+    return len(rows)
+
+
+def index_technical_questions(conn):
+    conn.execute("DELETE FROM question_search WHERE kind = 'technical'")
+    cursor = conn.execute("""
+        INSERT INTO question_search (kind, item_id, topic, difficulty, title, body, options, prerequisites)
+        SELECT 'technical', id, NULL, NULL, title, problem_statement, '', '' FROM technical_questions
+    """)
+    return cursor.rowcount
+
+
+def rebuild_search_index(kinds=KINDS):
+    """Re-index the given question banks from their tables."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        create_search_index(conn)
+        counts = {}
+        if "gap" in kinds:
+            counts["gap"] = index_gap_questions(conn)
+        if "technical" in kinds:
+            counts["technical"] = index_technical_questions(conn)
+        conn.execute("INSERT INTO question_search (question_search) VALUES ('optimize')")
+        conn.commit()
+        return counts
+    finally:
+        conn.close()
+
+
+def ensure_search_index():
+    """Create the index, building it if it's empty (databases loaded before it existed)."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        create_search_index(conn)
+        conn.commit()
+        empty = conn.execute("SELECT 1 FROM question_search LIMIT 1").fetchone() is None
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+    if empty:
+        rebuild_search_index([k for k, table in (("gap", "gap_test_questions"), ("technical", "technical_questions"))
+                              if table in tables])
+
+
+def match_expression(query: str):
+    """
+    Turn free text into a safe FTS5 query: every word must match (as a quoted term, so
+    FTS5 operators in user input are taken literally); a trailing * keeps prefix matching.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if re.search(r"\w", word):
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search_questions(query, kind=None, topic=None, difficulty=None, limit=20):
+    expression = match_expression(query)
+    if not expression:
+        return []
+    sql = f"""
+        SELECT kind, item_id, topic, difficulty, title,
+               snippet(question_search, -1, '[', ']', '…', 12),
+               bm25(question_search, {", ".join(str(w) for w in RANK_WEIGHTS)}) AS rank
+        FROM question_search
+        WHERE question_search MATCH ?
+    """
+    params = [expression]
+    for column, value in (("kind", kind), ("topic", topic), ("difficulty", difficulty)):
+        if value is not None:
+            sql += f" AND {column} = ?"
+            params.append(value)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+
+    with phase("db"):
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+    return [
+        {"kind": r[0], "id": int(r[1]), "topic": r[2], "difficulty": r[3], "title": r[4], "snippet": r[5],
+         "score": round(-r[6], 3)}
+        for r in rows
+    ]
+
+
+@router.get("/questions")
+def search(q: str, kind: str = None, topic: str = None, difficulty: str = None, limit: int = 20,
+           admin: User = Depends(require_admin)):
+    """Ranked search across both question banks, optionally filtered by bank, topic and difficulty."""
+    if kind is not None and kind not in KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(KINDS)}")
+    limit = max(1, min(limit, MAX_RESULTS))
+    started = time.perf_counter()
+    results = search_questions(q, kind, topic, difficulty, limit)
+    return {"query": q, "results": results, "took_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["rebuild"]:
+        print(f"Indexed questions: {rebuild_search_index()}")
+    else:
+        print("usage: python question_search.py rebuild")
@@ -1,37 +1,218 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
-from models import User
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from pydantic import BaseModel
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from models import User, CareerGuidance
+from guidance_store import decompress_guidance
+from profiling import TimedJSONResponse
+from auth import require_admin
+from gap_sessions import gap_sessions
+from concept_graph import concept_mastery
+from sharding import scatter_gather
+import hashlib
 import json
 
 router = APIRouter(prefix="/results", tags=["Results"])
 
+# ----------------------- Column decoding -----------------------
+# The result columns hold JSON text; these helpers are shared with export and other bulk readers.
+
+def load_json_column(raw):
+    if raw is None or raw == "":
+        return None
+    return json.loads(raw) if isinstance(raw, str) else raw
+
+def decode_gap_analysis(raw):
+    data = load_json_column(raw)
+    if data is None:
+        return None
+    return {
+        "topic_ratings": data.get("topic_ratings", {}),
+        "average_elo": data.get("average_elo", 0),
+        "concept_mastery": {
+            concept: {**stats, "mastery": round(concept_mastery(stats), 2)}
+            for concept, stats in data.get("concept_mastery", {}).items()
+        },
+    }
+
+def decode_technical_test(raw):
+    data = load_json_column(raw)
+    if data is None:
+        return None
+    return {"solved": data.get("solved", 0), "milestone": data.get("milestone", "0")}
+
+def decode_final_result(raw):
+    return load_json_column(raw)
+
 @router.get("/gap_analysis/{username}")
-def get_gap_analysis_result(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+async def get_gap_analysis_result(username: str, db: AsyncSession = Depends(get_async_db)):
+    # A test in progress is newer in the session store than in the database
+    live = gap_sessions.peek(username)
+    if live:
+        return decode_gap_analysis(live)
+
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalars().first()
     if not user or not user.gap_analysis:
         raise HTTPException(status_code=404, detail="Gap analysis result not found")
     
-    # Parse the stored JSON string
-    gap_analysis_data = json.loads(user.gap_analysis)
-
-    # Extract topic ratings and average elo
-    topic_ratings = gap_analysis_data.get("topic_ratings", {})
-    average_elo = gap_analysis_data.get("average_elo", 0)
-
-    return {"topic_ratings": topic_ratings, "average_elo": average_elo}
+    # Parse the stored JSON string and extract topic ratings and average elo
+    return decode_gap_analysis(user.gap_analysis)
 
 @router.get("/technical_test/{username}")
-def get_technical_test_result(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+async def get_technical_test_result(username: str, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalars().first()
     if not user or not user.technical_test:
         raise HTTPException(status_code=404, detail="Technical test result not found")
 
-    # Parse the stored JSON string
-    tech_test_data = json.loads(user.technical_test)
+    # Parse the stored JSON string and extract solved count and milestone (default to 0 if missing)
+    return decode_technical_test(user.technical_test)
+
+# ----------------------- Dashboard -----------------------
+# Everything the dashboard shows, from one row read, with a combined ETag.
+
+DASHBOARD_FIELDS = {
+    "gap_analysis": (User.gap_analysis,),
+    "technical_test": (User.technical_test,),
+    "personality_type": (User.non_technical_test,),
+    "final_result": (User.final_result, CareerGuidance.codec.label("guidance_codec"),
+                     CareerGuidance.body.label("guidance_body")),
+}
+
+def dashboard_etag(username, version, fields, live_gap):
+    """users.version changes on every write to the row; a live gap test adds its in-memory state."""
+    key = f"{username}:{version}:{','.join(fields)}"
+    if live_gap is not None:
+        key += ":" + json.dumps(live_gap, sort_keys=True)
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+@router.get("/dashboard/{username}")
+async def get_dashboard(username: str, request: Request, fields: str = ",".join(DASHBOARD_FIELDS),
+                        db: AsyncSession = Depends(get_async_db)):
+    """
+    Gap analysis, technical progress, personality type and final result in one response.
+    `fields` is a comma-separated mask; only those columns are read and decoded.
+    Sends an ETag and answers If-None-Match with 304.
+    """
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in DASHBOARD_FIELDS]
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail=f"fields must be drawn from: {', '.join(DASHBOARD_FIELDS)}")
+
+    columns = [User.version] + [column for field in requested for column in DASHBOARD_FIELDS[field]]
+    query = select(*columns).where(User.username == username)
+    if "final_result" in requested:
+        query = query.outerjoin(CareerGuidance, CareerGuidance.hash == User.career_guidance_hash)
+    row = (await db.execute(query)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    live_gap = gap_sessions.peek(username) if "gap_analysis" in requested else None
+    etag = dashboard_etag(username, row.version, requested, live_gap)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    body = {"username": username}
+    if "gap_analysis" in requested:
+        body["gap_analysis"] = decode_gap_analysis(live_gap or row.gap_analysis)
+    if "technical_test" in requested:
+        body["technical_test"] = decode_technical_test(row.technical_test)
+    if "personality_type" in requested:
+        body["personality_type"] = row.non_technical_test
+    if "final_result" in requested:
+        final = decode_final_result(row.final_result)
+        if final is not None and "career_guidance" not in final and row.guidance_body is not None:
+            final["career_guidance"] = decompress_guidance(row.guidance_codec, row.guidance_body)
+        body["final_result"] = final
+
+    return TimedJSONResponse(body, headers=headers)
+
+# ----------------------- Batch results -----------------------
+# Many users per call, one keyset-paginated query per page, returned column by column.
+
+BATCH_PAGE_SIZE = 500
+BATCH_MAX_PAGE_SIZE = 900  # Stays under SQLite's bound-parameter limit for IN lists
+BATCH_MAX_USERNAMES = 50000
+
+class BatchResultsRequest(BaseModel):
+    usernames: Optional[List[str]] = None
+    email_domain: Optional[str] = None  # Cohort filter: users whose email ends with @<domain>
+    username_prefix: Optional[str] = None  # Cohort filter: usernames starting with this
+    after: Optional[str] = None  # Cursor: the next_cursor of the previous page
+    limit: int = BATCH_PAGE_SIZE
+
+BATCH_COLUMNS = (User.username, User.gap_analysis, User.technical_test, User.non_technical_test, User.final_result)
+
+def batch_query(request: BatchResultsRequest, limit: int):
+    """One page of users, ordered by username (the primary key) after the cursor."""
+    query = select(*BATCH_COLUMNS).order_by(User.username).limit(limit)
+    if request.after is not None:
+        query = query.where(User.username > request.after)
+    if request.usernames is not None:
+        wanted = sorted(set(request.usernames))
+        if request.after is not None:
+            wanted = [u for u in wanted if u > request.after]
+        query = query.where(User.username.in_(wanted[:limit]))
+    if request.username_prefix:
+        # Range on the primary key instead of LIKE, so the index is used
+        prefix = request.username_prefix
+        query = query.where(User.username >= prefix, User.username < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    if request.email_domain:
+        # % and _ in the domain are literal characters, not wildcards
+        domain = request.email_domain.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.where(User.email.like(f"%@{domain}", escape="\\"))
+    return query
+
+def columnar_results(rows):
+    """Decode a page in one pass into {column: [values...]}."""
+    columns = {"username": [], "average_elo": [], "topic_ratings": {}, "solved": [], "milestone": [],
+               "personality_type": [], "has_final_result": []}
+    for index, row in enumerate(rows):
+        gap = decode_gap_analysis(gap_sessions.peek(row.username) or row.gap_analysis) or {}
+        tech = decode_technical_test(row.technical_test) or {}
+        columns["username"].append(row.username)
+        columns["average_elo"].append(gap.get("average_elo"))
+        for topic, rating in gap.get("topic_ratings", {}).items():
+            columns["topic_ratings"].setdefault(topic, [None] * index).append(rating)
+        for ratings in columns["topic_ratings"].values():
+            if len(ratings) == index:
+                ratings.append(None)
+        columns["solved"].append(tech.get("solved"))
+        columns["milestone"].append(tech.get("milestone"))
+        columns["personality_type"].append(row.non_technical_test)
+        columns["has_final_result"].append(bool(row.final_result))
+    return columns
+
+@router.post("/batch")
+async def get_batch_results(request: BatchResultsRequest, db: AsyncSession = Depends(get_async_db),
+                            admin: User = Depends(require_admin)):
+    """
+    Results for a list of usernames or a cohort (email domain and/or username prefix), a page at a time.
+    Pass the returned next_cursor as `after` to get the next page; it's null on the last page.
+    """
+    if request.usernames is None and not request.email_domain and not request.username_prefix:
+        raise HTTPException(status_code=400, detail="Give usernames, email_domain or username_prefix")
+    if request.usernames is not None and len(request.usernames) > BATCH_MAX_USERNAMES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_USERNAMES} usernames per request")
+    limit = max(1, min(request.limit, BATCH_MAX_PAGE_SIZE))
+
+    # Each shard returns its first `limit` rows; the merge keeps the global username order
+    rows = await scatter_gather(db, batch_query(request, limit), key=lambda row: row.username, limit=limit)
+    columns = columnar_results(rows)
 
-    # Extract solved count and milestone (default to 0 if missing)
-    solved = tech_test_data.get("solved", 0)
-    milestone = tech_test_data.get("milestone", "0")  # Default to "0" if blank
+    if request.usernames is not None:
+        # The page covers the requested names up to the last one returned (or all remaining ones)
+        remaining = sorted(u for u in set(request.usernames) if request.after is None or u > request.after)
+        page_names = remaining[:limit]
+        found = set(columns["username"])
+        missing = [u for u in page_names if u not in found]
+        next_cursor = page_names[-1] if len(remaining) > limit else None
+    else:
+        missing = []
+        next_cursor = rows[-1].username if len(rows) == limit else None
 
-    return {"solved": solved, "milestone": milestone}
\ No newline at end of file
+    return {"count": len(rows), "columns": columns, "missing": missing, "next_cursor": next_cursor}
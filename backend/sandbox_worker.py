@@ -0,0 +1,208 @@
+"""
+Pre-warmed Python execution worker, started and managed by worker_pool.py.
+
+The worker imports the interpreter's commonly used modules once, then waits for
+requests on stdin (one JSON object per line). Each submission runs in a forked
+child, so it starts from the warm parent's state and leaves nothing behind.
+Results are streamed back on stdout as JSON lines:
+
+    {"chunk": "..."}                               program output, in order
+    {"done": true, "exit_code": 0, ...}            final status and resource usage
+
+Writing "stop" to stdin mid-run kills the submission early (e.g. once the judge
+has seen a mismatch); the worker still answers with its "done" line.
+"""
+import codecs
+import json
+import os
+import resource
+import select
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+# Warm up: modules submissions commonly import, so the child doesn't pay for them
+import collections, functools, heapq, itertools, math, re, string, bisect  # noqa: E401,F401
+
+READ_SIZE = 65536
+MEMORY_ERROR_EXIT = 251  # Child exit status meaning the submission hit its address-space limit
+
+
+def run_child(code, in_r, out_w, memory_mb, cpu_seconds, workdir):
+    """Runs inside the forked child: wire up stdio, drop limits, exec the submission."""
+    os.setsid()
+    os.dup2(in_r, 0)
+    os.dup2(out_w, 1)
+    os.dup2(out_w, 2)
+    os.chdir(workdir)
+
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (1024 * 1024, 1024 * 1024))
+
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", closefd=False)
+    sys.stderr = open(2, "w", closefd=False)
+
+    exit_code = 0
+    try:
+        exec(compile(code, "main", "exec"), {"__name__": "__main__", "__builtins__": __builtins__})
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except MemoryError:
+        exit_code = MEMORY_ERROR_EXIT
+    except BaseException as e:
+        # Skip our own frame so the traceback starts at the submission
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        exit_code = 1
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(exit_code)
+
+
+def kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def handle(request, channel):
+    """Fork a child for one submission and stream its output back over `channel`."""
+    timeout = request.get("timeout", 3)
+    output_limit = request.get("output_limit", 1024 * 1024)
+    stdin_data = (request.get("stdin") or "").encode()
+
+    in_r, in_w = os.pipe()
+    out_r, out_w = os.pipe()
+    workdir = tempfile.mkdtemp(prefix="run-")
+    started = time.monotonic()
+
+    pid = os.fork()
+    if pid == 0:
+        os.close(in_w)
+        os.close(out_r)
+        run_child(request["code"], in_r, out_w, request.get("memory_mb"), int(timeout) + 1, workdir)
+
+    os.close(in_r)
+    os.close(out_w)
+    os.set_blocking(in_w, False)
+
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    output_bytes = 0
+    timed_out = truncated = stopped = False
+    deadline = started + timeout
+    readers, writers = [out_r, 0], [in_w] if stdin_data else []
+    if not stdin_data:
+        os.close(in_w)
+
+    while readers:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        ready_r, ready_w, _ = select.select(readers, writers, [], remaining)
+        if ready_w:
+            try:
+                written = os.write(in_w, stdin_data[:READ_SIZE])
+                stdin_data = stdin_data[written:]
+            except BrokenPipeError:
+                stdin_data = b""
+            if not stdin_data:
+                os.close(in_w)
+                writers = []
+        if 0 in ready_r:
+            # Only ever a stop request (or EOF) while a run is in progress
+            os.read(0, READ_SIZE)
+            stopped = True
+            break
+        if ready_r:
+            data = os.read(out_r, READ_SIZE)
+            if not data:
+                break
+            output_bytes += len(data)
+            if output_bytes > output_limit:
+                data = data[:len(data) - (output_bytes - output_limit)]
+                output_bytes = output_limit
+                truncated = True
+            text = decoder.decode(data)
+            if text:
+                channel.write(json.dumps({"chunk": text}) + "\n")
+                channel.flush()
+            if truncated:
+                break
+
+    if timed_out or truncated or stopped:
+        kill_group(pid)
+    if writers:
+        os.close(in_w)
+    os.close(out_r)
+
+    # The child may have closed its stdout but still be running
+    while True:
+        waited, status, usage = os.wait4(pid, os.WNOHANG)
+        if waited:
+            break
+        if time.monotonic() >= deadline:
+            timed_out = True
+            kill_group(pid)
+        time.sleep(0.001)
+    kill_group(pid)  # Anything the submission left running in its process group
+    wall_time = time.monotonic() - started
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        channel.write(json.dumps({"chunk": tail}) + "\n")
+
+    channel.write(json.dumps({
+        "done": True,
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "timed_out": timed_out,
+        "truncated": truncated,
+        "stopped": stopped,
+        "memory_exceeded": os.waitstatus_to_exitcode(status) == MEMORY_ERROR_EXIT,
+        "wall_time": round(wall_time, 6),
+        "cpu_time": round(usage.ru_utime + usage.ru_stime, 6),
+        "peak_rss_kb": usage.ru_maxrss,
+        "output_bytes": output_bytes,
+        "worker_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }) + "\n")
+    channel.flush()
+
+
+_pending = bytearray()
+
+def read_line():
+    """Line read straight from fd 0 (no stdio buffering), so select() on it mid-run sees any stop request."""
+    while b"\n" not in _pending:
+        data = os.read(0, READ_SIZE)
+        if not data:
+            return None
+        _pending.extend(data)
+    line, _, rest = bytes(_pending).partition(b"\n")
+    _pending[:] = rest
+    return line
+
+
+def main():
+    channel = sys.stdout
+    # Submissions must never write to the protocol channel directly
+    sys.stdout = sys.stderr
+    while True:
+        line = read_line()
+        if line is None:
+            break
+        if line.strip() and line.strip() != b"stop":  # A stop that raced with the end of a run
+            handle(json.loads(line), channel)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Hash-partitioned user store: SHARD_COUNT SQLite files, each with its own write lock.
+
+  - Sharded: users, plus the career_guidance bodies they point at (kept on the
+    same shard so the results and export joins stay local).
+  - Replicated: the read-only question banks (gap_test_questions,
+    technical_questions). They're imported into the primary file, then copied
+    whole to every other shard. Reads go to any shard.
+  - Primary only: everything else (submission stats, similarity index,
+    search index, user_emails). These are cross-user by nature.
+
+Shard 0 is nextstep.db, so SHARD_COUNT=1 (the default) is the old layout.
+A user lives on shard jump_hash(blake2b(username)) % SHARD_COUNT. With jump
+consistent hashing, growing from N to N+1 shards moves only about 1/(N+1)
+of the users.
+
+With more than one shard, database.SessionLocal / AsyncSessionLocal are
+SQLAlchemy ShardedSessions, routed by the choosers below:
+  - Statements whose WHERE pins users.username (== or IN, AND-ed) go to
+    those users' shards.
+  - Statements touching only replicated tables go to one random shard.
+  - Anything else (e.g. lookups by email) goes to every shard, and the rows
+    are concatenated.
+  - .execution_options(shard_username=...) forces a user's shard. It's
+    needed for career_guidance rows, which have no username of their own.
+Ordered or limited cross-user queries need the merge in scatter_gather /
+scatter_stream / merged_rows; plain concatenation would break the order.
+Each shard commits on its own; there is no two-phase commit.
+
+Uniqueness: a username always maps to one shard, so that shard's primary
+key keeps usernames unique. The UNIQUE index on users.email only covers its
+own file, so emails are claimed in user_emails (lower-cased email -> username)
+on the primary first: one writer, one PRIMARY KEY, no race. Signup and bulk
+signup claim before inserting the user row and give the claim back if that
+insert fails. create_email_index() backfills it from every shard at startup
+and after a rebalance.
+
+    python sharding.py status                    # users per shard file
+    python sharding.py replicate                 # copy question tables from the primary to every shard
+    python sharding.py rebalance --from-count 2  # after changing SHARD_COUNT (API stopped)
+"""
+import argparse
+import asyncio
+import hashlib
+import heapq
+import os
+import random
+import sqlite3
+
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+from sqlalchemy.sql.util import find_tables
+
+from models import User
+
+SHARD_COUNT = max(1, int(os.getenv("SHARD_COUNT", "1")))
+PRIMARY_DB = "nextstep.db"
+SHARD_IDS = [str(index) for index in range(SHARD_COUNT)]
+SHARDED_TABLES = ("users", "career_guidance")
+REPLICATED_TABLES = ("gap_test_questions", "technical_questions")
+REBALANCE_BATCH = 500
+EMAIL_CLAIM_CHUNK = 500  # Emails per IN query when checking claims
+
+
+def shard_path(index: int) -> str:
+    return PRIMARY_DB if index == 0 else f"nextstep.shard{index}.db"
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach): a bucket in [0, buckets)."""
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(username: str, count: int = SHARD_COUNT) -> int:
+    key = int.from_bytes(hashlib.blake2b(username.encode(), digest_size=8).digest(), "big")
+    return jump_hash(key, count)
+
+
+def user_db_path(username: str) -> str:
+    """SQLite file holding a user's row (for the raw sqlite3 code paths)."""
+    return shard_path(shard_for(username))
+
+# ----------------------- Routing -----------------------
+
+def _is_username_column(column):
+    return getattr(column, "name", None) == "username" and getattr(column, "table", None) is User.__table__
+
+
+def usernames_in(clause):
+    """Usernames a WHERE clause pins users.username to, or None if it can match any user.
+    Only AND-ed == / IN comparisons narrow it; anything under an OR could match other users."""
+    if clause is None:
+        return None
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        found = None
+        for criterion in clause.clauses:
+            names = usernames_in(criterion)
+            if names is not None:
+                found = names if found is None else found & names
+        return found
+    if isinstance(clause, BinaryExpression) and _is_username_column(clause.left) \
+            and isinstance(clause.right, BindParameter):
+        if clause.operator is operators.eq:
+            return {clause.right.effective_value}
+        if clause.operator is operators.in_op:
+            return set(clause.right.effective_value or ())
+    return None
+
+
+def shards_for_statement(statement, execution_options=None):
+    username = (execution_options or {}).get("shard_username")
+    if username is not None:
+        return [str(shard_for(username))]
+    tables = {table.name for table in find_tables(statement, include_crud=True, include_joins=True)}
+    if tables and tables.issubset(REPLICATED_TABLES):
+        return [random.choice(SHARD_IDS)]
+    usernames = usernames_in(getattr(statement, "whereclause", None))
+    if usernames is not None:
+        return sorted({str(shard_for(u)) for u in usernames}) or SHARD_IDS[:1]
+    return SHARD_IDS
+
+
+def shard_chooser(mapper, instance, clause=None, **kw):
+    """Shard for a new row (and for statements executed without an ORM entity)."""
+    if isinstance(instance, User):
+        return str(shard_for(instance.username))
+    if clause is not None:
+        return shards_for_statement(clause)[0]
+    return SHARD_IDS[0]
+
+
+def identity_chooser(mapper, primary_key, *, lazy_loaded_from, execution_options, bind_arguments, **kw):
+    if mapper.class_ is User:
+        return [str(shard_for(primary_key[0]))]
+    if mapper.local_table.name in REPLICATED_TABLES:
+        return [random.choice(SHARD_IDS)]
+    return SHARD_IDS
+
+
+def execute_chooser(orm_context):
+    return shards_for_statement(orm_context.statement, orm_context.execution_options)
+
+
+def sharded_session_options(shards):
+    """Keyword arguments turning a (async_)sessionmaker into a ShardedSession factory over `shards`."""
+    return {"shards": shards, "shard_chooser": shard_chooser,
+            "identity_chooser": identity_chooser, "execute_chooser": execute_chooser}
+
+# ----------------------- Scatter-gather -----------------------
+
+async def scatter_gather(db, statement, key, limit=None):
+    """
+    Rows of an ordered (and possibly limited) statement across every shard it targets,
+    merged by `key` and cut to `limit`. Shards are queried concurrently.
+    """
+    if SHARD_COUNT == 1:
+        return (await db.execute(statement)).all()
+    from database import AsyncSessionLocal
+
+    async def one(shard_id):
+        async with AsyncSessionLocal() as session:
+            return (await session.execute(statement, bind_arguments={"shard_id": shard_id})).all()
+
+    partials = await asyncio.gather(*(one(s) for s in shards_for_statement(statement)))
+    merged = list(heapq.merge(*partials, key=key))
+    return merged if limit is None else merged[:limit]
+
+
+async def scatter_stream(statement, key):
+    """Async iterator over an ordered statement's rows from every shard, k-way merged by `key` as they stream."""
+    from database import AsyncSessionLocal
+
+    sessions = [AsyncSessionLocal() for _ in SHARD_IDS]
+    try:
+        streams = [(await session.stream(statement, bind_arguments={"shard_id": shard_id})).__aiter__()
+                   for session, shard_id in zip(sessions, SHARD_IDS)]
+        heap = []
+        for index, stream in enumerate(streams):
+            row = await anext(stream, None)
+            if row is not None:
+                heap.append((key(row), index, row))
+        heapq.heapify(heap)
+        while heap:
+            _, index, row = heap[0]
+            yield row
+            following = await anext(streams[index], None)
+            if following is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (key(following), index, following))
+    finally:
+        for session in sessions:
+            await session.close()
+
+
+def merged_rows(db, statement, key):
+    """Sync counterpart of scatter_stream, on one (Sharded)Session."""
+    if SHARD_COUNT == 1:
+        return db.execute(statement)
+    return heapq.merge(*(db.execute(statement, bind_arguments={"shard_id": s}) for s in SHARD_IDS), key=key)
+
+# ----------------------- Replication and rebalancing -----------------------
+
+def replicate_question_tables():
+    """Copy the question tables from the primary to every other shard, schema and all, one transaction per shard."""
+    if SHARD_COUNT == 1:
+        return 0
+    primary = sqlite3.connect(PRIMARY_DB)
+    schemas = dict(primary.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN ({','.join('?' * len(REPLICATED_TABLES))})",
+        REPLICATED_TABLES,
+    ).fetchall())
+    primary.close()
+
+    for index in range(1, SHARD_COUNT):
+        conn = sqlite3.connect(shard_path(index), isolation_level=None)
+        try:
+            conn.execute("ATTACH DATABASE ? AS primary_db", (PRIMARY_DB,))
+            conn.execute("BEGIN IMMEDIATE")
+            for table, sql in schemas.items():
+                conn.execute(f"DROP TABLE IF EXISTS main.{table}")
+                conn.execute(sql)
+                conn.execute(f"INSERT INTO main.{table} SELECT * FROM primary_db.{table}")
+            conn.execute("COMMIT")
+            conn.execute("DETACH DATABASE primary_db")
+        finally:
+            conn.close()
+    return len(schemas)
+
+
+def create_shard_schemas(count=SHARD_COUNT):
+    """Create the sharded tables in every shard file that lacks them."""
+    from sqlalchemy import create_engine
+    import models
+
+    for index in range(count):
+        engine = create_engine(f"sqlite:///./{shard_path(index)}")
+        models.Base.metadata.create_all(engine, tables=[models.User.__table__, models.CareerGuidance.__table__])
+        engine.dispose()
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def rebalance(from_count=SHARD_COUNT):
+    """
+    Move every user (and the guidance bodies they reference) to the shard SHARD_COUNT assigns them.
+    Scans shard files 0..max(from_count, SHARD_COUNT)-1. Stop the API first: a write to a user's old
+    shard after it has moved would be lost. Safe to re-run after an interruption.
+    """
+    create_shard_schemas()
+    moved = {}
+    for index in range(max(from_count, SHARD_COUNT)):
+        if not os.path.exists(shard_path(index)):
+            continue
+        conn = sqlite3.connect(shard_path(index), isolation_level=None)
+        try:
+            if "users" not in {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}:
+                continue
+            by_target = {}
+            for (username,) in conn.execute("SELECT username FROM users"):
+                target = shard_for(username)
+                if target != index:
+                    by_target.setdefault(target, []).append(username)
+
+            for target, usernames in by_target.items():
+                conn.execute("ATTACH DATABASE ? AS dest", (shard_path(target),))
+                # Column lists by name: files migrated with ALTER TABLE can order them differently
+                user_columns = ", ".join(c for c in _columns(conn, "main", "users") if c in _columns(conn, "dest", "users"))
+                for start in range(0, len(usernames), REBALANCE_BATCH):
+                    batch = usernames[start:start + REBALANCE_BATCH]
+                    marks = ",".join("?" * len(batch))
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute(f"INSERT OR IGNORE INTO dest.career_guidance SELECT * FROM main.career_guidance "
+                                 f"WHERE hash IN (SELECT career_guidance_hash FROM main.users WHERE username IN ({marks}))", batch)
+                    conn.execute(f"INSERT OR REPLACE INTO dest.users ({user_columns}) "
+                                 f"SELECT {user_columns} FROM main.users WHERE username IN ({marks})", batch)
+                    conn.execute(f"DELETE FROM main.users WHERE username IN ({marks})", batch)
+                    conn.execute("COMMIT")
+                conn.execute("DETACH DATABASE dest")
+                moved[(index, target)] = len(usernames)
+
+            if by_target:
+                conn.execute("DELETE FROM career_guidance WHERE hash NOT IN "
+                             "(SELECT career_guidance_hash FROM users WHERE career_guidance_hash IS NOT NULL)")
+        finally:
+            conn.close()
+    # Moves don't change the email -> username claims, but drained files may hold users it never saw
+    create_email_index(max(from_count, SHARD_COUNT))
+    return moved
+
+
+# ----------------------- Email index -----------------------
+
+def create_email_index(count=SHARD_COUNT):
+    """Create user_emails on the primary and add every user it's missing, from shard files 0..count-1."""
+    conn = sqlite3.connect(PRIMARY_DB, isolation_level=None)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS user_emails (email TEXT PRIMARY KEY, username TEXT NOT NULL)")
+        for index in range(count):
+            if index and not os.path.exists(shard_path(index)):
+                continue
+            schema = "main" if index == 0 else "shard"
+            if index:
+                conn.execute("ATTACH DATABASE ? AS shard", (shard_path(index),))
+            try:
+                if "users" in {r[0] for r in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}:
+                    conn.execute(f"INSERT OR IGNORE INTO main.user_emails (email, username) "
+                                 f"SELECT lower(email), username FROM {schema}.users")
+            finally:
+                if index:
+                    conn.execute("DETACH DATABASE shard")
+    finally:
+        conn.close()
+
+
+def claim_emails(pairs):
+    """
+    Claim (email, username) pairs in user_emails in one transaction. Returns the lower-cased
+    emails now held by their username; the others already belonged to someone else.
+    """
+    pairs = [(email.lower(), username) for email, username in pairs]
+    conn = sqlite3.connect(PRIMARY_DB)
+    try:
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO user_emails (email, username) VALUES (?, ?)", pairs)
+        wanted = dict(pairs)
+        claimed = set()
+        emails = list(wanted)
+        for start in range(0, len(emails), EMAIL_CLAIM_CHUNK):
+            chunk = emails[start:start + EMAIL_CLAIM_CHUNK]
+            rows = conn.execute(f"SELECT email, username FROM user_emails WHERE email IN ({','.join('?' * len(chunk))})",
+                                chunk)
+            claimed.update(email for email, username in rows if wanted[email] == username)
+        return claimed
+    finally:
+        conn.close()
+
+
+def release_emails(pairs):
+    """Give back claims whose user row was never written."""
+    conn = sqlite3.connect(PRIMARY_DB)
+    try:
+        with conn:
+            conn.executemany("DELETE FROM user_emails WHERE email = ? AND username = ?",
+                             [(email.lower(), username) for email, username in pairs])
+    finally:
+        conn.close()
+
+
+def shard_status(count=SHARD_COUNT):
+    status = []
+    for index in range(count):
+        path = shard_path(index)
+        users = None
+        if os.path.exists(path):
+            conn = sqlite3.connect(path)
+            try:
+                users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            except sqlite3.OperationalError:
+                users = 0
+            finally:
+                conn.close()
+        status.append({"shard": index, "path": path, "users": users})
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and maintain the user shards.")
+    parser.add_argument("command", choices=("status", "replicate", "rebalance"))
+    parser.add_argument("--from-count", type=int, default=SHARD_COUNT,
+                        help="rebalance: the previous SHARD_COUNT (files beyond the new count are drained)")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for entry in shard_status(max(args.from_count, SHARD_COUNT)):
+            print(f"shard {entry['shard']} {entry['path']}: {entry['users'] if entry['users'] is not None else 'missing'} users")
+    elif args.command == "replicate":
+        print(f"Replicated {replicate_question_tables()} tables to {SHARD_COUNT - 1} shards")
+    else:
+        for (source, target), count in sorted(rebalance(args.from_count).items()):
+            print(f"moved {count} users from shard {source} to shard {target}")
+        print("Rebalance complete")
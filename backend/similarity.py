@@ -0,0 +1,185 @@
+"""
+Near-duplicate detection for accepted technical submissions (MinHash + LSH).
+
+Each accepted submission is tokenized with identifiers, literals, comments and
+whitespace normalized away, cut into overlapping token shingles, and reduced to
+a NUM_PERM-value MinHash signature. The signature is split into BANDS bands;
+submissions to the same question that share any band bucket are candidate
+copies. Only those candidates are compared, so indexing a submission costs
+BANDS indexed lookups instead of a scan of the whole cohort.
+"""
+import hashlib
+import random
+import re
+import sqlite3
+import struct
+from datetime import datetime
+
+from profiling import phase
+
+DB_PATH = "nextstep.db"
+
+SHINGLE_SIZE = 5  # Tokens per shingle
+NUM_PERM = 64  # MinHash values per signature
+BANDS = 16  # LSH bands; NUM_PERM / BANDS rows each
+ROWS_PER_BAND = NUM_PERM // BANDS
+SIMILARITY_THRESHOLD = 0.8  # Estimated Jaccard similarity reported as a likely copy by default
+RECORD_THRESHOLD = 0.5  # Lowest similarity kept, so reports can be re-run with a looser threshold
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)  # Fixed seed: signatures must stay comparable across restarts
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+_SIGNATURE_FORMAT = f"<{NUM_PERM}Q"
+
+# Keywords common to the languages students submit in; kept as-is, every other name becomes "ID"
+KEYWORDS = {
+    "and", "as", "assert", "break", "case", "catch", "class", "const", "continue", "def", "default", "del", "do",
+    "elif", "else", "except", "false", "False", "finally", "for", "from", "func", "function", "global", "if",
+    "import", "in", "is", "lambda", "let", "new", "nil", "none", "None", "not", "null", "or", "pass", "print",
+    "printf", "println", "public", "raise", "return", "static", "struct", "switch", "this", "throw", "true", "True",
+    "try", "var", "void", "while", "with", "yield", "int", "long", "float", "double", "char", "string", "bool",
+    "boolean", "input", "range", "len", "cin", "cout", "scanf", "include", "using", "namespace", "std", "main",
+}
+
+_HASH_COMMENTS = r"\#[^\n]*"
+_C_COMMENTS = r"//[^\n]*|/\*.*?\*/"
+# Comment syntax per submission language; anything else is C-like (in Python, // is floor division)
+COMMENT_SYNTAX = {
+    "python": _HASH_COMMENTS, "python3": _HASH_COMMENTS, "py": _HASH_COMMENTS, "ruby": _HASH_COMMENTS,
+    "perl": _HASH_COMMENTS, "bash": _HASH_COMMENTS, "sh": _HASH_COMMENTS, "r": _HASH_COMMENTS,
+    "php": f"{_HASH_COMMENTS}|{_C_COMMENTS}",
+}
+
+_TOKEN_PATTERN = r"""
+    (?P<comment>{comments})
+  | (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<op>==|!=|<=|>=|\+=|-=|\*=|/=|&&|\|\||<<|>>|->|\*\*|//|[^\s\w])
+"""
+_TOKEN_RES = {comments: re.compile(_TOKEN_PATTERN.replace("{comments}", comments), re.VERBOSE | re.DOTALL)
+              for comments in {_C_COMMENTS, *COMMENT_SYNTAX.values()}}
+
+
+def normalize_tokens(code: str, language: str = None):
+    """Token stream with comments dropped and names/literals replaced by placeholders."""
+    token_re = _TOKEN_RES[COMMENT_SYNTAX.get((language or "").lower(), _C_COMMENTS)]
+    tokens = []
+    for match in token_re.finditer(code):
+        kind = match.lastgroup
+        if kind == "comment":
+            continue
+        if kind == "string":
+            tokens.append("STR")
+        elif kind == "number":
+            tokens.append("NUM")
+        elif kind == "name":
+            text = match.group()
+            tokens.append(text if text in KEYWORDS else "ID")
+        else:
+            tokens.append(match.group())
+    return tokens
+
+
+def shingle_hashes(tokens):
+    if len(tokens) < SHINGLE_SIZE:
+        grams = [" ".join(tokens)] if tokens else []
+    else:
+        grams = [" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+    return {int.from_bytes(hashlib.blake2b(g.encode(), digest_size=8).digest(), "little") for g in grams}
+
+
+def minhash_signature(code: str, language: str = None):
+    shingles = shingle_hashes(normalize_tokens(code, language))
+    if not shingles:
+        return [_MERSENNE_PRIME] * NUM_PERM
+    return [min((a * s + b) % _MERSENNE_PRIME for s in shingles) for a, b in _PERMUTATIONS]
+
+
+def band_buckets(signature):
+    """One bucket key per band."""
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        buckets.append(hashlib.blake2b(struct.pack(f"<{ROWS_PER_BAND}Q", *rows), digest_size=8).hexdigest())
+    return buckets
+
+
+def estimated_similarity(first, second):
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_PERM
+
+
+def index_submission(username, question_id, language, code):
+    """
+    Add an accepted submission to its question's LSH index and record any likely copies.
+    Cheap enough to run inline; the judge runs it as a background task after responding.
+    """
+    signature = minhash_signature(code, language)
+    buckets = band_buckets(signature)
+
+    with phase("db"):
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO submission_signatures (username, question_id, language, signature, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (username, question_id, language, struct.pack(_SIGNATURE_FORMAT, *signature), datetime.utcnow().isoformat()))
+            signature_id = cursor.lastrowid
+
+            candidates = set()
+            for band, bucket in enumerate(buckets):
+                cursor.execute(
+                    "SELECT signature_id FROM submission_lsh WHERE question_id = ? AND band = ? AND bucket = ?",
+                    (question_id, band, bucket)
+                )
+                candidates.update(row[0] for row in cursor.fetchall())
+            cursor.executemany(
+                "INSERT INTO submission_lsh (question_id, band, bucket, signature_id) VALUES (?, ?, ?, ?)",
+                [(question_id, band, bucket, signature_id) for band, bucket in enumerate(buckets)]
+            )
+
+            for candidate_id in candidates:
+                cursor.execute("SELECT username, signature FROM submission_signatures WHERE id = ?", (candidate_id,))
+                other_username, other_signature = cursor.fetchone()
+                if other_username == username:
+                    continue  # Resubmissions by the same user aren't copies
+                similarity = estimated_similarity(signature, struct.unpack(_SIGNATURE_FORMAT, other_signature))
+                if similarity >= RECORD_THRESHOLD:
+                    cursor.execute("""
+                        INSERT INTO similar_submissions (question_id, first_id, second_id, similarity)
+                        VALUES (?, ?, ?, ?)
+                    """, (question_id, candidate_id, signature_id, similarity))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def similar_pairs(question_id, threshold=SIMILARITY_THRESHOLD):
+    """Recorded likely-copy pairs for a question, most similar first."""
+    with phase("db"):
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT p.similarity, a.username, a.created_at, b.username, b.created_at
+            FROM similar_submissions p
+            JOIN submission_signatures a ON a.id = p.first_id
+            JOIN submission_signatures b ON b.id = p.second_id
+            WHERE p.question_id = ? AND p.similarity >= ?
+            ORDER BY p.similarity DESC
+        """, (question_id, threshold))
+        rows = cursor.fetchall()
+        conn.close()
+
+    pairs, seen = [], set()
+    for row in rows:
+        users = frozenset((row[1], row[3]))
+        if users in seen:
+            continue  # Resubmissions pair up again; keep each pair of users once, at its highest similarity
+        seen.add(users)
+        pairs.append({
+            "similarity": round(row[0], 3),
+            "first": {"username": row[1], "submitted_at": row[2]},
+            "second": {"username": row[3], "submitted_at": row[4]},
+        })
+    return pairs
@@ -1,14 +1,40 @@
 import requests
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import sqlite3
 import json
+import math
+import time
+from datetime import datetime
+
+from concurrency import retry_sync
+from judge_scheduler import judge_scheduler, SchedulerFull
+from worker_pool import get_pool, WorkerError
+from output_compare import make_comparator
+from auth import require_admin
+from models import User
+import similarity
+from profiling import phase
+from cache import CACHE_BACKEND, cache
+from sharding import user_db_path
 
 router = APIRouter()
 
 DB_PATH = "nextstep.db"
 PISTON_API_URL = "https://emkc.org/api/v2/piston/execute"  # Piston API endpoint
 TOTAL_QUESTIONS = 15  # Total number of questions
+EXECUTION_TIMEOUT_SECONDS = 30  # A hung Piston call would otherwise hold a judge slot forever
+OUTPUT_LIMIT_BYTES = 1024 * 1024  # Submissions printing more than this are rejected
+DEFAULT_TIME_LIMIT_MS = 3000  # Used when a question has no time_limit_ms of its own
+DEFAULT_MEMORY_LIMIT_MB = 256  # Used when a question has no memory_limit_mb of its own
+# init_tech_questions invalidates the shared cache; a local one lives in the API process the script can't reach,
+# so there edited questions show up when the short TTL runs out
+QUESTION_CACHE_TTL_SECONDS = 3600 if CACHE_BACKEND == "redis" else 60
+STATS_CACHE_TTL_SECONDS = 30
+
+question_cache = cache.namespace("tech_question", ttl=QUESTION_CACHE_TTL_SECONDS)
+stats_cache = cache.namespace("tech_question_stats", ttl=STATS_CACHE_TTL_SECONDS)
 
 ### 📌 SCHEMAS ###
 class AnswerRequest(BaseModel):
@@ -29,19 +55,25 @@ class StartTestRequest(BaseModel):
 
 ### 📌 HELPER FUNCTIONS ###
 def get_question_by_id(question_id):
-    """Fetch a technical question by its ID."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    """Fetch a technical question by its ID (cached)."""
+    return question_cache.get_or_load(question_id, lambda: load_question(question_id))
+
+def load_question(question_id):
+    """Read a technical question from the database."""
+    with phase("db"):
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
     
-    # Removed language column since it's not stored in our JSON DB.
-    cursor.execute("""
-        SELECT id, title, problem_statement, input_example, expected_output, 
-               constraints, min_lines, max_lines 
-        FROM technical_questions 
-        WHERE id = ?
-    """, (question_id,))
-    row = cursor.fetchone()
-    conn.close()
+        # Removed language column since it's not stored in our JSON DB.
+        cursor.execute("""
+            SELECT id, title, problem_statement, input_example, expected_output, 
+                   constraints, min_lines, max_lines, compare_mode, float_epsilon,
+                   time_limit_ms, memory_limit_mb 
+            FROM technical_questions 
+            WHERE id = ?
+        """, (question_id,))
+        row = cursor.fetchone()
+        conn.close()
     
     if row:
         return {
@@ -52,60 +84,205 @@ def get_question_by_id(question_id):
             "expected_output": row[4],
             "constraints": row[5],
             "min_lines": row[6],
-            "max_lines": row[7]
+            "max_lines": row[7],
+            "compare_mode": row[8],
+            "float_epsilon": row[9],
+            "time_limit_ms": row[10],
+            "memory_limit_mb": row[11]
         }
     return None
 
 def get_user_progress(username):
     """Fetch user progress from the User table."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with phase("db"):
+        conn = sqlite3.connect(user_db_path(username))
+        cursor = conn.cursor()
     
-    cursor.execute("SELECT technical_test FROM users WHERE username = ?", (username,))
-    row = cursor.fetchone()
-    conn.close()
+        cursor.execute("SELECT technical_test FROM users WHERE username = ?", (username,))
+        row = cursor.fetchone()
+        conn.close()
     
     if row and row[0]:
         return json.loads(row[0])
     return {"solved": 0, "milestone": "Not Started"}
 
-def update_user_progress(username, solved_count):
-    """Update the user's progress in the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
+def milestone_for(solved_count):
+    """Milestone label for a number of solved questions."""
     if solved_count >= 15:
-        milestone = "Completed 15 Questions"
+        return "Completed 15 Questions"
     elif solved_count >= 10:
-        milestone = "10 Questions Solved"
+        return "10 Questions Solved"
     elif solved_count >= 5:
-        milestone = "5 Questions Solved"
-    else:
-        milestone = f"{solved_count} Questions Solved"
+        return "5 Questions Solved"
+    return f"{solved_count} Questions Solved"
 
-    test_result = {"solved": solved_count, "milestone": milestone}
-    test_result_json = json.dumps(test_result)
+def modify_user_progress(username, operation, compute):
+    """
+    Read-modify-write of the user's progress, guarded by users.version.
+    `compute(progress)` returns the new progress dict; the UPDATE only applies if nobody
+    else bumped the version since our read, otherwise it's retried from a fresh read.
+    """
+    def attempt():
+        with phase("db"):
+            conn = sqlite3.connect(user_db_path(username))
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT technical_test, version FROM users WHERE username = ?", (username,))
+                row = cursor.fetchone()
+                if not row:
+                    return True, None
 
-    cursor.execute("UPDATE users SET technical_test = ? WHERE username = ?", (test_result_json, username))
-    conn.commit()
-    conn.close()
+                progress = json.loads(row[0]) if row[0] else {"solved": 0, "milestone": "Not Started"}
+                new_progress = compute(progress)
+                cursor.execute(
+                    "UPDATE users SET technical_test = ?, version = version + 1 WHERE username = ? AND version = ?",
+                    (json.dumps(new_progress), username, row[1])
+                )
+                conn.commit()
+                return cursor.rowcount == 1, new_progress
+            finally:
+                conn.close()
+
+    return retry_sync(operation, attempt)
+
+def update_user_progress(username, solved_count):
+    """Update the user's progress in the database."""
+    test_result = {"solved": solved_count, "milestone": milestone_for(solved_count)}
+    modify_user_progress(username, "update_user_progress", lambda progress: test_result)
 
 def count_lines_of_code(code):
     """Count the number of non-empty lines in the user's code."""
     return len([line for line in code.split("\n") if line.strip()])
 
-def execute_code(language, user_code, input_example):
-    """Execute user code using PistonAPI with the user-selected language."""
+def read_capped(response, limit):
+    """Read a streamed HTTP response body, giving up (None) once it passes `limit` bytes."""
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=65536):
+        body.extend(chunk)
+        if len(body) > limit:
+            response.close()
+            return None
+    return bytes(body)
+
+def execute_code(language, user_code, input_example, on_output, time_limit_ms=DEFAULT_TIME_LIMIT_MS,
+                 memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB):
+    """
+    Execute user code on a warm local worker if enabled for the language, otherwise via PistonAPI.
+    Output is passed to on_output(chunk) as it becomes available; returning False stops early.
+    Returns run metrics (wall_ms, cpu_ms, peak_rss_kb, output_bytes, timed_out, truncated),
+    or None if the code couldn't be executed.
+    """
+    pool = get_pool(language)
+    if pool:
+        try:
+            run = pool.run(
+                user_code, input_example, on_output,
+                timeout=time_limit_ms / 1000,
+                # Hard address-space backstop; the limit itself is judged on measured peak RSS
+                memory_mb=memory_limit_mb * 2 + 64,
+                output_limit=OUTPUT_LIMIT_BYTES,
+            )
+        except WorkerError:
+            return None
+        return {
+            "wall_ms": run["wall_time"] * 1000,
+            "cpu_ms": run["cpu_time"] * 1000,
+            "peak_rss_kb": run["peak_rss_kb"],
+            "output_bytes": run["output_bytes"],
+            "timed_out": run["timed_out"],
+            "memory_exceeded": run["memory_exceeded"],
+            "truncated": run["truncated"],
+        }
+
     payload = {
         "language": language,
         "version": "*",  # Latest version
         "files": [{"name": "main", "content": user_code}],
-        "stdin": input_example
+        "stdin": input_example,
+        "run_timeout": time_limit_ms,
+        "run_memory_limit": memory_limit_mb * 1024 * 1024,
+    }
+    started = time.monotonic()
+    try:
+        response = requests.post(PISTON_API_URL, json=payload, timeout=EXECUTION_TIMEOUT_SECONDS, stream=True)
+        if response.status_code != 200:
+            return None
+        # Piston returns the output twice (stdout and combined output) inside the JSON body
+        body = read_capped(response, 2 * OUTPUT_LIMIT_BYTES + 65536)
+    except requests.RequestException:
+        return None
+    wall_ms = (time.monotonic() - started) * 1000
+    if body is None:
+        return {"wall_ms": wall_ms, "cpu_ms": None, "peak_rss_kb": None, "output_bytes": OUTPUT_LIMIT_BYTES,
+                "timed_out": False, "memory_exceeded": False, "truncated": True}
+
+    run = json.loads(body).get("run", {})
+    del body
+    output = run.get("output", "")
+    for start in range(0, len(output), 65536):
+        if on_output(output[start:start + 65536]) is False:
+            break
+
+    # Newer Piston versions report usage; the round-trip time stands in for wall time otherwise
+    return {
+        "wall_ms": run.get("wall_time", wall_ms),
+        "cpu_ms": run.get("cpu_time"),
+        "peak_rss_kb": run["memory"] // 1024 if run.get("memory") is not None else None,
+        "output_bytes": len(output.encode()),
+        "timed_out": run.get("status") == "TO",
+        "memory_exceeded": False,
+        "truncated": False,
+    }
+
+def judge_submission(question, language, user_code):
+    """Run a submission, stream its output through the question's comparator and apply its limits."""
+    time_limit_ms = question.get("time_limit_ms") or DEFAULT_TIME_LIMIT_MS
+    memory_limit_mb = question.get("memory_limit_mb") or DEFAULT_MEMORY_LIMIT_MB
+    comparator = make_comparator(
+        question["expected_output"], question.get("compare_mode"), question.get("float_epsilon"), OUTPUT_LIMIT_BYTES
+    )
+    metrics = execute_code(language, user_code, question["input_example"], comparator.feed, time_limit_ms, memory_limit_mb)
+    if metrics is None:
+        return {"verdict": "Execution Failed", "passed": False, "reason": "Execution failed", "output": None, "metrics": None}
+
+    passed, reason = comparator.finish()
+    if metrics["timed_out"] or (metrics["cpu_ms"] or 0) > time_limit_ms:
+        verdict, reason = "Time Limit Exceeded", f"time limit is {time_limit_ms} ms"
+    elif metrics["memory_exceeded"] or (metrics["peak_rss_kb"] or 0) > memory_limit_mb * 1024:
+        verdict, reason = "Memory Limit Exceeded", f"memory limit is {memory_limit_mb} MB"
+    elif metrics["truncated"]:
+        verdict, reason = "Output Limit Exceeded", "Output limit exceeded"
+    else:
+        verdict = "Accepted" if passed else "Wrong Answer"
+
+    return {
+        "verdict": verdict,
+        "passed": verdict == "Accepted",
+        "reason": reason,
+        "output": comparator.preview.strip(),
+        "metrics": metrics,
     }
-    response = requests.post(PISTON_API_URL, json=payload)
-    if response.status_code == 200:
-        return response.json().get("run", {}).get("output", "").strip()
-    return None
+
+def record_submission_stats(username, question_id, language, verdict, metrics):
+    """Store the resource usage of one judged submission."""
+    with phase("db"):
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO submission_stats (username, question_id, language, verdict, wall_ms, cpu_ms, peak_rss_kb, output_bytes, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (username, question_id, language, verdict, metrics["wall_ms"], metrics["cpu_ms"],
+              metrics["peak_rss_kb"], metrics["output_bytes"], datetime.utcnow().isoformat()))
+        conn.commit()
+        conn.close()
+
+def percentiles(values, points=(50, 90, 99)):
+    """Nearest-rank percentiles of a sorted list."""
+    if not values:
+        return None
+    result = {f"p{p}": values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))] for p in points}
+    result["max"] = values[-1]
+    return result
 
 ### 📌 API ENDPOINTS ###
 
@@ -130,9 +307,9 @@ def get_technical_question(question_id: int):
     return question
 
 @router.post("/technical_test/submit_answer")
-def submit_technical_answer(data: AnswerRequest):
+async def submit_technical_answer(data: AnswerRequest, background_tasks: BackgroundTasks):
     """Submits user code, executes it, and evaluates correctness."""
-    question = get_question_by_id(data.question_id)
+    question = await run_in_threadpool(get_question_by_id, data.question_id)
     if not question:
         raise HTTPException(status_code=404, detail="Question not found")
 
@@ -144,28 +321,43 @@ def submit_technical_answer(data: AnswerRequest):
             detail=f"Code must be between {question['min_lines']} and {question['max_lines']} lines. Your code has {lines_of_code} lines."
         )
 
-    # Execute the user's code using the selected language from the request
-    output = execute_code(data.language, data.user_code, question["input_example"])
+    # Execute the user's code using the selected language from the request.
+    # Goes through the judge scheduler: bounded queue, per-user rate limit, round-robin across users.
+    try:
+        with phase("execution"):  # Includes time queued in the scheduler
+            verdict = await judge_scheduler.submit(
+                data.username, judge_submission, question, data.language, data.user_code
+            )
+    except SchedulerFull as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
     expected_output = question["expected_output"].strip()
 
-    if output != expected_output:
-        raise HTTPException(status_code=400, detail=f"Incorrect output. Expected: {expected_output}, Got: {output}")
+    if verdict["metrics"]:
+        await run_in_threadpool(
+            record_submission_stats, data.username, data.question_id, data.language, verdict["verdict"], verdict["metrics"]
+        )
 
-    # Update user progress
-    user_progress = get_user_progress(data.username)
-    solved_count = user_progress.get("solved", 0) + 1
-    if solved_count >= 15:
-        milestone = "Completed 15 Questions"
-    elif solved_count >= 10:
-        milestone = "10 Questions Solved"
-    elif solved_count >= 5:
-        milestone = "5 Questions Solved"
-    else:
-        milestone = f"{solved_count} Questions Solved"
-    new_progress = {"solved": solved_count, "milestone": milestone}
-    update_user_progress(data.username, solved_count)
+    if verdict["verdict"] in ("Time Limit Exceeded", "Memory Limit Exceeded"):
+        raise HTTPException(status_code=400, detail=f"{verdict['verdict']} ({verdict['reason']})")
+    if not verdict["passed"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Incorrect output ({verdict['reason']}). Expected: {expected_output}, Got: {verdict['output']}"
+        )
+
+    # Update user progress (atomic increment, safe across workers)
+    def increment(progress):
+        solved_count = progress.get("solved", 0) + 1
+        return {"solved": solved_count, "milestone": milestone_for(solved_count)}
+
+    new_progress = await run_in_threadpool(modify_user_progress, data.username, "submit_technical_answer", increment) or increment({})
+    solved_count = new_progress["solved"]
+    milestone = new_progress["milestone"]
+
+    # Near-duplicate index runs after the response is sent
+    background_tasks.add_task(similarity.index_submission, data.username, data.question_id, data.language, data.user_code)
 
-    return {"message": "Correct answer!", "solved": solved_count, "milestone": milestone}
+    return {"message": "Correct answer!", "solved": solved_count, "milestone": milestone, "stats": verdict["metrics"]}
 
 @router.post("/technical_test/end_test")
 def end_test(data: EndTestRequest):
@@ -186,3 +378,54 @@ def get_technical_test_result(username: str):
     """Fetch a user's technical test result."""
     progress = get_user_progress(username)
     return TechResultResponse(solved=progress.get("solved", 0), milestone=progress.get("milestone", "Not Started"))
+
+@router.get("/technical_test/judge_stats")
+def get_judge_stats():
+    """Judge queue depth, wait times and rejection counts."""
+    return judge_scheduler.stats()
+
+@router.get("/technical_test/stats/{question_id}")
+def get_question_stats(question_id: int, verdict: str = "Accepted"):
+    """
+    Resource usage distribution for a question's submissions (accepted ones by default; verdict=all for every run).
+    """
+    question = get_question_by_id(question_id)
+    if not question:
+        raise HTTPException(status_code=404, detail="Question not found")
+    return stats_cache.get_or_load(f"{question_id}:{verdict}", lambda: compute_question_stats(question, verdict))
+
+def compute_question_stats(question, verdict):
+    question_id = question["id"]
+    with phase("db"):
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        cursor.execute("SELECT verdict, COUNT(*) FROM submission_stats WHERE question_id = ? GROUP BY verdict", (question_id,))
+        verdict_counts = dict(cursor.fetchall())
+
+        distributions = {}
+        for metric in ("wall_ms", "cpu_ms", "peak_rss_kb", "output_bytes"):
+            if verdict == "all":
+                cursor.execute(f"SELECT {metric} FROM submission_stats WHERE question_id = ? AND {metric} IS NOT NULL ORDER BY {metric}",
+                               (question_id,))
+            else:
+                cursor.execute(f"SELECT {metric} FROM submission_stats WHERE question_id = ? AND verdict = ? AND {metric} IS NOT NULL ORDER BY {metric}",
+                               (question_id, verdict))
+            distributions[metric] = percentiles([row[0] for row in cursor.fetchall()])
+        conn.close()
+
+    return {
+        "question_id": question_id,
+        "time_limit_ms": question["time_limit_ms"] or DEFAULT_TIME_LIMIT_MS,
+        "memory_limit_mb": question["memory_limit_mb"] or DEFAULT_MEMORY_LIMIT_MB,
+        "verdicts": verdict_counts,
+        "distribution": distributions,
+    }
+
+@router.get("/technical_test/similarity/{question_id}")
+def get_similar_submissions(question_id: int, threshold: float = similarity.SIMILARITY_THRESHOLD,
+                            admin: User = Depends(require_admin)):
+    """Pairs of accepted submissions to a question that look copied, most similar first."""
+    if not get_question_by_id(question_id):
+        raise HTTPException(status_code=404, detail="Question not found")
+    pairs = similarity.similar_pairs(question_id, threshold)
+    return {"question_id": question_id, "threshold": threshold, "pairs": pairs}
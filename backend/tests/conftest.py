@@ -0,0 +1,80 @@
+"""
+Tests import the backend modules directly and run against throwaway SQLite
+files: the modules open nextstep.db relative to the working directory, so
+the run moves into a temporary one before any of them is imported.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_configure(config):
+    # Not at import time: pytest still resolves testpaths against the working directory after loading this file
+    os.chdir(tempfile.mkdtemp(prefix="nextstep-tests-"))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    import models
+    from database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine on a fresh event loop, then drop the pooled aiosqlite connections tied to it."""
+
+    from database import async_engine
+
+    def runner(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await async_engine.dispose()
+
+        return asyncio.run(main())
+
+    return runner
+
+
+@pytest.fixture
+def make_user():
+    """Insert users with a given gap_analysis document; removed again after the test."""
+    created = []
+
+    def make(username, gap_analysis=None, technical_test=None):
+        conn = sqlite3.connect("nextstep.db")
+        with conn:
+            conn.execute(
+                "INSERT INTO users (fullname, username, email, password, gap_analysis, technical_test, version) "
+                "VALUES (?, ?, ?, 'x', ?, ?, 0)",
+                (username, username, f"{username}@example.com",
+                 json.dumps(json.dumps(gap_analysis)) if gap_analysis is not None else None,
+                 json.dumps(technical_test) if technical_test is not None else None),
+            )
+        conn.close()
+        created.append(username)
+        return username
+
+    yield make
+    conn = sqlite3.connect("nextstep.db")
+    with conn:
+        conn.executemany("DELETE FROM users WHERE username = ?", [(u,) for u in created])
+    conn.close()
+
+
+def stored_gap_analysis(username):
+    """users.gap_analysis decoded the way the API stores it (JSON text inside the JSON column)."""
+    conn = sqlite3.connect("nextstep.db")
+    raw = conn.execute("SELECT gap_analysis FROM users WHERE username = ?", (username,)).fetchone()[0]
+    conn.close()
+    return json.loads(json.loads(raw)) if raw else None
@@ -0,0 +1,136 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+import concurrency
+from concurrency import MAX_RETRIES, get_conflict_stats, retry_sync, run_with_retry
+from database import AsyncSessionLocal
+from models import User
+from technical_test import modify_user_progress
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(concurrency, "BASE_BACKOFF_SECONDS", 0)
+
+
+def counters(operation):
+    return get_conflict_stats().get(operation, {"attempts": 0, "conflicts": 0, "exhausted": 0})
+
+
+def bump_version(username):
+    """Another writer commits to the user's row."""
+    conn = sqlite3.connect("nextstep.db")
+    with conn:
+        conn.execute("UPDATE users SET version = version + 1 WHERE username = ?", (username,))
+    conn.close()
+
+
+def stored_progress(username):
+    conn = sqlite3.connect("nextstep.db")
+    raw = conn.execute("SELECT technical_test FROM users WHERE username = ?", (username,)).fetchone()[0]
+    conn.close()
+    return json.loads(raw)
+
+
+def test_retry_sync_gives_up_with_409():
+    before = counters("always_losing")
+
+    with pytest.raises(HTTPException) as raised:
+        retry_sync("always_losing", lambda: (False, None))
+
+    assert raised.value.status_code == 409
+    after = counters("always_losing")
+    assert after["attempts"] == before["attempts"] + MAX_RETRIES
+    assert after["conflicts"] == before["conflicts"] + MAX_RETRIES
+    assert after["exhausted"] == before["exhausted"] + 1
+
+
+def test_concurrent_progress_writers_keep_both_updates(make_user):
+    username = make_user("two_judges", technical_test={"solved": 0, "milestone": "Not Started", "solved_ids": []})
+    both_read = threading.Barrier(2)
+
+    def solve(question_id):
+        rounds = []
+
+        def compute(progress):
+            rounds.append(question_id)
+            if len(rounds) == 1:
+                both_read.wait(timeout=5)  # Both threads hold the same version before either writes
+            return {**progress, "solved_ids": progress["solved_ids"] + [question_id]}
+
+        return compute
+
+    first = threading.Thread(target=modify_user_progress, args=(username, "solve_race", solve(1)))
+    second = threading.Thread(target=modify_user_progress, args=(username, "solve_race", solve(2)))
+    conflicts_before = counters("solve_race")["conflicts"]
+    first.start(), second.start()
+    first.join(), second.join()
+
+    assert sorted(stored_progress(username)["solved_ids"]) == [1, 2]
+    assert counters("solve_race")["conflicts"] == conflicts_before + 1
+
+
+def test_modify_user_progress_gives_up_with_409(make_user):
+    username = make_user("contended_progress", technical_test={"solved": 0, "milestone": "Not Started"})
+
+    def compute(progress):
+        bump_version(username)  # Someone else always writes between our read and our UPDATE
+        return {"solved": progress["solved"] + 1, "milestone": "Beginner"}
+
+    with pytest.raises(HTTPException) as raised:
+        modify_user_progress(username, "contended_progress", compute)
+
+    assert raised.value.status_code == 409
+    assert stored_progress(username) == {"solved": 0, "milestone": "Not Started"}
+
+
+def test_run_with_retry_recovers_from_a_stale_orm_write(run, make_user):
+    username = make_user("orm_one_conflict")
+    before = counters("orm_one_conflict")
+    calls = []
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            async def attempt():
+                user = (await db.execute(select(User).filter(User.username == username))).scalar_one()
+                calls.append(user.version)
+                if len(calls) == 1:
+                    bump_version(username)
+                user.non_technical_test = json.dumps({"type": "INTJ"})
+                await db.flush()
+
+            await run_with_retry(db, "orm_one_conflict", attempt)
+
+    run(scenario())
+
+    assert calls == [0, 1]  # The retry re-read the winner's version
+    assert counters("orm_one_conflict")["conflicts"] == before["conflicts"] + 1
+    conn = sqlite3.connect("nextstep.db")
+    assert conn.execute("SELECT version FROM users WHERE username = ?", (username,)).fetchone()[0] == 2
+    conn.close()
+
+
+def test_run_with_retry_gives_up_with_409(run, make_user):
+    username = make_user("orm_always_stale")
+    before = counters("orm_always_stale")
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            async def attempt():
+                user = (await db.execute(select(User).filter(User.username == username))).scalar_one()
+                bump_version(username)
+                user.non_technical_test = json.dumps({"type": "ENFP"})
+                await db.flush()
+
+            await run_with_retry(db, "orm_always_stale", attempt)
+
+    with pytest.raises(HTTPException) as raised:
+        run(scenario())
+
+    assert raised.value.status_code == 409
+    assert counters("orm_always_stale")["exhausted"] == before["exhausted"] + 1
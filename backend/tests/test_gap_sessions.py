@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event
+
+import gap_sessions as gap_sessions_module
+from concurrency import get_conflict_stats
+from database import AsyncSessionLocal, async_engine
+from gap_sessions import FLUSH_OPERATION, GapSessionStore
+from gap_test import INITIAL_TOPIC_RATING, TOPICS, merge_gap_analysis
+
+from conftest import stored_gap_analysis
+
+
+def fresh_test():
+    return {
+        "topic_ratings": {topic: INITIAL_TOPIC_RATING for topic in TOPICS},
+        "average_elo": INITIAL_TOPIC_RATING,
+        "prev_topics": [],
+        "answered_questions": [],
+        "concept_mastery": {},
+    }
+
+
+def worker():
+    """A GapSessionStore as one API worker process would have it."""
+    store = GapSessionStore()
+    store.merge = merge_gap_analysis
+    return store
+
+
+async def answer(store, username, question_id, topic, delta, concept=None):
+    """What next_gap_question + evaluate_gap_question do to a live session."""
+    async with AsyncSessionLocal() as db:
+        session = await store.get(db, username)
+    async with session.lock:
+        session.data["answered_questions"].append(question_id)
+        session.data["topic_ratings"][topic] += delta
+        if concept:
+            stats = session.data["concept_mastery"].setdefault(concept, {"attempts": 0, "correct": 0})
+            stats["attempts"] += 1
+            stats["correct"] += int(delta > 0)
+        store.updated(session)
+    return session
+
+
+def test_concurrent_workers_keep_both_answers(run, make_user):
+    username = make_user("two_workers", fresh_test())
+    first, second = worker(), worker()
+
+    async def scenario():
+        # Both workers load the same document before either writes back
+        await answer(first, username, 11, "Databases", +50, concept="Indexes")
+        await answer(second, username, 12, "Databases", -30, concept="Indexes")
+        await asyncio.gather(first.flush(), second.flush())
+
+    run(scenario())
+
+    stored = stored_gap_analysis(username)
+    assert sorted(stored["answered_questions"]) == [11, 12]
+    assert stored["topic_ratings"]["Databases"] == INITIAL_TOPIC_RATING + 50 - 30
+    assert stored["concept_mastery"]["Indexes"] == {"attempts": 2, "correct": 1}
+    assert first.counters["conflicts_merged"] + second.counters["conflicts_merged"] == 1
+
+
+def test_worker_with_stale_copy_continues_from_the_merged_document(run, make_user):
+    username = make_user("stale_worker", fresh_test())
+    first, second = worker(), worker()
+
+    async def scenario():
+        await answer(first, username, 21, "Operating Systems", +40)
+        await answer(second, username, 22, "Operating Systems", +10)
+        await first.flush()
+        await second.flush()  # Conflicts with first's write and merges
+        # first's copy is clean, so its next request re-reads what second stored
+        session = await answer(first, username, 23, "Operating Systems", +5)
+        await first.flush()
+        return session.data
+
+    data = run(scenario())
+
+    assert data["answered_questions"] == [21, 22, 23]
+    assert stored_gap_analysis(username)["topic_ratings"]["Operating Systems"] == INITIAL_TOPIC_RATING + 55
+
+
+def test_dirty_session_survives_get_and_is_written_by_flush_idle(run, make_user, monkeypatch):
+    username = make_user("idle_user", fresh_test())
+    store = worker()
+
+    async def scenario():
+        await answer(store, username, 31, "Databases", +20)
+        # A later request on this worker must see the unflushed answer, not the stored document
+        async with AsyncSessionLocal() as db:
+            session = await store.get(db, username)
+        assert session.dirty
+        assert session.data["answered_questions"] == [31]
+        assert stored_gap_analysis(username)["answered_questions"] == []
+
+        monkeypatch.setattr(gap_sessions_module, "SESSION_IDLE_SECONDS", 0)
+        await store.flush_idle()
+
+    run(scenario())
+
+    assert stored_gap_analysis(username)["answered_questions"] == [31]
+    assert username not in store.sessions  # Idle: written back, then dropped
+
+
+def test_failed_flush_keeps_the_session_dirty(run, make_user, monkeypatch):
+    username = make_user("failed_flush", fresh_test())
+    store = worker()
+
+    async def failing_write(db, session, raw):
+        raise RuntimeError("disk full")
+
+    async def scenario():
+        session = await answer(store, username, 41, "Databases", +10)
+        monkeypatch.setattr(store, "_write", failing_write)
+        with pytest.raises(RuntimeError):
+            await store.flush()
+        assert session.dirty
+        monkeypatch.undo()
+        await store.flush()
+
+    run(scenario())
+
+    assert stored_gap_analysis(username)["answered_questions"] == [41]
+
+
+def test_flush_gives_up_after_merge_retries(run, make_user):
+    username = make_user("always_conflicting", fresh_test())
+    store = worker()
+    exhausted_before = get_conflict_stats().get(FLUSH_OPERATION, {}).get("exhausted", 0)
+
+    def other_writer(conn, cursor, statement, parameters, context, executemany):
+        # Another worker changes the document right before every compare-and-swap
+        if statement.startswith("UPDATE users SET gap_analysis"):
+            cursor.execute("UPDATE users SET gap_analysis = gap_analysis || ' ' WHERE username = ?", (username,))
+
+    async def scenario():
+        session = await answer(store, username, 51, "Databases", +10)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", other_writer)
+        try:
+            with pytest.raises(RuntimeError, match="kept conflicting"):
+                await store.flush()
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", other_writer)
+        return session
+
+    session = run(scenario())
+
+    assert session.dirty  # Nothing lost: the next flush tries again
+    assert get_conflict_stats()[FLUSH_OPERATION]["exhausted"] == exhausted_before + 1
+    assert stored_gap_analysis(username)["answered_questions"] == []  # The failed flush committed nothing
@@ -0,0 +1,106 @@
+import pytest
+
+from output_compare import PREVIEW_CHARS, make_comparator
+
+# (mode, expected, output, matched)
+CASES = [
+    ("exact", "1\n2\n", "1\n2\n", True),
+    ("exact", "1\n2", "1   \n2\t\n", True),  # Trailing spaces on a line
+    ("exact", "1\n2", "\n\n1\n2\n\n\n", True),  # Leading/trailing blank output
+    ("exact", "1\n2", "1\r\n2\r\n", True),  # Windows line endings
+    ("exact", "1\n2", "1\r2", True),
+    ("exact", "a b", "a  b", False),  # Inner spaces count
+    ("exact", "1\n2", " 1\n2", True),  # Leading whitespace before the first output is dropped
+    ("exact", "1\n2", "1\n 2", False),
+    ("exact", "1\n2", "1\n", False),
+    ("exact", "1\n2", "1\n2\n3", False),
+    ("exact", "", "", True),
+    ("exact", "1", "", False),
+    ("tokens", "1 2 3", "1\n2\n3\n", True),
+    ("tokens", "1 2 3", "1 2", False),
+    ("tokens", "1 2", "1 2 3", False),
+    ("tokens", "12", "1 2", False),
+    ("whitespace", "a b c", "abc", True),
+    ("whitespace", "abc", "a\r\nb\tc  ", True),
+    ("whitespace", "abc", "abd", False),
+    ("whitespace", "abc", "ab", False),
+    ("float", "0.333333", "0.3333333333", True),
+    ("float", "1000000", "1000000.5", True),  # Relative for large values
+    ("float", "0.5", "0.50001", False),
+    ("float", "1.0 2.0", "1 2", True),
+    ("float", "nan", "nan", True),  # Same token, compared as text
+    ("float", "1.0", "nan", False),
+    ("float", "nan", "NaN", False),
+    ("float", "abc 1.5", "abc 1.5000001", True),
+    ("float", "abc", "abd", False),
+]
+
+
+def run_comparator(comparator, chunks):
+    for chunk in chunks:
+        if not comparator.feed(chunk):
+            break
+    return comparator.finish()
+
+
+@pytest.mark.parametrize("mode, expected, output, matched", CASES)
+@pytest.mark.parametrize("chunk_size", [None, 1, 3], ids=["whole", "chars", "threes"])
+def test_compare_modes(mode, expected, output, matched, chunk_size):
+    size = chunk_size or max(len(output), 1)
+    chunks = [output[i:i + size] for i in range(0, len(output), size)]
+
+    result, reason = run_comparator(make_comparator(expected, mode), chunks)
+
+    assert result is matched, reason
+    assert (reason is None) is matched
+
+
+def test_crlf_split_across_chunks():
+    comparator = make_comparator("1\n2\n3")
+
+    assert run_comparator(comparator, ["1\r", "\n2\r", "\n3"]) == (True, None)
+    assert comparator.line_no == 3  # "\r" + "\n" was one line break, not two
+
+
+def test_float_epsilon_is_configurable():
+    assert run_comparator(make_comparator("1.0", "float", epsilon=0.1), ["1.05"]) == (True, None)
+    assert run_comparator(make_comparator("1.0", "float", epsilon=0.01), ["1.05"])[0] is False
+
+
+@pytest.mark.parametrize("mode", ["exact", "tokens", "whitespace", "float"])
+def test_output_cap(mode):
+    comparator = make_comparator("x\n" * 10, mode, output_limit=20)
+
+    assert comparator.feed("x\n" * 10) is True  # Exactly at the cap is fine
+    assert comparator.feed("x") is False
+    assert comparator.finish() == (False, "Output limit exceeded")
+    assert comparator.feed("x\n") is False  # Nothing more is consumed
+
+
+@pytest.mark.parametrize("mode", ["exact", "tokens", "whitespace"])
+def test_mismatch_stops_early(mode):
+    comparator = make_comparator("a\nb\nc\n", mode)
+
+    assert comparator.feed("a\nz") is False
+    assert comparator.feed("ignored") is False
+    assert comparator.finish()[0] is False
+
+
+def test_exact_trailing_spaces_past_the_line_stay_bounded():
+    comparator = make_comparator("ok")
+
+    for _ in range(1000):
+        assert comparator.feed(" " * 100)  # Leading whitespace before output
+    comparator.feed("ok")
+    for _ in range(1000):
+        assert comparator.feed(" " * 100)
+
+    assert len(comparator.partial) <= len("ok")
+    assert comparator.finish() == (True, None)
+
+
+def test_preview_is_capped():
+    comparator = make_comparator("x")
+    comparator.feed("y" * 10_000)
+
+    assert len(comparator.preview) == PREVIEW_CHARS
@@ -0,0 +1,211 @@
+import random
+import sqlite3
+import threading
+from collections import Counter
+
+import pytest
+from sqlalchemy import or_, select
+
+import database
+import sharding
+from models import GapTestQuestion, User
+from sharding import (claim_emails, create_email_index, jump_hash, merged_rows, release_emails,
+                      scatter_gather, shard_for, shards_for_statement, usernames_in)
+
+SHARDS = 4
+
+
+@pytest.fixture
+def four_shards(monkeypatch):
+    """Route as if SHARD_COUNT were 4 (shard_for's default count is bound at import)."""
+    real_shard_for = sharding.shard_for
+    monkeypatch.setattr(sharding, "SHARD_COUNT", SHARDS)
+    monkeypatch.setattr(sharding, "SHARD_IDS", [str(index) for index in range(SHARDS)])
+    monkeypatch.setattr(sharding, "shard_for", lambda username, count=SHARDS: real_shard_for(username, count))
+
+
+# ----------------------- Hashing -----------------------
+
+@pytest.mark.parametrize("key, buckets, bucket", [
+    # Reference values of the jump consistent hash paper's C++ implementation
+    (1, 1, 0),
+    (42, 57, 43),
+    (0xDEAD10CC, 1, 0),
+    (0xDEAD10CC, 666, 361),
+    (256, 1024, 520),
+])
+def test_jump_hash_reference_values(key, buckets, bucket):
+    assert jump_hash(key, buckets) == bucket
+
+
+@pytest.mark.parametrize("username, shard", [("alice", 1), ("bob", 7), ("carol", 3), ("dave", 2)])
+def test_shard_for_is_stable(username, shard):
+    # Changing these strands every existing user on the wrong shard
+    assert shard_for(username, 8) == shard
+
+
+def test_one_shard_is_the_old_layout():
+    assert {shard_for(f"user{i}", 1) for i in range(1000)} == {0}
+
+
+@pytest.mark.parametrize("buckets", [2, 3, 5, 8, 13])
+def test_jump_hash_spreads_keys_evenly(buckets):
+    rng = random.Random(buckets)
+    keys = [rng.getrandbits(64) for _ in range(20_000)]
+    counts = Counter(jump_hash(key, buckets) for key in keys)
+
+    assert set(counts) == set(range(buckets))
+    expected = len(keys) / buckets
+    assert all(abs(count - expected) < expected * 0.1 for count in counts.values())
+
+
+@pytest.mark.parametrize("buckets", [1, 2, 3, 7, 15])
+def test_growing_by_one_shard_moves_only_to_the_new_shard(buckets):
+    usernames = [f"user{i}" for i in range(20_000)]
+    before = {u: shard_for(u, buckets) for u in usernames}
+    after = {u: shard_for(u, buckets + 1) for u in usernames}
+
+    moved = [u for u in usernames if before[u] != after[u]]
+    assert all(after[u] == buckets for u in moved)
+    assert abs(len(moved) / len(usernames) - 1 / (buckets + 1)) < 0.02
+
+
+# ----------------------- Routing -----------------------
+
+@pytest.mark.parametrize("where, usernames", [
+    (User.username == "alice", {"alice"}),
+    (User.username.in_(["alice", "bob"]), {"alice", "bob"}),
+    ((User.username.in_(["alice", "bob"])) & (User.username == "bob"), {"bob"}),
+    ((User.username == "alice") & (User.email == "a@example.com"), {"alice"}),
+    (or_(User.username == "alice", User.username == "bob"), None),
+    (User.email == "a@example.com", None),
+    (User.username != "alice", None),
+])
+def test_usernames_in(where, usernames):
+    assert usernames_in(select(User).where(where).whereclause) == usernames
+
+
+def test_statements_route_to_their_users_shards(four_shards):
+    names = ["alice", "bob", "carol", "dave"]
+    pinned = select(User).where(User.username.in_(names))
+
+    assert shards_for_statement(pinned) == sorted({str(sharding.shard_for(u)) for u in names})
+    assert shards_for_statement(select(User).where(User.username == "bob")) == [str(sharding.shard_for("bob"))]
+    assert shards_for_statement(select(User).where(User.email == "a@example.com")) == ["0", "1", "2", "3"]
+    assert shards_for_statement(select(User).where(User.username.in_([]))) == ["0"]
+    assert len(shards_for_statement(select(GapTestQuestion))) == 1  # Replicated: any one shard
+    forced = shards_for_statement(select(User), {"shard_username": "carol"})
+    assert forced == [str(sharding.shard_for("carol"))]
+
+
+# ----------------------- Merging -----------------------
+
+def sort_key(row):
+    return -row[0], row[1]
+
+
+def partials():
+    """Per-shard results of an ORDER BY score DESC, username query."""
+    rows = [(random.Random(i).randint(0, 50), f"user{i:03}") for i in range(200)]
+    by_shard = [[] for _ in range(SHARDS)]
+    for score, username in rows:
+        by_shard[sharding.shard_for(username)].append((score, username))
+    return [sorted(shard_rows, key=sort_key) for shard_rows in by_shard], sorted(rows, key=sort_key)
+
+
+class FakeSession:
+    """Answers execute() with the rows of the shard in bind_arguments."""
+
+    def __init__(self, by_shard):
+        self.by_shard = by_shard
+
+    def execute(self, statement, bind_arguments):
+        return iter(self.by_shard[int(bind_arguments["shard_id"])])
+
+
+class FakeAsyncSession(FakeSession):
+    class Result(list):
+        def all(self):
+            return list(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, bind_arguments):
+        return self.Result(self.by_shard[int(bind_arguments["shard_id"])])
+
+
+def test_merged_rows_keeps_the_global_order(four_shards):
+    by_shard, expected = partials()
+
+    assert list(merged_rows(FakeSession(by_shard), select(User), key=sort_key)) == expected
+
+
+@pytest.mark.parametrize("limit", [None, 1, 10, 500])
+def test_scatter_gather_merges_and_limits(run, four_shards, monkeypatch, limit):
+    by_shard, expected = partials()
+    monkeypatch.setattr(database, "AsyncSessionLocal", lambda: FakeAsyncSession(by_shard))
+
+    rows = run(scatter_gather(None, select(User), key=sort_key, limit=limit))
+
+    assert rows == expected[:limit]
+
+
+# ----------------------- Email claims -----------------------
+
+@pytest.fixture
+def email_index():
+    create_email_index()
+    yield
+    conn = sqlite3.connect("nextstep.db")
+    with conn:
+        conn.execute("DELETE FROM user_emails")
+    conn.close()
+
+
+def test_one_email_goes_to_one_user(email_index):
+    winners = []
+
+    def claim(index):
+        if claim_emails([("Same@Example.com", f"racer{index}")]):
+            winners.append(index)
+
+    threads = [threading.Thread(target=claim, args=(index,)) for index in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(winners) == 1
+    assert claim_emails([("same@example.com", f"racer{winners[0]}")]) == {"same@example.com"}  # Idempotent
+
+
+def test_released_email_can_be_claimed_again(email_index):
+    assert claim_emails([("a@example.com", "first")]) == {"a@example.com"}
+    assert claim_emails([("A@EXAMPLE.COM", "second")]) == set()
+
+    release_emails([("a@example.com", "second")])  # Not its claim: no effect
+    assert claim_emails([("a@example.com", "second")]) == set()
+    release_emails([("A@example.com", "first")])
+    assert claim_emails([("a@example.com", "second")]) == {"a@example.com"}
+
+
+def test_bulk_claims_report_each_email(email_index):
+    claim_emails([("taken@example.com", "owner")])
+    pairs = [(f"new{i}@example.com", f"new{i}") for i in range(sharding.EMAIL_CLAIM_CHUNK + 5)]
+
+    claimed = claim_emails(pairs + [("taken@example.com", "latecomer")])
+
+    assert claimed == {email for email, _ in pairs}
+
+
+def test_email_index_backfills_existing_users(email_index, make_user):
+    make_user("backfilled")
+
+    create_email_index()
+
+    assert claim_emails([("backfilled@example.com", "someone_else")]) == set()
+    assert claim_emails([("BACKFILLED@example.com", "backfilled")]) == {"backfilled@example.com"}
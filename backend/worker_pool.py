@@ -0,0 +1,144 @@
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+
+# Languages run on local pre-warmed workers instead of Piston, e.g. "python".
+# Off by default: local workers rely on rlimits and a throwaway working directory,
+# not a container, so only enable this where that level of isolation is acceptable.
+LOCAL_RUNNER_LANGUAGES = [l.strip().lower() for l in os.getenv("LOCAL_RUNNER_LANGUAGES", "").split(",") if l.strip()]
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "4"))  # Warm workers per language
+WORKER_MAX_RUNS = int(os.getenv("WORKER_MAX_RUNS", "500"))  # Recycle a worker after this many submissions
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "200"))  # ...or once its own RSS grows past this
+
+RUN_TIMEOUT_SECONDS = 3
+RUN_MEMORY_MB = 256
+OUTPUT_LIMIT_BYTES = 1024 * 1024
+
+# Worker command per language, plus the names Piston accepts for it
+WORKER_COMMANDS = {
+    "python": [sys.executable, "-u", WORKER_SCRIPT],
+}
+LANGUAGE_ALIASES = {"python3": "python", "py": "python"}
+
+
+class WorkerError(Exception):
+    """The worker died or broke protocol; the submission was not judged."""
+
+
+class Worker:
+    """One pre-warmed worker process, speaking the sandbox_worker.py JSON-lines protocol."""
+
+    def __init__(self, command):
+        self.runs = 0
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+            start_new_session=True,
+        )
+
+    def execute(self, request, on_output):
+        """
+        Run one submission, passing output chunks to on_output(chunk) as they arrive.
+        If on_output returns False the run is stopped early. Returns the worker's final metrics.
+        """
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+            stopping = False
+            for line in self.process.stdout:
+                message = json.loads(line)
+                if message.get("done"):
+                    self.runs += 1
+                    return message
+                if not stopping and on_output(message["chunk"]) is False:
+                    # Ask the worker to kill the run, then read up to its "done" line
+                    self.process.stdin.write("stop\n")
+                    self.process.stdin.flush()
+                    stopping = True
+        except (OSError, ValueError) as e:
+            raise WorkerError(str(e))
+        raise WorkerError("worker exited mid-run")
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def stop(self):
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of warm workers for one language.
+
+    Workers are reused across submissions (each run is a fresh fork inside the worker);
+    a worker is replaced after WORKER_MAX_RUNS runs, when its RSS passes WORKER_MAX_RSS_MB,
+    or when it fails mid-run.
+    """
+
+    def __init__(self, language, size=WORKER_POOL_SIZE, max_runs=WORKER_MAX_RUNS, max_rss_mb=WORKER_MAX_RSS_MB):
+        self.language = language
+        self.command = WORKER_COMMANDS[language]
+        self.max_runs = max_runs
+        self.max_rss_kb = max_rss_mb * 1024
+        self.idle = queue.Queue()
+        self.recycled = 0
+        for _ in range(size):
+            self.idle.put(Worker(self.command))
+
+    def _release(self, worker, metrics):
+        if metrics is None or not worker.alive() or worker.runs >= self.max_runs \
+                or metrics.get("worker_rss_kb", 0) > self.max_rss_kb:
+            worker.stop()
+            self.recycled += 1
+            # Popen returns immediately; the replacement warms up while it sits idle
+            worker = Worker(self.command)
+        self.idle.put(worker)
+
+    def run(self, code, stdin, on_output, timeout=RUN_TIMEOUT_SECONDS, memory_mb=RUN_MEMORY_MB, output_limit=OUTPUT_LIMIT_BYTES):
+        """Run a submission on a warm worker; see Worker.execute. Raises WorkerError if the worker failed."""
+        worker = self.idle.get()
+        metrics = None
+        try:
+            request = {"code": code, "stdin": stdin, "timeout": timeout, "memory_mb": memory_mb, "output_limit": output_limit}
+            metrics = worker.execute(request, on_output)
+            return metrics
+        finally:
+            # metrics stays None if the worker failed; its protocol state is unknown, so it gets replaced
+            self._release(worker, metrics)
+
+    def shutdown(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().stop()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(language):
+    """Return the warm worker pool for a language, or None if it should go to Piston."""
+    language = LANGUAGE_ALIASES.get(language.lower(), language.lower())
+    enabled = [LANGUAGE_ALIASES.get(l, l) for l in LOCAL_RUNNER_LANGUAGES]
+    if language not in enabled or language not in WORKER_COMMANDS or not hasattr(os, "fork"):
+        return None
+    with _pools_lock:
+        if language not in _pools:
+            _pools[language] = WorkerPool(language)
+        return _pools[language]
+
+def shutdown_pools():
+    """Stop all worker processes (called on app shutdown)."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown()
+        _pools.clear()
@@ -4,10 +4,30 @@ import "./Dashboard.css";
 
 const backendUrl = process.env.REACT_APP_API_URL || "https://fuzzy-space-engine-77w9qxrqq73xq96-8000.app.github.dev";
 
+// Gap analysis, technical progress, personality type and final result in one request.
+// The last response is kept with its ETag, so an unchanged dashboard comes back as an empty 304.
+const fetchDashboard = async (username) => {
+  const cacheKey = `dashboard:${username}`;
+  const cached = JSON.parse(localStorage.getItem(cacheKey) || "null");
+  const response = await fetch(`${backendUrl}/results/dashboard/${username}`, {
+    headers: cached ? { "If-None-Match": cached.etag } : {},
+    cache: "no-store", // Revalidation is done here; keep the browser cache from answering the 304 itself
+  });
+
+  if (response.status === 304 && cached) return cached.body;
+  if (!response.ok) throw new Error(`Server responded with ${response.status}`);
+
+  const body = await response.json();
+  const etag = response.headers.get("ETag");
+  if (etag) localStorage.setItem(cacheKey, JSON.stringify({ etag, body }));
+  return body;
+};
+
 function Dashboard() {
   const navigate = useNavigate();
   const [loading, setLoading] = useState(true);
   const [username, setUsername] = useState("");
+  const [summary, setSummary] = useState(null);
 
   useEffect(() => {
     const verifyToken = async () => {
@@ -28,6 +48,10 @@ function Dashboard() {
         const userData = await response.json();
         setUsername(userData.username);
         setLoading(false);
+
+        fetchDashboard(userData.username)
+          .then(setSummary)
+          .catch((err) => console.error("Error fetching dashboard:", err));
       } catch (error) {
         console.error("Token verification failed:", error);
         localStorage.removeItem("token");
@@ -63,6 +87,14 @@ function Dashboard() {
       {/* Main Content */}
       <div className="dashboard-content">
         <h2 className="dashboard-title">Dashboard</h2>
+        {summary && (
+          <div className="dashboard-summary">
+            <p><strong>Average Elo:</strong> {summary.gap_analysis ? summary.gap_analysis.average_elo : "Not taken"}</p>
+            <p><strong>Technical Test:</strong> {summary.technical_test ? `${summary.technical_test.solved} / 15 solved` : "Not taken"}</p>
+            <p><strong>Personality Type:</strong> {summary.personality_type || "Not taken"}</p>
+            <p><strong>Final Result:</strong> {summary.final_result ? "Ready" : "Not generated"}</p>
+          </div>
+        )}
         <div className="dashboard-grid">
           <button onClick={() => navigate("/gap-test")} className="dashboard-card">
             Gap Analysis Test
@@ -39,12 +39,28 @@ const GapTest = () => {
     }
   };
 
+  // Saves the test on the server (it is kept in memory while in progress), then shows the summary
+  const finishGapTest = async () => {
+    const token = localStorage.getItem("token");
+    try {
+      await fetch(`${backendUrl}/gap_test/end_gap_test`, {
+        method: "POST",
+        headers: {
+          Authorization: `Bearer ${token}`,
+        },
+      });
+    } catch (error) {
+      console.error("❌ Error saving test:", error);
+    }
+    navigate("/gap-result-summary");
+  };
+
   const loadNextQuestion = async () => {
     console.log(`📌 Loading next question... (Current count: ${questionCount})`);
 
     if (questionCount >= TOTAL_QUESTIONS) {
       console.log("✅ All questions answered. Navigating to results...");
-      navigate("/gap-result-summary");
+      finishGapTest();
       return;
     }
 
@@ -66,7 +82,7 @@ const GapTest = () => {
 
       if (!questionData || !questionData.id) {
         console.log("🚨 No more questions available! Navigating to results...");
-        navigate("/gap-result-summary");
+        finishGapTest();
         return;
       }
 
@@ -109,7 +125,7 @@ const GapTest = () => {
         console.log(`🔢 Updated question count: ${newCount}`);
         if (newCount >= TOTAL_QUESTIONS) {
           console.log("🏁 Reached total questions, navigating to results...");
-          navigate("/gap-result-summary");
+          finishGapTest();
         }
         return newCount;
       });